@@ -8,4 +8,9 @@ from . import pos_order_line
 from . import res_config_settings
 from . import migration
 from . import ingredient_selection_wizard
-from . import pos_config 
\ No newline at end of file
+from . import pos_config
+from . import pos_credit_outbox 
+from . import pos_distributeur_settings
+from . import plu_index
+from . import catalog_import
+from . import pos_credit_log
\ No newline at end of file
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import json
+import logging
+import os
+import time
+import psycopg2
+from odoo import models, api, _
+from odoo.exceptions import UserError, ValidationError
+from odoo.tools import split_every
+from .pos_distributeur_settings import _to_bool, _to_float, _to_int
+
+_logger = logging.getLogger(__name__)
+
+# Contexte des create/write faits par l'import: les produits sautent leur
+# synchronisation par enregistrement (catégorie POS, template, index PLU)
+BULK_IMPORT_CONTEXT = 'pos_distributeur_bulk_import'
+
+DEFAULT_CHUNK_SIZE = 500
+
+# Colonnes acceptées -> conversion
+PRODUCT_COLUMNS = {
+    'name': str,
+    'default_code': str,
+    'barcode': str,
+    'list_price': float,
+    'volume_distributeur': float,
+    'credits_per_serving': int,
+    'is_distributeur_boisson': bool,
+    'needs_distributor': bool,
+    'is_combo_product': bool,
+    'is_ingredient_only': bool,
+    'available_in_pos': bool,
+}
+OPTION_COLUMNS = {
+    'name': str,
+    'price_extra': float,
+    'sequence': int,
+    'volume_distributeur': float,
+    'credits_per_serving': int,
+    'active': bool,
+}
+
+CATALOG_KINDS = ('products', 'options', 'recipes')
+
+
+def iter_catalog_rows(stream, fmt=None):
+    """
+    Lit un fichier de catalogue ligne à ligne
+
+    Formats: csv (en-tête), jsonl (un objet par ligne) ou json (tableau
+    d'objets, lu en une fois). Pour une recette en CSV, les PLU des
+    ingrédients sont séparés par '|'.
+
+    Yields:
+        tuple: (numéro de ligne, dict)
+    """
+    if fmt is None:
+        fmt = os.path.splitext(getattr(stream, 'name', '') or '')[1].lstrip('.').lower() or 'csv'
+    if isinstance(stream, bytes):
+        stream = io.StringIO(stream.decode('utf-8-sig'))
+    elif isinstance(stream, str):
+        stream = io.StringIO(stream)
+    if fmt == 'csv':
+        for line_no, row in enumerate(csv.DictReader(stream), start=2):
+            yield line_no, {key.strip(): (value or '').strip() for key, value in row.items() if key}
+    elif fmt == 'jsonl':
+        for line_no, line in enumerate(stream, start=1):
+            if line.strip():
+                yield line_no, json.loads(line)
+    elif fmt == 'json':
+        for line_no, row in enumerate(json.load(stream), start=1):
+            yield line_no, row
+    else:
+        raise UserError(_("Format de catalogue inconnu: %s (csv, jsonl ou json)") % fmt)
+
+
+def _convert(value, kind):
+    if kind is bool:
+        return value if isinstance(value, bool) else _to_bool(value)
+    if kind is int:
+        return _to_int(value, None)
+    if kind is float:
+        return _to_float(value, None)
+    return str(value).strip() if value is not None else ''
+
+
+def _clean_values(row, columns):
+    vals = {}
+    for column, kind in columns.items():
+        if column in row and row[column] not in (None, ''):
+            value = _convert(row[column], kind)
+            if value is None:
+                raise ValueError(_("Valeur invalide pour %s: %s") % (column, row[column]))
+            vals[column] = value
+    return vals
+
+
+def _plu(value):
+    return str(value).strip() if value not in (None, '') else ''
+
+
+class PosDistributeurCatalogImport(models.AbstractModel):
+    """
+    Import groupé du catalogue distributeur (boissons, ingrédients, recettes)
+
+    Chaque lot de lignes est validé, rapproché par PLU en une requête puis
+    créé ou mis à jour en quelques écritures: les lignes inchangées ne sont
+    pas réécrites. Les produits sont créés sous BULK_IMPORT_CONTEXT (pas de
+    recherche de catégorie POS ni de synchronisation de template par
+    enregistrement); l'index PLU est vidé une fois à la fin. Un lot en
+    erreur (PLU en double, valeur refusée, contrainte SQL comme un code-barres
+    déjà utilisé) est annulé seul (savepoint) et ses lignes sont comptées
+    comme rejetées; les autres lots sont gardés.
+    """
+    _name = 'pos.distributeur.catalog.import'
+    _description = 'Import groupé du catalogue distributeur'
+
+    @api.model
+    def import_catalog(self, kind, rows, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Importe des produits, des options de combo ou des recettes
+
+        Args:
+            kind (str): 'products', 'options' ou 'recipes'
+            rows (iterable): dicts, ou tuples (numéro de ligne, dict) comme
+                renvoyés par iter_catalog_rows
+            chunk_size (int): Lignes par lot
+
+        Returns:
+            dict: success, message, created, updated, unchanged, rejected
+                (lignes des lots annulés), errors
+        """
+        if not self.env.user.has_group('point_of_sale.group_pos_manager'):
+            raise UserError(_('Accès refusé: import réservé aux responsables POS'))
+        if kind not in CATALOG_KINDS:
+            raise UserError(_("Type d'import inconnu: %s") % kind)
+        start = time.perf_counter()
+        import_chunk = getattr(self.with_context(**{BULK_IMPORT_CONTEXT: True}), f'_import_{kind}_chunk')
+        stats = {'created': 0, 'updated': 0, 'unchanged': 0, 'rejected': 0, 'errors': []}
+        seen = set()
+        numbered = (row if isinstance(row, tuple) else (index, row) for index, row in enumerate(rows, start=1))
+        for chunk in split_every(max(int(chunk_size or DEFAULT_CHUNK_SIZE), 1), numbered, list):
+            chunk = self._deduplicate_chunk(kind, chunk, seen, stats['errors'])
+            if not chunk:
+                continue
+            try:
+                with self.env.cr.savepoint():
+                    chunk_stats = import_chunk(chunk, stats['errors'])
+                    self.env.flush_all()
+            except (ValidationError, UserError, psycopg2.Error) as e:
+                self.env.invalidate_all(flush=False)
+                stats['rejected'] += len(chunk)
+                stats['errors'].append({'line': chunk[0][0], 'plu_code': '', 'message': _("Lot lignes %s-%s annulé: %s") % (chunk[0][0], chunk[-1][0], e)})
+                continue
+            for key in ('created', 'updated', 'unchanged'):
+                stats[key] += chunk_stats[key]
+
+        self.env['pos.distributeur.plu.index']._invalidate_index()
+        duration = time.perf_counter() - start
+        message = _("%(kind)s: %(created)s créé(s), %(updated)s mis à jour, %(unchanged)s inchangé(s), %(rejected)s rejeté(s), %(errors)s erreur(s) en %(duration).1f s") % {
+            'kind': kind, 'created': stats['created'], 'updated': stats['updated'], 'unchanged': stats['unchanged'],
+            'rejected': stats['rejected'], 'errors': len(stats['errors']), 'duration': duration,
+        }
+        _logger.info("📦 Import catalogue %s", message)
+        return dict(stats, success=not stats['errors'], message=message, duration=round(duration, 3))
+
+    def _deduplicate_chunk(self, kind, chunk, seen, errors):
+        """Écarte les lignes sans clé ou dont la clé est déjà apparue dans l'import"""
+        kept = []
+        for line_no, row in chunk:
+            if kind == 'options':
+                # Une option sans PLU propre est identifiée par (catégorie, produit)
+                key = _plu(row.get('plu_code')) or ((row.get('category') or '').strip(), _plu(row.get('product_plu')))
+                valid = bool(_plu(row.get('product_plu')))
+            else:
+                key = _plu(row.get('cocktail_plu' if kind == 'recipes' else 'plu_code'))
+                valid = bool(key)
+            if not valid:
+                errors.append({'line': line_no, 'plu_code': '', 'message': _("Ligne sans PLU")})
+                continue
+            if key in seen:
+                errors.append({'line': line_no, 'plu_code': key, 'message': _("PLU en double dans le fichier")})
+                continue
+            seen.add(key)
+            kept.append((line_no, row))
+        return kept
+
+    def _group_writes(self, records, vals_by_id):
+        """Une écriture par jeu de valeurs identique; retourne le nombre d'enregistrements modifiés"""
+        by_vals = {}
+        for record_id, vals in vals_by_id.items():
+            if vals:
+                by_vals.setdefault(json.dumps(vals, sort_keys=True, default=str), []).append(record_id)
+        for ids in by_vals.values():
+            records.browse(ids).write(vals_by_id[ids[0]])
+        return sum(len(ids) for ids in by_vals.values())
+
+    @staticmethod
+    def _changed_values(record, vals):
+        changed = {}
+        for name, value in vals.items():
+            current = record[name]
+            if record._fields[name].type == 'many2many':
+                if set(current.ids) != set(value[0][2]):
+                    changed[name] = value
+            elif current != value and not (current in (False, None, '') and value in (False, None, '')):
+                changed[name] = value
+        return changed
+
+    # ------------------------------------------------------------------
+    # Produits
+    # ------------------------------------------------------------------
+
+    def _import_products_chunk(self, chunk, errors):
+        Product = self.env['product.product']
+        vals_by_plu = {}
+        line_by_plu = {}
+        for line_no, row in chunk:
+            plu_code = _plu(row.get('plu_code'))
+            try:
+                vals = _clean_values(row, PRODUCT_COLUMNS)
+            except ValueError as e:
+                errors.append({'line': line_no, 'plu_code': plu_code, 'message': str(e)})
+                continue
+            if vals.get('is_combo_product'):
+                # Les crédits d'un cocktail viennent de ses ingrédients
+                vals.update(is_distributeur_boisson=True, needs_distributor=True, credits_per_serving=0)
+            vals_by_plu[plu_code] = vals
+            line_by_plu[plu_code] = line_no
+
+        existing = Product.with_context(active_test=False).search_fetch(
+            [('plu_code', 'in', list(vals_by_plu))], ['plu_code', 'product_tmpl_id', *PRODUCT_COLUMNS]
+        )
+        existing_by_plu = {product.plu_code: product for product in existing}
+
+        to_create = []
+        for plu_code, vals in vals_by_plu.items():
+            if plu_code in existing_by_plu:
+                continue
+            if not vals.get('name'):
+                errors.append({'line': line_by_plu[plu_code], 'plu_code': plu_code, 'message': _("Nom obligatoire pour un nouveau produit")})
+                continue
+            create_vals = {
+                'type': 'consu',
+                'is_distributeur_boisson': True,
+                'available_in_pos': not vals.get('is_ingredient_only'),
+                **vals,
+                'plu_code': plu_code,
+            }
+            to_create.append(create_vals)
+        changes = {
+            product.id: self._changed_values(product, vals_by_plu[plu_code])
+            for plu_code, product in existing_by_plu.items()
+        }
+        created = Product.create(to_create) if to_create else Product
+        updated = self._group_writes(Product, changes)
+
+        self._sync_product_templates(created | existing)
+        return {'created': len(created), 'updated': updated, 'unchanged': len(existing_by_plu) - updated}
+
+    def _sync_product_templates(self, products):
+        """Équivalent groupé de ProductProduct.create/write: combo sur le template et catégorie POS"""
+        for is_combo in (True, False):
+            templates = products.filtered(
+                lambda p: p.is_combo_product == is_combo and p.product_tmpl_id.is_combo_product != is_combo
+            ).product_tmpl_id
+            if templates:
+                templates.write({'is_combo_product': is_combo})
+        drinks_category = self.env['pos.category'].search([('name', 'ilike', 'Drinks')], limit=1)
+        if drinks_category:
+            templates = products.filtered(
+                lambda p: p.is_distributeur_boisson or p.needs_distributor
+            ).product_tmpl_id.filtered(lambda t: drinks_category not in t.pos_categ_ids)
+            if templates:
+                templates.write({'pos_categ_ids': [(4, drinks_category.id)]})
+
+    # ------------------------------------------------------------------
+    # Options de combo (ingrédients)
+    # ------------------------------------------------------------------
+
+    def _import_options_chunk(self, chunk, errors):
+        Option = self.env['pos.combo.option'].with_context(active_test=False)
+        Category = self.env['pos.combo.category'].with_context(active_test=False)
+
+        product_plus = {_plu(row.get('product_plu')) for _line, row in chunk}
+        products = self.env['product.product'].with_context(active_test=False).search_fetch(
+            [('plu_code', 'in', list(product_plus))], ['plu_code', 'name']
+        )
+        product_by_plu = {product.plu_code: product for product in products}
+        category_names = {(row.get('category') or '').strip() for _line, row in chunk} - {''}
+        categories = {category.name: category for category in Category.search_fetch([('name', 'in', list(category_names))], ['name'])}
+        missing = category_names - set(categories)
+        if missing:
+            for category in Category.create([{'name': name} for name in sorted(missing)]):
+                categories[category.name] = category
+
+        rows = []
+        for line_no, row in chunk:
+            product = product_by_plu.get(_plu(row.get('product_plu')))
+            category = categories.get((row.get('category') or '').strip())
+            if not product or not category:
+                errors.append({
+                    'line': line_no, 'plu_code': _plu(row.get('plu_code')),
+                    'message': _("Produit %s introuvable") % row.get('product_plu') if not product else _("Catégorie manquante"),
+                })
+                continue
+            try:
+                vals = _clean_values(row, OPTION_COLUMNS)
+            except ValueError as e:
+                errors.append({'line': line_no, 'plu_code': _plu(row.get('plu_code')), 'message': str(e)})
+                continue
+            vals.setdefault('name', product.name)
+            if _plu(row.get('plu_code')):
+                vals['plu_code'] = _plu(row.get('plu_code'))
+            rows.append((product, category, vals))
+
+        # Rapprochement: par PLU de l'option, sinon par (catégorie, produit)
+        existing = Option.search_fetch([
+            '|', ('plu_code', 'in', [vals['plu_code'] for _p, _c, vals in rows if vals.get('plu_code')]),
+            '&', ('combo_category_id', 'in', [category.id for _p, category, _v in rows]),
+            ('product_id', 'in', [product.id for product, _c, _v in rows]),
+        ], ['plu_code', 'combo_category_id', 'product_id', *OPTION_COLUMNS])
+        by_plu = {option.plu_code: option for option in existing if option.plu_code}
+        by_pair = {(option.combo_category_id.id, option.product_id.id): option for option in existing}
+
+        to_create = []
+        changes = {}
+        for product, category, vals in rows:
+            option = by_plu.get(vals.get('plu_code')) or by_pair.get((category.id, product.id))
+            vals = dict(vals, combo_category_id=category.id, product_id=product.id)
+            if option:
+                changed = self._changed_values(option, {
+                    key: value for key, value in vals.items() if key not in ('combo_category_id', 'product_id')
+                })
+                if option.combo_category_id != category or option.product_id != product:
+                    changed.update(combo_category_id=category.id, product_id=product.id)
+                changes[option.id] = changed
+            else:
+                to_create.append(vals)
+        created = Option.create(to_create) if to_create else Option
+        updated = self._group_writes(Option, changes)
+        return {'created': len(created), 'updated': updated, 'unchanged': len(changes) - updated}
+
+    # ------------------------------------------------------------------
+    # Recettes (ingrédients sélectionnés des cocktails)
+    # ------------------------------------------------------------------
+
+    def _import_recipes_chunk(self, chunk, errors):
+        ingredients_by_plu = {}
+        for line_no, row in chunk:
+            ingredients = row.get('ingredients') or []
+            if isinstance(ingredients, str):
+                ingredients = ingredients.split('|')
+            ingredients_by_plu[_plu(row.get('cocktail_plu'))] = (line_no, [_plu(plu) for plu in ingredients if _plu(plu)])
+
+        cocktails = self.env['product.product'].with_context(active_test=False).search_fetch(
+            [('plu_code', 'in', list(ingredients_by_plu))], ['plu_code', 'product_tmpl_id']
+        )
+        ingredient_plus = list({plu for _line, plus in ingredients_by_plu.values() for plu in plus})
+        options = self.env['pos.combo.option'].search_fetch(
+            ['|', ('plu_code', 'in', ingredient_plus), ('product_id.plu_code', 'in', ingredient_plus)],
+            ['plu_code', 'product_id'],
+        )
+        option_by_plu = {}
+        for option in options:
+            option_by_plu.setdefault(option.product_id.plu_code, option)
+        for option in options.filtered('plu_code'):
+            option_by_plu[option.plu_code] = option
+
+        Template = self.env['product.template']
+        changes = {}
+        found = 0
+        for cocktail in cocktails:
+            line_no, plus = ingredients_by_plu[cocktail.plu_code]
+            unknown = [plu for plu in plus if plu not in option_by_plu]
+            if unknown:
+                errors.append({'line': line_no, 'plu_code': cocktail.plu_code, 'message': _("Ingrédients inconnus: %s") % ', '.join(unknown)})
+                continue
+            found += 1
+            option_ids = [option_by_plu[plu].id for plu in plus]
+            changes[cocktail.product_tmpl_id.id] = self._changed_values(
+                cocktail.product_tmpl_id, {'selected_combo_ingredient_ids': [(6, 0, option_ids)]}
+            )
+        for plu_code in set(ingredients_by_plu) - set(cocktails.mapped('plu_code')):
+            errors.append({'line': ingredients_by_plu[plu_code][0], 'plu_code': plu_code, 'message': _("Cocktail introuvable")})
+        updated = self._group_writes(Template, changes)
+        return {'created': 0, 'updated': updated, 'unchanged': found - updated}
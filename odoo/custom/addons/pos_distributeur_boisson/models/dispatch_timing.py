@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import time
+from contextlib import contextmanager
+
+# Étapes mesurées d'un envoi de crédit, dans l'ordre d'exécution
+STAGES = ('lookup', 'server_no', 'connect', 'send', 'disconnect', 'log')
+
+# Seuil par défaut (ms) au-delà duquel un crédit est marqué lent
+DEFAULT_SLOW_THRESHOLD_MS = 1000.0
+
+
+class StageTimer:
+    """
+    Chronomètre par étape d'un envoi de crédit
+
+    Les durées (ms) s'additionnent par étape; celles mesurées par
+    MiddlewareClient (connect, send, disconnect) sont reprises via merge().
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000.0)
+
+    def add(self, name, duration_ms):
+        self.stages[name] = self.stages.get(name, 0.0) + duration_ms
+
+    def merge(self, timings):
+        """Reprend les durées renvoyées par MiddlewareClient (clé 'timings' du résultat)"""
+        for name, duration_ms in (timings or {}).items():
+            if name in STAGES:
+                self.add(name, duration_ms)
+
+    def copy(self):
+        timer = StageTimer()
+        timer.stages = dict(self.stages)
+        return timer
+
+    @property
+    def total_ms(self):
+        return sum(self.stages.values())
+
+    def log_vals(self, threshold_ms=DEFAULT_SLOW_THRESHOLD_MS):
+        """Valeurs des champs de durée de pos.credit.log"""
+        vals = {f'duration_{name}_ms': round(self.stages.get(name, 0.0), 2) for name in STAGES}
+        vals['duration_total_ms'] = round(self.total_ms, 2)
+        vals['is_slow'] = bool(threshold_ms) and self.total_ms >= threshold_ms
+        return vals
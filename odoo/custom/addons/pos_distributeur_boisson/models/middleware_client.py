@@ -3,10 +3,35 @@
 import requests
 import json
 import logging
+import random
+import time
+import uuid
+from contextlib import contextmanager
 from odoo import models, api
+from .middleware_transport import get_transport
+from .middleware_session import SerialSessionLease, SERIAL_PORT, SERIAL_BAUDRATE
+from .middleware_health import MiddlewareHealth
+from .middleware_breaker import CircuitBreaker, MiddlewareUnavailable, STATE_OPEN
+from .dispatch_metrics import DispatchMetrics
+from .dispatch_logging import get_credit_logger, kv
 
 _logger = logging.getLogger(__name__)
 
+# Délai (secondes) d'une requête unitaire au middleware
+REQUEST_TIMEOUT = 10
+
+# Valeurs par défaut des relances si aucun paramètre système n'est défini
+DEFAULT_RETRY_MAX_ATTEMPTS = 4
+DEFAULT_RETRY_BASE_DELAY = 0.2
+DEFAULT_RETRY_MAX_DELAY = 2.0
+DEFAULT_CREDIT_DEADLINE = 15.0
+
+
+def new_credit_id():
+    """Génère un identifiant de crédit, utilisé comme clé d'idempotence par le middleware"""
+    return f"CRED-{uuid.uuid4().hex[:16].upper()}"
+
+
 class MiddlewareClient:
     """
     Client centralisé pour la communication avec le middleware Hart96
@@ -15,32 +40,120 @@ class MiddlewareClient:
     
     def __init__(self, env):
         self.env = env
-        self._middleware_url = None
-        self._server_no = None
+        self._settings = None
+        self._transport = None
+    
+    def _get_settings(self):
+        """Paramètres typés du distributeur (cache du registre, sans requête SQL une fois chargés)"""
+        if self._settings is None:
+            self._settings = self.env['pos.distributeur.settings']._get_settings()
+        return self._settings
     
     def _get_middleware_url(self):
         """Récupère l'URL du middleware depuis la configuration Odoo"""
-        if not self._middleware_url:
-            self._middleware_url = self.env['ir.config_parameter'].sudo().get_param(
-                'pos_distributeur.middleware_url', 
-                'http://192.168.1.59:5000'
-            )
-            
-            # S'assurer que l'URL a un port
-            if not self._middleware_url.endswith(':5000') and not self._middleware_url.endswith(':80'):
-                if 'http://192.168.1.59' in self._middleware_url:
-                    self._middleware_url = 'http://192.168.1.59:5000'
-        
-        return self._middleware_url
+        return self._get_settings()['middleware_url']
     
     def _get_server_no(self):
         """Récupère le numéro de serveur depuis la configuration Odoo"""
-        if not self._server_no:
-            self._server_no = self.env['ir.config_parameter'].sudo().get_param(
-                'pos_distributeur.server_no', 
-                '1'
+        return self._get_settings()['server_no']
+    
+    def _get_transport(self):
+        """Retourne le transport HTTP keep-alive partagé par le worker, configuré depuis Odoo"""
+        if self._transport is None:
+            settings = self._get_settings()
+            transport = get_transport()
+            transport.configure(
+                pool_size=settings['http_pool_size'],
+                idle_timeout=settings['http_idle_timeout'],
             )
-        return self._server_no
+            self._transport = transport
+        return self._transport
+    
+    def _get_serial_lease(self):
+        """Retourne le bail de session série partagé pour ce middleware"""
+        settings = self._get_settings()
+        lease = SerialSessionLease.for_url(self._get_middleware_url())
+        lease.configure(
+            idle_timeout=settings['serial_idle_timeout'],
+            health_interval=settings['serial_health_interval'],
+        )
+        return lease
+    
+    def _get_breaker(self):
+        """Retourne le disjoncteur partagé pour ce middleware"""
+        settings = self._get_settings()
+        breaker = CircuitBreaker.for_url(self._get_middleware_url())
+        breaker.configure(
+            failure_threshold=settings['breaker_failure_threshold'],
+            reset_timeout=settings['breaker_reset_timeout'],
+        )
+        return breaker
+    
+    def _get_metrics(self):
+        """Retourne les compteurs du worker (exportés par /pos_distributeur_boisson/metrics)"""
+        metrics = DispatchMetrics.get()
+        metrics.configure(directory=self._get_settings()['metrics_dir'])
+        return metrics
+    
+    def _record_credits(self, credits_list, results, timings=None):
+        """
+        Compte l'issue de chaque trame par PLU et server_no et écrit un
+        enregistrement compact par crédit (logger ...pos_distributeur_boisson.credit)
+        """
+        metrics = self._get_metrics()
+        credit_logger = get_credit_logger(self._get_settings()['credit_log_sample_rate'])
+        duration_ms = round(sum((timings or {}).values()), 1)
+        for credit_data, result in zip(credits_list, results):
+            if result.get('offline'):
+                outcome = 'offline'
+            elif not result.get('success'):
+                outcome = 'failed'
+            elif credit_data.get('sign') == '-':
+                outcome = 'cancelled'
+            else:
+                outcome = 'sent'
+            server_no = credit_data.get('server_no') or self._get_server_no()
+            metrics.record_credit(outcome, credit_data.get('plu_no'), server_no, credit_data.get('quantity', 1))
+            credit_logger.log(
+                logging.INFO if result.get('success') else logging.WARNING,
+                "credit %s",
+                kv(
+                    outcome=outcome,
+                    credit_id=credit_data.get('credit_id'),
+                    server_no=server_no,
+                    plu=credit_data.get('plu_no'),
+                    sign=credit_data.get('sign', '+'),
+                    qty=credit_data.get('quantity', 1),
+                    ms=duration_ms,
+                    error=None if result.get('success') else result.get('message'),
+                ),
+            )
+    
+    def _offline_result(self, error=None):
+        """Résultat renvoyé immédiatement quand le disjoncteur est ouvert"""
+        detail = f' ({error})' if error and str(error) != 'None' else ''
+        return {
+            'success': False,
+            'offline': True,
+            'message': f'Distributeur hors ligne: middleware Hart96 injoignable{detail}. Réessayez dans quelques instants.'
+        }
+    
+    def _acquire_lease(self, lease):
+        """Ouvre (ou réutilise) la session série et reporte un échec au disjoncteur"""
+        lease_result = lease.acquire()
+        if not lease_result['success']:
+            _logger.warning("⚠️ Échec connexion middleware: %s", lease_result.get('error', 'Erreur inconnue'))
+            self._get_breaker().record_failure(lease_result.get('error'))
+        return lease_result
+    
+    @contextmanager
+    def _timed(self, timings, stage):
+        """Ajoute la durée (ms) du bloc à timings[stage]"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings[stage] = round(timings.get(stage, 0.0) + (time.perf_counter() - start) * 1000.0, 2)
     
     def _prepare_hart96_data(self, credit_data):
         """
@@ -58,13 +171,77 @@ class MiddlewareClient:
         if isinstance(plu_no, str) and plu_no.startswith('PLU'):
             plu_no = plu_no.replace('PLU', '')
         
-        return {
+        hart96_data = {
             'server_no': int(credit_data.get('server_no', self._get_server_no())),
             'plu_no': int(plu_no),
             'sign': credit_data.get('sign', '+'),
             'quantity': int(credit_data.get('quantity', 1))
         }
-    
+        if credit_data.get('credit_id'):
+            hart96_data['credit_id'] = credit_data['credit_id']
+        return hart96_data
+
+    def _with_credit_id(self, credit_data):
+        """Retourne les données du crédit avec un credit_id (généré si absent)"""
+        if credit_data.get('credit_id'):
+            return credit_data
+        return dict(credit_data, credit_id=new_credit_id())
+
+    def _post_with_retry(self, url, payload, headers):
+        """
+        POST vers le middleware avec relances sur erreurs transitoires
+
+        Relance sur ConnectionError, Timeout et réponses 5xx avec un backoff
+        exponentiel à jitter complet, dans la limite d'une échéance globale.
+        Les trames portent leur credit_id: le middleware ignore un doublon,
+        une relance ne peut donc pas distribuer deux fois.
+
+        Chaque tentative est comptée par le disjoncteur: s'il s'ouvre, les
+        relances s'arrêtent aussitôt.
+
+        Returns:
+            requests.Response: Dernière réponse reçue
+
+        Raises:
+            MiddlewareUnavailable: si le disjoncteur est ouvert
+            requests.exceptions.ConnectionError, requests.exceptions.Timeout:
+                si toutes les tentatives ont échoué sans réponse
+        """
+        breaker = self._get_breaker()
+        breaker.before_call()
+        settings = self._get_settings()
+        max_attempts = settings['retry_max_attempts']
+        base_delay = settings['retry_base_delay']
+        deadline = time.monotonic() + settings['credit_deadline']
+
+        metrics = self._get_metrics()
+        endpoint = url[len(self._get_middleware_url()):] if url.startswith(self._get_middleware_url()) else url
+        attempt = 0
+        while True:
+            attempt += 1
+            timeout = max(min(REQUEST_TIMEOUT, deadline - time.monotonic()), 0.5)
+            start = time.perf_counter()
+            try:
+                response = self._get_transport().post(url, json=payload, headers=headers, timeout=timeout)
+                metrics.record_request(endpoint, response.status_code, time.perf_counter() - start)
+                if response.status_code < 500:
+                    breaker.record_success()
+                    return response
+                error = f'HTTP {response.status_code}'
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                metrics.record_request(endpoint, 'timeout' if isinstance(e, requests.exceptions.Timeout) else 'error', time.perf_counter() - start)
+                response = None
+                error = e
+            breaker.record_failure(error)
+
+            delay = random.uniform(0, min(DEFAULT_RETRY_MAX_DELAY, base_delay * (2 ** (attempt - 1))))
+            if attempt >= max_attempts or time.monotonic() + delay >= deadline or breaker.state == STATE_OPEN:
+                if response is not None:
+                    return response
+                raise error
+            _logger.warning("🔁 Tentative %s/%s échouée (%s), nouvel essai dans %.2fs", attempt, max_attempts, error, delay)
+            time.sleep(delay)
+
     def connect_middleware(self):
         """
         Ouvre la connexion au middleware Hart96
@@ -77,12 +254,12 @@ class MiddlewareClient:
             url_connect = f"{middleware_url}/api/connect"
             
             connect_data = {
-                "port": "COM1",
-                "baudrate": 9600
+                "port": SERIAL_PORT,
+                "baudrate": SERIAL_BAUDRATE
             }
             
             headers = {'Content-Type': 'application/json'}
-            response = requests.post(url_connect, json=connect_data, headers=headers, timeout=10)
+            response = self._get_transport().post(url_connect, json=connect_data, headers=headers, timeout=REQUEST_TIMEOUT)
             
             _logger.info(f"🔌 Connexion middleware: {response.status_code} - {response.text}")
             
@@ -111,7 +288,7 @@ class MiddlewareClient:
             url_disconnect = f"{middleware_url}/api/disconnect"
             
             headers = {'Content-Type': 'application/json'}
-            response = requests.post(url_disconnect, json={}, headers=headers, timeout=10)
+            response = self._get_transport().post(url_disconnect, json={}, headers=headers, timeout=REQUEST_TIMEOUT)
             
             _logger.info(f"🔌 Déconnexion middleware: {response.status_code} - {response.text}")
             
@@ -133,12 +310,22 @@ class MiddlewareClient:
         Envoie un crédit au middleware Hart96
         
         Args:
-            credit_data (dict): Données du crédit
+            credit_data (dict): Données du crédit (credit_id généré si absent)
             auto_connect (bool): Si True, gère automatiquement la connexion/déconnexion
-        
+
         Returns:
-            dict: Résultat de l'envoi
+            dict: Résultat de l'envoi, avec le credit_id transmis au middleware
+                et la durée (ms) des étapes connect/send/disconnect (timings)
         """
+        credit_data = self._with_credit_id(credit_data)
+        timings = {}
+        result = self._send_credit(credit_data, auto_connect, timings)
+        self._record_credits([credit_data], [result], timings)
+        result['credit_id'] = credit_data['credit_id']
+        result['timings'] = timings
+        return result
+
+    def _send_credit(self, credit_data, auto_connect, timings):
         try:
             middleware_url = self._get_middleware_url()
             api_url = f"{middleware_url}/api/send-credit"
@@ -146,27 +333,35 @@ class MiddlewareClient:
             # Préparer les données au format Hart96
             hart96_data = self._prepare_hart96_data(credit_data)
             
-            _logger.info(f"📤 Envoi crédit vers middleware Hart96: {api_url}")
-            _logger.info(f"📤 Données originales: {json.dumps(credit_data, indent=2)}")
-            _logger.info(f"📤 Données Hart96 formatées: {json.dumps(hart96_data, indent=2)}")
+            _logger.debug("📤 Envoi crédit vers %s: %s", api_url, hart96_data)
             
-            # Connexion automatique si demandée
-            if auto_connect:
-                connect_result = self.connect_middleware()
-                if not connect_result['success']:
-                    _logger.warning(f"⚠️ Échec connexion middleware: {connect_result.get('error', 'Erreur inconnue')}")
+            # Middleware hors ligne: échec immédiat plutôt que d'attendre les timeouts
+            self._get_breaker().before_call()
             
-            # Envoyer la requête
-            headers = {'Content-Type': 'application/json'}
-            response = requests.post(api_url, json=hart96_data, headers=headers, timeout=10)
+            # Session série partagée si demandée (ouverte à la demande, fermée après inactivité)
+            lease = self._get_serial_lease() if auto_connect else None
+            with self._timed(timings, 'connect'):
+                leased = bool(lease) and self._acquire_lease(lease)['success']
             
-            _logger.info(f"📥 Réponse middleware: {response.status_code} - {response.text}")
+            # Envoyer la requête (relancée sur erreur transitoire avec la même clé d'idempotence)
+            try:
+                headers = {'Content-Type': 'application/json', 'Idempotency-Key': credit_data['credit_id']}
+                with self._timed(timings, 'send'):
+                    response = self._post_with_retry(api_url, hart96_data, headers)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if leased:
+                    lease.invalidate()
+                raise
+            finally:
+                if leased:
+                    with self._timed(timings, 'disconnect'):
+                        lease.release()
             
-            # Déconnexion automatique si demandée
-            if auto_connect:
-                disconnect_result = self.disconnect_middleware()
-                if not disconnect_result['success']:
-                    _logger.warning(f"⚠️ Échec déconnexion middleware: {disconnect_result.get('error', 'Erreur inconnue')}")
+            _logger.debug("📥 Réponse middleware: %s - %s", response.status_code, response.text)
+            
+            if leased and response.status_code != 200:
+                # Session peut-être fermée côté middleware: reconnecter au prochain crédit
+                lease.invalidate()
             
             # Traitement de la réponse
             if response.status_code == 200:
@@ -206,6 +401,9 @@ class MiddlewareClient:
                     'response': response.text
                 }
                 
+        except MiddlewareUnavailable as e:
+            _logger.warning("⛔ Middleware Hart96 hors ligne, crédit refusé sans envoi")
+            return self._offline_result(e)
         except requests.exceptions.ConnectionError:
             _logger.error("❌ Erreur de connexion au middleware Hart96")
             return {
@@ -219,7 +417,7 @@ class MiddlewareClient:
                 'message': 'Timeout lors de la connexion au middleware Hart96'
             }
         except Exception as e:
-            _logger.error(f"❌ Erreur inattendue: {str(e)}")
+            _logger.error("❌ Erreur inattendue: %s", e)
             return {
                 'success': False,
                 'message': f'Erreur inattendue: {str(e)}'
@@ -237,18 +435,24 @@ class MiddlewareClient:
             dict: Résultat global avec détails de chaque crédit
         """
         if not credits_list:
-            return {
+            return self._failed_credits_result(credits_list, {
                 'success': False,
                 'message': 'Aucun crédit à envoyer'
-            }
+            })
         
-        # Connexion unique
-        connect_result = self.connect_middleware()
+        try:
+            self._get_breaker().before_call()
+        except MiddlewareUnavailable as e:
+            return self._failed_credits_result(credits_list, self._offline_result(e))
+        
+        # Session série unique pour tous les crédits
+        lease = self._get_serial_lease()
+        connect_result = self._acquire_lease(lease)
         if not connect_result['success']:
-            return {
+            return self._failed_credits_result(credits_list, {
                 'success': False,
                 'message': f'Impossible de se connecter au middleware: {connect_result.get("error", "Erreur inconnue")}'
-            }
+            })
         
         results = []
         success_count = 0
@@ -256,22 +460,20 @@ class MiddlewareClient:
         try:
             # Envoyer tous les crédits
             for i, credit_data in enumerate(credits_list):
-                _logger.info(f"📤 Envoi crédit {i+1}/{len(credits_list)}")
+                _logger.debug("📤 Envoi crédit %s/%s", i + 1, len(credits_list))
                 
                 result = self.send_credit(credit_data, auto_connect=False)  # Pas de connexion automatique
                 results.append(result)
                 
                 if result['success']:
                     success_count += 1
-                    _logger.info(f"✅ Crédit {i+1} envoyé avec succès")
+                    _logger.debug("✅ Crédit %s envoyé avec succès", i + 1)
                 else:
-                    _logger.error(f"❌ Échec crédit {i+1}: {result['message']}")
+                    _logger.error("❌ Échec crédit %s: %s", i + 1, result['message'])
         
         finally:
-            # Déconnexion unique
-            disconnect_result = self.disconnect_middleware()
-            if not disconnect_result['success']:
-                _logger.warning(f"⚠️ Échec déconnexion: {disconnect_result.get('error', 'Erreur inconnue')}")
+            # La session reste ouverte et sera fermée après inactivité
+            lease.release()
         
         return {
             'success': success_count == len(credits_list),
@@ -280,52 +482,209 @@ class MiddlewareClient:
             'success_count': success_count,
             'results': results
         }
-    
-    def test_connection(self):
+
+    def _failed_credits_result(self, credits_list, result):
+        """Complète un échec global avec un résultat en échec par crédit"""
+        message = result['message']
+        return dict(
+            result,
+            total_credits=len(credits_list),
+            success_count=0,
+            results=[
+                {'success': False, 'message': message, 'credit_id': credit_data.get('credit_id')}
+                for credit_data in credits_list
+            ],
+        )
+
+    def _batch_frame_result(self, frame_result):
+        """Normalise le résultat d'une trame renvoyé par /api/send-credits"""
+        if isinstance(frame_result, dict):
+            success = bool(frame_result.get('success'))
+            default_message = 'Crédit envoyé avec succès' if success else 'Erreur lors de l\'envoi du crédit'
+            return {
+                'success': success,
+                'message': frame_result.get('message') or frame_result.get('error') or default_message,
+                'response': frame_result
+            }
+        if isinstance(frame_result, str) and frame_result.strip() == 'OK':
+            return {'success': True, 'message': 'Crédit envoyé avec succès', 'response': frame_result}
+        return {'success': False, 'message': f'Réponse inattendue: {frame_result}', 'response': frame_result}
+
+    def send_credits_batch(self, credits_list, auto_connect=True):
         """
-        Test la connexion au middleware Hart96
-        
+        Envoie plusieurs crédits au middleware Hart96 en une seule requête HTTP
+
+        Toutes les trames partent dans un seul POST /api/send-credits. Si le
+        middleware ne connaît pas cet endpoint (404/405), on bascule sur
+        send_multiple_credits (une requête par crédit).
+
+        Args:
+            credits_list (list): Liste des données de crédits
+            auto_connect (bool): Si True, gère automatiquement la connexion/déconnexion
+
         Returns:
-            dict: Résultat du test
+            dict: Résultat global avec un résultat par trame, dans l'ordre de credits_list,
+                et la durée (ms) des étapes du lot (timings)
         """
-        try:
-            middleware_url = self._get_middleware_url()
-            test_url = f"{middleware_url}/api/status"
-            
-            response = requests.get(test_url, timeout=5)
-            
-            if response.status_code == 200:
-                try:
-                    response_data = response.json()
-                    return {
-                        'success': True,
-                        'message': 'Connexion au middleware réussie',
-                        'middleware_url': middleware_url,
-                        'status': response_data
-                    }
-                except json.JSONDecodeError:
-                    return {
-                        'success': True,
-                        'message': 'Connexion au middleware réussie (réponse non-JSON)',
-                        'middleware_url': middleware_url,
-                        'response_text': response.text
-                    }
-            else:
-                return {
-                    'success': False,
-                    'message': f'Erreur HTTP {response.status_code}',
-                    'middleware_url': middleware_url
-                }
-                
-        except requests.exceptions.ConnectionError:
+        if not credits_list:
             return {
                 'success': False,
-                'message': f'Impossible de se connecter au middleware sur {middleware_url}',
-                'middleware_url': middleware_url
+                'message': 'Aucun crédit à envoyer',
+                'total_credits': 0,
+                'success_count': 0,
+                'results': []
             }
-        except Exception as e:
+
+        credits_list = [self._with_credit_id(credit_data) for credit_data in credits_list]
+        timings = {}
+        result = self._send_credits_batch(credits_list, auto_connect, timings)
+        result['timings'] = timings
+        return result
+
+    def _send_credits_batch(self, credits_list, auto_connect, timings):
+        total = len(credits_list)
+
+        def _all_failed(message, offline=False):
+            results = [{'success': False, 'message': message, 'credit_id': credit_data['credit_id']} for credit_data in credits_list]
+            self._record_credits(credits_list, [dict(result, offline=offline) for result in results], timings)
             return {
                 'success': False,
-                'message': f'Erreur: {str(e)}',
-                'middleware_url': middleware_url
-            } 
\ No newline at end of file
+                'message': message,
+                'total_credits': total,
+                'success_count': 0,
+                'results': results
+            }
+
+        try:
+            middleware_url = self._get_middleware_url()
+            api_url = f"{middleware_url}/api/send-credits"
+            frames = [self._prepare_hart96_data(credit_data) for credit_data in credits_list]
+
+            _logger.debug("📤 Envoi groupé de %s crédit(s) vers %s: %s", total, api_url, frames)
+
+            self._get_breaker().before_call()
+
+            lease = self._get_serial_lease() if auto_connect else None
+            with self._timed(timings, 'connect'):
+                leased = bool(lease) and self._acquire_lease(lease)['success']
+
+            try:
+                headers = {'Content-Type': 'application/json'}
+                with self._timed(timings, 'send'):
+                    response = self._post_with_retry(api_url, {'credits': frames}, headers)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if leased:
+                    lease.invalidate()
+                raise
+            finally:
+                if leased:
+                    with self._timed(timings, 'disconnect'):
+                        lease.release()
+
+            _logger.debug("📥 Réponse middleware (lot): %s - %s", response.status_code, response.text)
+
+            if response.status_code in (404, 405):
+                _logger.warning("⚠️ Endpoint /api/send-credits indisponible, envoi crédit par crédit")
+                fallback = self.send_multiple_credits(credits_list)
+                if len(fallback.get('results') or []) != total:
+                    # Échec global du mode série (hors ligne, connexion): un résultat par crédit
+                    offline = bool(fallback.get('offline'))
+                    return dict(_all_failed(fallback['message'], offline=offline), offline=offline)
+                return fallback
+
+            if leased and response.status_code != 200:
+                lease.invalidate()
+
+            if response.status_code != 200:
+                return _all_failed(f'Erreur HTTP {response.status_code}: {response.text}')
+
+            try:
+                response_data = response.json()
+            except json.JSONDecodeError:
+                response_text = response.text.strip()
+                if response_text == 'OK':
+                    response_data = {'success': True}
+                else:
+                    return _all_failed(f'Réponse inattendue: {response_text}')
+
+            frame_results = response_data.get('results')
+            if frame_results is None:
+                # Réponse globale sans détail: même résultat pour toutes les trames
+                frame_results = [{
+                    'success': bool(response_data.get('success')),
+                    'message': response_data.get('message') or response_data.get('error'),
+                }] * total
+            elif len(frame_results) != total:
+                return _all_failed(f'Réponse incohérente: {len(frame_results)} résultat(s) pour {total} crédit(s)')
+
+            results = [self._batch_frame_result(frame_result) for frame_result in frame_results]
+            for credit_data, result in zip(credits_list, results):
+                result['credit_id'] = credit_data['credit_id']
+            self._record_credits(credits_list, results, timings)
+            success_count = sum(1 for result in results if result['success'])
+
+            return {
+                'success': success_count == total,
+                'message': f'{success_count}/{total} crédits envoyés avec succès',
+                'total_credits': total,
+                'success_count': success_count,
+                'results': results
+            }
+
+        except MiddlewareUnavailable as e:
+            _logger.warning("⛔ Middleware Hart96 hors ligne, lot de %s crédit(s) refusé sans envoi", total)
+            offline = self._offline_result(e)
+            return dict(_all_failed(offline['message'], offline=True), offline=True)
+        except requests.exceptions.ConnectionError:
+            _logger.error("❌ Erreur de connexion au middleware Hart96")
+            return _all_failed('Impossible de se connecter au middleware Hart96. Vérifiez qu\'il est démarré et accessible.')
+        except requests.exceptions.Timeout:
+            _logger.error("❌ Timeout lors de la connexion au middleware Hart96")
+            return _all_failed('Timeout lors de la connexion au middleware Hart96')
+        except Exception as e:
+            _logger.error("❌ Erreur inattendue: %s", e)
+            return _all_failed(f'Erreur inattendue: {str(e)}')
+
+    def _get_health(self):
+        """Retourne le cache de statut partagé pour ce middleware"""
+        health = MiddlewareHealth.for_url(self._get_middleware_url())
+        health.configure(probe_interval=self._get_settings()['health_probe_interval'])
+        return health
+
+    def test_connection(self, force=False):
+        """
+        Test la connexion au middleware Hart96
+        
+        Le statut vient du cache alimenté en arrière-plan: pas d'aller-retour
+        réseau sauf si force=True ou si aucun statut récent n'est connu.
+        
+        Args:
+            force (bool): Interroger /api/status immédiatement
+        
+        Returns:
+            dict: Résultat du test (avec port, baudrate et âge du statut)
+        """
+        middleware_url = self._get_middleware_url()
+        health = self._get_health()
+        if force:
+            health.refresh()
+        status = health.get_status()
+        
+        result = {
+            'success': status['reachable'],
+            'middleware_url': middleware_url,
+            'connected': status['connected'],
+            'port': status['port'],
+            'baudrate': status['baudrate'],
+            'age': status['age'],
+        }
+        if status['reachable']:
+            if isinstance(status['payload'], dict):
+                result.update(message='Connexion au middleware réussie', status=status['payload'])
+            else:
+                result.update(message='Connexion au middleware réussie (réponse non-JSON)', response_text=status['payload'])
+        elif status['status_code']:
+            result['message'] = f"Erreur HTTP {status['status_code']}"
+        else:
+            result['message'] = f'Impossible de se connecter au middleware sur {middleware_url}'
+        return result
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import threading
+import time
+
+from .middleware_transport import get_transport
+from .middleware_health import MiddlewareHealth
+
+_logger = logging.getLogger(__name__)
+
+# Port série ouvert par le middleware Hart96
+SERIAL_PORT = 'COM1'
+SERIAL_BAUDRATE = 9600
+
+# Valeurs par défaut si aucun paramètre système n'est défini
+DEFAULT_IDLE_TIMEOUT = 30.0
+DEFAULT_HEALTH_INTERVAL = 15.0
+
+
+class SerialSessionLease:
+    """
+    Bail sur la session série du middleware Hart96
+
+    Au lieu d'un connect/send/disconnect par crédit, la session reste ouverte
+    tant que des crédits arrivent et n'est fermée qu'après idle_timeout
+    secondes sans activité (par un thread de surveillance). Une session gardée
+    ouverte est revérifiée via /api/status toutes les health_interval
+    secondes avant d'être réutilisée.
+
+    Un bail par URL de middleware et par processus worker.
+    """
+
+    _leases = {}
+    _leases_lock = threading.Lock()
+
+    def __init__(self, middleware_url, idle_timeout=DEFAULT_IDLE_TIMEOUT, health_interval=DEFAULT_HEALTH_INTERVAL):
+        self.middleware_url = middleware_url
+        self.idle_timeout = float(idle_timeout)
+        self.health_interval = float(health_interval)
+        self._lock = threading.RLock()
+        self._connected = False
+        self._in_use = 0
+        self._last_activity = 0.0
+        self._last_health_check = 0.0
+        self._reaper = None
+
+    @classmethod
+    def for_url(cls, middleware_url):
+        """Retourne le bail partagé pour cette URL de middleware"""
+        lease = cls._leases.get(middleware_url)
+        if lease is None:
+            with cls._leases_lock:
+                lease = cls._leases.get(middleware_url)
+                if lease is None:
+                    lease = cls._leases[middleware_url] = cls(middleware_url)
+        return lease
+
+    def configure(self, idle_timeout=None, health_interval=None):
+        with self._lock:
+            if idle_timeout is not None:
+                self.idle_timeout = float(idle_timeout)
+            if health_interval is not None:
+                self.health_interval = float(health_interval)
+
+    @property
+    def connected(self):
+        return self._connected
+
+    # ------------------------------------------------------------------
+    # Appels HTTP bruts vers le middleware
+    # ------------------------------------------------------------------
+
+    def _connect(self):
+        try:
+            response = get_transport().post(
+                f"{self.middleware_url}/api/connect",
+                json={'port': SERIAL_PORT, 'baudrate': SERIAL_BAUDRATE},
+                headers={'Content-Type': 'application/json'},
+                timeout=10,
+            )
+            _logger.debug("🔌 Ouverture session série middleware: %s", response.status_code)
+            if response.status_code == 200:
+                return {'success': True, 'status_code': response.status_code, 'response': response.text}
+            return {'success': False, 'status_code': response.status_code, 'error': response.text}
+        except Exception as e:
+            _logger.error(f"🔌 Erreur ouverture session série: {str(e)}")
+            return {'success': False, 'error': str(e)}
+
+    def _disconnect(self):
+        try:
+            response = get_transport().post(
+                f"{self.middleware_url}/api/disconnect",
+                json={},
+                headers={'Content-Type': 'application/json'},
+                timeout=10,
+            )
+            _logger.debug("🔌 Fermeture session série middleware: %s", response.status_code)
+            return {'success': response.status_code == 200, 'status_code': response.status_code}
+        except Exception as e:
+            _logger.error(f"🔌 Erreur fermeture session série: {str(e)}")
+            return {'success': False, 'error': str(e)}
+
+    def _check_health(self):
+        """Vérifie via /api/status (statut mis en cache) que le middleware a toujours le port série ouvert"""
+        status = MiddlewareHealth.for_url(self.middleware_url).get_status(max_age=self.health_interval)
+        return status['reachable'] and status['connected'] is not False
+
+    # ------------------------------------------------------------------
+    # Gestion du bail
+    # ------------------------------------------------------------------
+
+    def acquire(self):
+        """
+        Garantit une session série ouverte et la réserve pour un envoi
+
+        Chaque acquire() réussi doit être suivi d'un release().
+
+        Returns:
+            dict: {'success': bool, 'reused': bool, 'error': str}
+        """
+        with self._lock:
+            now = time.monotonic()
+            reused = self._connected
+            if self._connected and self.health_interval and now - self._last_health_check > self.health_interval:
+                if self._check_health():
+                    self._last_health_check = now
+                else:
+                    _logger.warning("⚠️ Session série middleware perdue, reconnexion")
+                    self._connected = False
+                    reused = False
+            if not self._connected:
+                result = self._connect()
+                if not result['success']:
+                    return dict(result, reused=False)
+                self._connected = True
+                self._last_health_check = now
+            self._in_use += 1
+            self._last_activity = now
+            self._ensure_reaper()
+            return {'success': True, 'reused': reused}
+
+    def release(self):
+        """Libère la réservation; ferme tout de suite la session si idle_timeout vaut 0"""
+        with self._lock:
+            self._in_use = max(self._in_use - 1, 0)
+            self._last_activity = time.monotonic()
+            if not self.idle_timeout and not self._in_use and self._connected:
+                self._close_locked()
+
+    def invalidate(self):
+        """Marque la session comme perdue: le prochain acquire() reconnectera"""
+        with self._lock:
+            self._connected = False
+
+    def close(self):
+        """Ferme immédiatement la session série si elle est ouverte"""
+        with self._lock:
+            if self._connected:
+                self._close_locked()
+
+    def _close_locked(self):
+        self._connected = False
+        result = self._disconnect()
+        if not result['success']:
+            _logger.warning(f"⚠️ Échec déconnexion middleware: {result.get('error', 'Erreur inconnue')}")
+
+    def _ensure_reaper(self):
+        if not self.idle_timeout:
+            return
+        if self._reaper is not None and self._reaper.is_alive():
+            return
+        self._reaper = threading.Thread(
+            target=self._reap_loop,
+            name=f'hart96-serial-lease-{self.middleware_url}',
+            daemon=True,
+        )
+        self._reaper.start()
+
+    def _reap_loop(self):
+        """Ferme la session quand elle est restée inactive plus de idle_timeout secondes"""
+        while True:
+            time.sleep(max(min(self.idle_timeout / 2.0, 5.0), 0.5))
+            with self._lock:
+                if not self._connected:
+                    self._reaper = None
+                    return
+                if not self.idle_timeout:
+                    continue
+                idle = time.monotonic() - self._last_activity
+                if not self._in_use and idle >= self.idle_timeout:
+                    _logger.info(f"🔌 Session série inactive depuis {idle:.0f}s, fermeture")
+                    self._close_locked()
+                    self._reaper = None
+                    return
+
+
+def _after_fork_in_child():
+    # Les threads de surveillance ne survivent pas au fork: repartir de zéro
+    SerialSessionLease._leases = {}
+    SerialSessionLease._leases_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_logger = logging.getLogger(__name__)
+
+# Valeurs par défaut si aucun paramètre système n'est défini
+DEFAULT_POOL_SIZE = 10
+DEFAULT_IDLE_TIMEOUT = 60.0
+
+
+class MiddlewareTransport:
+    """
+    Transport HTTP mutualisé (keep-alive) vers le middleware Hart96
+
+    Une seule instance par processus worker Odoo, partagée par tous les
+    MiddlewareClient : les connexions TCP restent ouvertes entre deux crédits
+    au lieu d'un handshake par requête.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.pool_size = max(int(pool_size or DEFAULT_POOL_SIZE), 1)
+        self.idle_timeout = float(idle_timeout or 0)
+        self._lock = threading.Lock()
+        self._session = None
+        self._last_used = 0.0
+        self._pid = os.getpid()
+
+    @classmethod
+    def get_instance(cls):
+        """Retourne le transport partagé du processus courant"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def configure(self, pool_size=None, idle_timeout=None):
+        """
+        Applique la configuration du pool
+
+        Args:
+            pool_size (int): Nombre max de connexions gardées ouvertes par hôte
+            idle_timeout (float): Secondes d'inactivité avant fermeture du pool (0 = jamais)
+        """
+        with self._lock:
+            if idle_timeout is not None:
+                self.idle_timeout = float(idle_timeout)
+            if pool_size is not None:
+                pool_size = max(int(pool_size), 1)
+                if pool_size != self.pool_size:
+                    self.pool_size = pool_size
+                    # Le nouveau pool sera construit au prochain appel
+                    self._close_session()
+
+    def _build_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=0,
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _logger.debug("Pool HTTP middleware créé (taille=%s, pid=%s)", self.pool_size, self._pid)
+        return session
+
+    def _close_session(self):
+        if self._session is not None:
+            try:
+                self._session.close()
+            except Exception:
+                pass
+            self._session = None
+
+    def _get_session(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._pid != os.getpid():
+                # Processus forké sans passer par le hook: ne pas réutiliser les sockets du parent
+                self._session = None
+                self._pid = os.getpid()
+            if self._session is not None and self.idle_timeout and now - self._last_used > self.idle_timeout:
+                _logger.debug("Pool HTTP middleware inactif depuis %.0fs, fermeture", now - self._last_used)
+                self._close_session()
+            if self._session is None:
+                self._session = self._build_session()
+            self._last_used = now
+            return self._session
+
+    def evict_idle(self):
+        """Ferme le pool s'il est inactif depuis plus de idle_timeout secondes"""
+        with self._lock:
+            if self._session is not None and self.idle_timeout and time.monotonic() - self._last_used > self.idle_timeout:
+                self._close_session()
+                return True
+        return False
+
+    def reset(self):
+        """Ferme toutes les connexions du pool (reconstruit au prochain appel)"""
+        with self._lock:
+            self._close_session()
+
+    def after_fork(self):
+        """
+        Reconstruit le pool dans un processus enfant
+
+        Les sockets hérités du parent ne doivent pas être fermés ni réutilisés:
+        on abandonne simplement la session et on repart d'un pool vide.
+        """
+        self._lock = threading.Lock()
+        self._session = None
+        self._last_used = 0.0
+        self._pid = os.getpid()
+
+    def get(self, url, **kwargs):
+        return self._get_session().get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self._get_session().post(url, **kwargs)
+
+
+def get_transport():
+    """Raccourci vers le transport partagé du worker"""
+    return MiddlewareTransport.get_instance()
+
+
+def _after_fork_in_child():
+    if MiddlewareTransport._instance is not None:
+        MiddlewareTransport._instance.after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
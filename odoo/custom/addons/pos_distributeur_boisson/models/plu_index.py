@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from weakref import WeakKeyDictionary
+from odoo import models, api, _
+from odoo.exceptions import ValidationError
+from odoo.tools import frozendict
+
+_logger = logging.getLogger(__name__)
+
+# Version de l'index, incrémentée après le commit de chaque modification du catalogue
+INDEX_VERSION_SEQUENCE = 'pos_distributeur_plu_index_version'
+
+# Index partagé du worker: {base: (version, index)}
+_shared_indexes = {}
+# Transactions ayant modifié le catalogue: {cursor: index propre à la transaction ou None}
+_dirty_transactions = WeakKeyDictionary()
+
+# Champs repris dans l'index: toute écriture sur l'un d'eux l'invalide
+PRODUCT_INDEX_FIELDS = (
+    'plu_code', 'name', 'active', 'is_distributeur_boisson', 'needs_distributor',
+    'is_combo_product', 'is_ingredient_only', 'available_in_pos',
+    'volume_distributeur', 'credits_per_serving',
+)
+TEMPLATE_INDEX_FIELDS = ('name', 'active', 'available_in_pos')
+OPTION_INDEX_FIELDS = ('plu_code', 'name', 'active', 'product_id', 'volume_distributeur', 'credits_per_serving')
+
+
+class PosDistributeurPluIndex(models.AbstractModel):
+    """
+    Index PLU -> produit / option de combo, gardé en mémoire par le worker
+
+    Construit à la première lecture, puis chaque recherche par PLU (envoi,
+    annulation) est une lecture de dictionnaire, après celle du numéro de
+    version (séquence PostgreSQL). Les create/write/unlink de
+    product.product, product.template et pos.combo.option qui touchent un
+    champ indexé incrémentent la version après le commit: tous les workers
+    reconstruisent l'index, et seulement lui (les caches du registre ne
+    sont pas touchés). La transaction qui modifie le catalogue utilise en
+    attendant son propre index.
+    """
+    _name = 'pos.distributeur.plu.index'
+    _description = 'Index PLU du distributeur de boissons'
+
+    def init(self):
+        self.env.cr.execute(f"CREATE SEQUENCE IF NOT EXISTS {INDEX_VERSION_SEQUENCE}")
+
+    @api.model
+    def _get_index(self):
+        """
+        Returns:
+            frozendict: {'products': {plu: (entrée, ...)}, 'options': {plu: (entrée, ...)}}
+                (ne pas modifier, partagé par le worker)
+        """
+        cr = self.env.cr
+        if cr in _dirty_transactions:
+            if _dirty_transactions[cr] is None:
+                _dirty_transactions[cr] = self._build_index()
+            return _dirty_transactions[cr]
+        cr.execute(f"SELECT last_value FROM {INDEX_VERSION_SEQUENCE}")
+        version = cr.fetchone()[0]
+        cached = _shared_indexes.get(cr.dbname)
+        if cached and cached[0] == version:
+            return cached[1]
+        # Version lue avant la construction: une modification concurrente sera vue au prochain appel
+        index = self._build_index()
+        _shared_indexes[cr.dbname] = (version, index)
+        return index
+
+    @api.model
+    def _build_index(self):
+        """Lit produits et options portant un PLU (trois flush, deux search_fetch)"""
+        Product = self.env['product.product'].sudo().with_context(active_test=True, lang=None)
+        Option = self.env['pos.combo.option'].sudo().with_context(active_test=False, lang=None)
+        Product.flush_model(PRODUCT_INDEX_FIELDS)
+        self.env['product.template'].flush_model(TEMPLATE_INDEX_FIELDS)
+        Option.flush_model(OPTION_INDEX_FIELDS)
+
+        products = {}
+        for product in Product.search_fetch([('plu_code', '!=', False)], PRODUCT_INDEX_FIELDS):
+            products.setdefault(product.plu_code, []).append(frozendict({
+                'product_id': product.id,
+                'name': product.name,
+                'is_distributeur_boisson': product.is_distributeur_boisson,
+                'needs_distributor': product.needs_distributor,
+                'is_combo_product': product.is_combo_product,
+                'is_ingredient_only': product.is_ingredient_only,
+                'available_in_pos': product.available_in_pos,
+                'volume': product.volume_distributeur,
+                'credits': product.credits_per_serving,
+            }))
+        options = {}
+        for option in Option.search_fetch([('plu_code', '!=', False)], OPTION_INDEX_FIELDS):
+            options.setdefault(option.plu_code, []).append(frozendict({
+                'option_id': option.id,
+                'product_id': option.product_id.id,
+                'name': option.name,
+                'active': option.active,
+                'volume': option.volume_distributeur,
+                'credits': option.credits_per_serving,
+            }))
+        index = frozendict({
+            'products': frozendict({plu: tuple(entries) for plu, entries in products.items()}),
+            'options': frozendict({plu: tuple(entries) for plu, entries in options.items()}),
+        })
+        _logger.debug("Index PLU chargé: %s produits, %s options", len(index['products']), len(index['options']))
+        return index
+
+    @api.model
+    def _invalidate_index(self):
+        """
+        Reconstruit l'index pour cette transaction et, après son commit,
+        pour tous les workers (incrément de la version)
+        """
+        cr = self.env.cr
+        already_dirty = cr in _dirty_transactions
+        _dirty_transactions[cr] = None
+        if already_dirty:
+            return
+        registry = self.env.registry
+
+        def _bump_version():
+            _dirty_transactions.pop(cr, None)
+            _shared_indexes.pop(cr.dbname, None)
+            with registry.cursor() as bump_cr:
+                bump_cr.execute(f"SELECT nextval('{INDEX_VERSION_SEQUENCE}')")
+
+        cr.postcommit.add(_bump_version)
+        cr.postrollback.add(lambda: _dirty_transactions.pop(cr, None))
+
+    @api.model
+    def _lookup_product(self, plu_code):
+        """Entrée du produit portant ce PLU, ou None"""
+        entries = self._get_index()['products'].get(str(plu_code or ''))
+        return entries[0] if entries else None
+
+    @api.model
+    def _lookup_option(self, plu_code):
+        """Entrée de l'option de combo portant ce PLU, ou None"""
+        entries = self._get_index()['options'].get(str(plu_code or ''))
+        return entries[0] if entries else None
+
+    @api.model
+    def _lookup_name(self, plu_code):
+        """Nom du produit ou de l'option pour ce PLU (journalisation), ou chaîne vide"""
+        entry = self._lookup_product(plu_code) or self._lookup_option(plu_code)
+        return entry['name'] if entry else ''
+
+    @api.model
+    def _distributor_product_ids(self):
+        """Produits vendus via le distributeur (boissons simples et cocktails, hors ingrédients)"""
+        return [
+            entry['product_id']
+            for entries in self._get_index()['products'].values()
+            for entry in entries
+            if entry['is_distributeur_boisson'] and entry['available_in_pos'] and not entry['is_ingredient_only']
+        ]
+
+    # ------------------------------------------------------------------
+    # Unicité des PLU (produits et options de combo partagent l'espace)
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _find_plu_conflicts(self, plu_codes):
+        """
+        Conflits de PLU en une seule requête, produits et options confondus
+
+        Un PLU est en conflit s'il est porté par plusieurs produits actifs,
+        par plusieurs options, ou par une option et un autre produit que le
+        sien (une option peut reprendre le PLU de son propre produit).
+
+        Returns:
+            dict: {plu: [(modèle, id), ...]} des PLU en conflit
+        """
+        plu_codes = sorted({code for code in plu_codes if code})
+        if not plu_codes:
+            return {}
+        self.env['product.product'].flush_model(['plu_code', 'active'])
+        self.env['pos.combo.option'].flush_model(['plu_code', 'product_id'])
+        self.env.cr.execute("""
+            SELECT plu_code, 'product.product', id, id
+              FROM product_product
+             WHERE plu_code = ANY(%s) AND active
+            UNION ALL
+            SELECT plu_code, 'pos.combo.option', id, product_id
+              FROM pos_combo_option
+             WHERE plu_code = ANY(%s)
+             ORDER BY 1, 2 DESC, 3
+        """, [plu_codes, plu_codes])
+        rows_by_plu = {}
+        for plu_code, model_name, record_id, owner_id in self.env.cr.fetchall():
+            rows_by_plu.setdefault(plu_code, []).append((model_name, record_id, owner_id))
+        conflicts = {}
+        for plu_code, rows in rows_by_plu.items():
+            owners = {owner_id for _model, _id, owner_id in rows}
+            options = [row for row in rows if row[0] == 'pos.combo.option']
+            if len(owners) > 1 or len(options) > 1:
+                conflicts[plu_code] = [(model_name, record_id) for model_name, record_id, _owner in rows]
+        return conflicts
+
+    @api.model
+    def _check_unique_plu_codes(self, plu_codes):
+        """Lève une seule ValidationError listant tous les PLU en double"""
+        conflicts = self._find_plu_conflicts(plu_codes)
+        if not conflicts:
+            return
+        names = {}
+        for model_name in ('product.product', 'pos.combo.option'):
+            ids = [record_id for rows in conflicts.values() for row_model, record_id in rows if row_model == model_name]
+            names[model_name] = {record.id: record.display_name for record in self.env[model_name].sudo().browse(ids)}
+        labels = {'product.product': _("produit"), 'pos.combo.option': _("option")}
+        lines = [
+            "- %s : %s" % (plu_code, ", ".join(
+                "%s '%s'" % (labels[model_name], names[model_name].get(record_id, record_id))
+                for model_name, record_id in rows
+            ))
+            for plu_code, rows in sorted(conflicts.items())
+        ]
+        raise ValidationError(_("Codes PLU en double (%s) :\n%s") % (len(conflicts), "\n".join(lines)))
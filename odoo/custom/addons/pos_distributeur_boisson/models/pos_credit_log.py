@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from odoo import models, fields, api
+from .dispatch_planner import DispatchPlan
+from .middleware_client import MiddlewareClient
+
+_logger = logging.getLogger(__name__)
+
+
+class PosCreditLog(models.Model):
+    _inherit = 'pos.credit.log'
+
+    @api.model
+    def _cancel_allocations(self, allocations, reason, product_name=None):
+        """
+        Annule des unités de crédits dans le Flex/Hart96 en un seul envoi
+
+        Les unités (issues de _allocate_quantity) sont regroupées en une trame
+        négative par (server_no, PLU), envoyées dans une seule requête et une
+        seule session série. Pour chaque trame acceptée, la quantité restante
+        des crédits est décrémentée (_consume_allocations) et une ligne
+        d'annulation est créée par crédit touché, le tout en un create.
+
+        Args:
+            allocations (list): [(pos.credit.log, unités à annuler)]
+            reason (str): Message des lignes d'annulation
+            product_name (str): Libellé des lignes d'annulation (sinon celui du crédit)
+
+        Returns:
+            int: Nombre d'unités annulées
+        """
+        allocations = [(credit, units) for credit, units in allocations if units > 0]
+        if not allocations:
+            return 0
+        # Vérifier les droits Barman
+        if not self.env.user.has_group('pos_user_org.group_pos_barman'):
+            _logger.warning("⚠️ Utilisateur non-Barman tente d'annuler %s crédit(s)", len(allocations))
+            return 0
+
+        plan = DispatchPlan()
+        for index, (credit, units) in enumerate(allocations):
+            # ❗ SIGNE MOINS = ANNULATION
+            plan.add(credit.server_no, credit.plu_no, units, index, credit.product_name, sign='-')
+        _logger.debug("📤 Annulation de %s unité(s) sur %s crédit(s) en %s trame(s)", sum(units for _credit, units in allocations), len(allocations), len(plan))
+
+        try:
+            result = MiddlewareClient(self.env).send_credits_batch(plan.credits_list(), auto_connect=True)
+        except Exception as e:
+            _logger.error("❌ Erreur lors de l'annulation des crédits: %s", e, exc_info=True)
+            return 0
+
+        now = fields.Datetime.now()
+        employee = self.env.user.employee_id
+        cancellation_vals = []
+        cancelled_units = 0
+        for frame, frame_result in zip(plan.frames, result.get('results', [])):
+            frame_allocations = [allocations[source['item_index']] for source in frame['sources']]
+            frame_credits = self.browse([credit.id for credit, _units in frame_allocations])
+            response = str(frame_result.get('response', ''))
+            if not frame_result.get('success'):
+                message = frame_result.get('message', 'Erreur inconnue')
+                _logger.error("❌ Échec annulation PLU %s (%s unité(s)): %s", frame['plu_no'], frame['quantity'], message)
+                frame_credits.write({'message': f"Échec annulation: {message}"})
+                continue
+            self._consume_allocations(frame_allocations, {
+                'cancelled_at': now,
+                'cancelled_by': self.env.user.id,
+                'cancellation_response': response,
+            })
+            cancelled_units += frame['quantity']
+            # Une ligne d'annulation par crédit touché (traçabilité complète)
+            cancellation_vals.extend({
+                'user_id': self.env.user.id,
+                'employee_id': employee.id if employee else False,
+                'session_id': credit.session_id.id,
+                'order_line_id': credit.order_line_id.id,
+                'product_name': f"🔄 ANNULATION - {product_name or credit.product_name}",
+                'plu_no': credit.plu_no,
+                'quantity': units,
+                'server_no': credit.server_no,
+                'success': True,
+                'status': 'cancelled',
+                'is_cancellation': True,
+                'message': reason,
+                'response_payload': response,
+                'credit_id': credit.credit_id,
+            } for credit, units in frame_allocations)
+        if cancellation_vals:
+            self.sudo().create(cancellation_vals)
+        _logger.debug("✅ %s unité(s) annulée(s) sur %s crédit(s) en %s trame(s)", cancelled_units, len(allocations), len(plan))
+        return cancelled_units
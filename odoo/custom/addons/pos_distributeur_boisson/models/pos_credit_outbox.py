@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, _
+from datetime import timedelta
+import json
+import logging
+from .middleware_client import MiddlewareClient, new_credit_id
+from .dispatch_timing import StageTimer
+
+_logger = logging.getLogger(__name__)
+
+# Valeurs par défaut si aucun paramètre système n'est défini
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_MAX_ATTEMPTS = 5
+# Attente avant une nouvelle tentative (s), doublée à chaque échec, plafonnée
+DEFAULT_RETRY_DELAY = 30
+MAX_RETRY_DELAY = 3600
+
+
+class PosCreditOutbox(models.Model):
+    """
+    File d'attente durable des crédits à envoyer au middleware Hart96
+
+    Le RPC POS enregistre les crédits dans la transaction de la commande et
+    rend la main immédiatement; le cron de dispatch vide la file par lots,
+    journalise dans pos.credit.log et notifie le POS du résultat via le bus.
+    """
+    _name = 'pos.credit.outbox'
+    _description = 'File d\'attente des crédits distributeur'
+    _order = 'id'
+
+    credit_id = fields.Char(
+        string='ID Crédit',
+        help='Clé d\'idempotence envoyée au middleware: identique à chaque tentative',
+        default=lambda self: new_credit_id(),
+        required=True,
+        copy=False,
+        index=True
+    )
+    session_id = fields.Many2one('pos.session', string='Session POS', index=True, ondelete='set null')
+    user_id = fields.Many2one('res.users', string='Utilisateur', required=True, default=lambda self: self.env.user)
+    order_ref = fields.Char(string='Référence commande')
+    order_line_id = fields.Many2one('pos.order.line', string='Ligne de commande', ondelete='set null')
+    product_name = fields.Char(string='Produit')
+    plu_no = fields.Char(string='PLU', required=True)
+    server_no = fields.Integer(string='Server No', required=True)
+    sign = fields.Char(string='Signe', default='+', required=True)
+    quantity = fields.Integer(string='Quantité', default=1, required=True)
+    state = fields.Selection([
+        ('pending', 'En attente'),
+        ('done', 'Envoyé'),
+        ('failed', 'Échec'),
+    ], string='État', default='pending', required=True, index=True)
+    attempts = fields.Integer(string='Tentatives', default=0)
+    last_error = fields.Char(string='Dernière erreur')
+    next_attempt_at = fields.Datetime(
+        string='Prochaine tentative',
+        help='Après un échec, le crédit n\'est pas renvoyé avant cette date (attente doublée à chaque tentative)'
+    )
+    processed_at = fields.Datetime(string='Traité le')
+    credit_log_id = fields.Many2one('pos.credit.log', string='Journal crédit', ondelete='set null')
+
+    _sql_constraints = [
+        ('credit_id_uniq', 'unique(credit_id)', 'Un crédit ne peut être mis qu\'une fois en file d\'attente.')
+    ]
+
+    @api.model
+    def _get_dispatch_params(self):
+        settings = self.env['pos.distributeur.settings']._get_settings()
+        return {
+            'batch_size': settings['outbox_batch_size'],
+            'max_attempts': settings['outbox_max_attempts'],
+            'retry_delay': settings['outbox_retry_delay'],
+        }
+
+    @api.model
+    def _enqueue(self, vals_list):
+        """
+        Met des crédits en file d'attente et réveille le cron de dispatch
+
+        Args:
+            vals_list (list): Valeurs de pos.credit.outbox (plu_no, server_no, quantity, ...)
+
+        Returns:
+            recordset: Entrées créées
+        """
+        records = self.sudo().create(vals_list)
+        cron = self.env.ref('pos_distributeur_boisson.ir_cron_pos_credit_outbox_dispatch', raise_if_not_found=False)
+        if cron:
+            # Exécuté dès que la transaction de la commande est validée
+            cron.sudo()._trigger()
+        return records
+
+    @api.model
+    def _cron_dispatch(self, limit_batches=None):
+        """
+        Vide la file d'attente par lots
+
+        Chaque lot est verrouillé (FOR UPDATE SKIP LOCKED), envoyé en une seule
+        requête au middleware puis validé: plusieurs dispatchers peuvent
+        tourner en parallèle sans envoyer deux fois le même crédit. Un crédit
+        en échec attend next_attempt_at et n'est jamais repris dans le même
+        passage.
+        """
+        dispatch_params = self._get_dispatch_params()
+        batches = 0
+        tried_ids = []
+        while limit_batches is None or batches < limit_batches:
+            self.env.cr.execute("""
+                SELECT id FROM pos_credit_outbox
+                 WHERE state = 'pending'
+                   AND (next_attempt_at IS NULL OR next_attempt_at <= %s)
+                   AND id != ALL(%s)
+                 ORDER BY id
+                 LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+            """, [fields.Datetime.now(), tried_ids, dispatch_params['batch_size']])
+            ids = [row[0] for row in self.env.cr.fetchall()]
+            if not ids:
+                break
+            tried_ids.extend(ids)
+            dispatched = self.browse(ids)._dispatch_batch(dispatch_params['max_attempts'], dispatch_params['retry_delay'])
+            self.env.cr.commit()
+            if not dispatched:
+                # Middleware hors ligne: on réessaiera au prochain passage du cron
+                break
+            batches += 1
+        self._schedule_next_attempt()
+        return batches
+
+    @api.model
+    def _schedule_next_attempt(self):
+        """Réveille le cron à la première date de nouvelle tentative en attente"""
+        waiting = self.search([('state', '=', 'pending'), ('next_attempt_at', '!=', False)], order='next_attempt_at', limit=1)
+        cron = self.env.ref('pos_distributeur_boisson.ir_cron_pos_credit_outbox_dispatch', raise_if_not_found=False)
+        if waiting and cron:
+            cron.sudo()._trigger(at=waiting.next_attempt_at)
+
+    def _dispatch_batch(self, max_attempts=DEFAULT_MAX_ATTEMPTS, retry_delay=DEFAULT_RETRY_DELAY):
+        """
+        Envoie les entrées en un seul appel middleware et enregistre les résultats
+
+        Returns:
+            bool: False si le middleware est hors ligne (disjoncteur ouvert): les
+                entrées restent en attente sans consommer de tentative
+        """
+        if not self:
+            return True
+        credits_list = [{
+            'credit_id': rec.credit_id,
+            'server_no': rec.server_no,
+            'plu_no': rec.plu_no,
+            'sign': rec.sign,
+            'quantity': rec.quantity,
+        } for rec in self]
+        client = MiddlewareClient(self.env)
+        batch_result = client.send_credits_batch(credits_list)
+        _logger.debug("📦 Dispatch file d'attente: %s", batch_result.get('message'))
+        if batch_result.get('offline'):
+            return False
+        timer = StageTimer()
+        timer.merge(batch_result.get('timings'))
+        settings = self.env['pos.distributeur.settings']._get_settings()
+        timing_vals = dict(timer.log_vals(settings['slow_credit_threshold_ms']), middleware_url=client._get_middleware_url())
+
+        now = fields.Datetime.now()
+        log_vals_list = []
+        succeeded = self.browse()
+        results = batch_result.get('results') or []
+        # Entrée sans résultat (réponse incomplète): tentative échouée avec le message du lot
+        missing = {'success': False, 'message': batch_result.get('message') or 'Aucun résultat du middleware'}
+        for index, rec in enumerate(self):
+            result = results[index] if index < len(results) else missing
+            attempts = rec.attempts + 1
+            if result.get('success'):
+                rec.write({'state': 'done', 'attempts': attempts, 'processed_at': now, 'last_error': False, 'next_attempt_at': False})
+                log_vals_list.append(dict(rec._prepare_credit_log_vals(result), **timing_vals))
+                succeeded |= rec
+            else:
+                failed = attempts >= max_attempts
+                delay = min(retry_delay * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+                rec.write({
+                    'state': 'failed' if failed else 'pending',
+                    'attempts': attempts,
+                    'last_error': (result.get('message') or '')[:255],
+                    'processed_at': now,
+                    'next_attempt_at': False if failed else now + timedelta(seconds=delay),
+                })
+        if log_vals_list:
+            logs = self.env['pos.credit.log'].sudo().create(log_vals_list)
+            for rec, log in zip(succeeded, logs):
+                rec.credit_log_id = log
+        self._notify_pos()
+        return True
+
+    def _prepare_credit_log_vals(self, result):
+        self.ensure_one()
+        employee = self.user_id.employee_id
+        return {
+            'user_id': self.user_id.id,
+            'employee_id': employee.id if employee else False,
+            'session_id': self.session_id.id,
+            'order_line_id': self.order_line_id.id,
+            'order_ref': self.order_ref,
+            'product_name': self.product_name,
+            'plu_no': self.plu_no,
+            'quantity': self.quantity,
+            'server_no': self.server_no,
+            'success': True,
+            'status': 'sent',
+            'credit_id': self.credit_id,
+            'message': result.get('message'),
+            'response_payload': json.dumps(result.get('response')) if isinstance(result.get('response'), (dict, list)) else (result.get('response') or ''),
+        }
+
+    def _notify_pos(self):
+        """Pousse le résultat du dispatch aux barmans concernés via le bus"""
+        for user in self.mapped('user_id'):
+            records = self.filtered(lambda r: r.user_id == user)
+            self.env['bus.bus']._sendone(user.partner_id, 'pos_distributeur_boisson/credit_status', {
+                'order_refs': list(set(records.mapped('order_ref')) - {False}),
+                'credits': [{
+                    'id': rec.id,
+                    'product_name': rec.product_name,
+                    'plu_no': rec.plu_no,
+                    'quantity': rec.quantity,
+                    'state': rec.state,
+                    'message': rec.last_error or '',
+                } for rec in records],
+            })
+
+    def action_retry(self):
+        """Remet les entrées en échec dans la file d'attente"""
+        self.filtered(lambda r: r.state == 'failed').write({'state': 'pending', 'attempts': 0, 'last_error': False, 'next_attempt_at': False})
+        cron = self.env.ref('pos_distributeur_boisson.ir_cron_pos_credit_outbox_dispatch', raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+        return True
@@ -27,16 +27,29 @@ class PosOrderLine(models.Model):
     def _get_active_credits(self):
         """
         Récupère les crédits actifs pour cette ligne
-        Méthode helper pour éviter le problème de dépendance circulaire
         """
         self.ensure_one()
-        if not self.env['ir.model'].search([('model', '=', 'pos.credit.log')]):
-            return self.env['pos.credit.log']
-        
-        return self.env['pos.credit.log'].search([
-            ('order_line_id', '=', self.id),
+        return self._get_active_credits_by_line().get(self.id, self.env['pos.credit.log'])
+
+    def _get_active_credits_by_line(self):
+        """
+        Crédits encore annulables de toutes les lignes en une requête (les plus récents en premier)
+
+        Returns:
+            dict: {order_line_id: pos.credit.log}
+        """
+        credits = self.env['pos.credit.log'].search([
+            ('order_line_id', 'in', self.ids),
             ('status', '=', 'sent'),
-        ])
+            ('remaining_quantity', '>', 0),
+        ], order='create_date desc, id desc')
+        credit_ids = {}
+        for credit_log in credits:
+            credit_ids.setdefault(credit_log.order_line_id.id, []).append(credit_log.id)
+        return {line_id: credits.browse(ids) for line_id, ids in credit_ids.items()}
+
+    def _distributor_lines(self):
+        return self.filtered(lambda line: line.product_id and line.product_id.needs_distributor)
 
     def set_combo_options(self, options):
         """
@@ -121,33 +134,18 @@ class PosOrderLine(models.Model):
         """
         Surcharge de la suppression pour gérer l'annulation automatique des crédits
         """
-        _logger.info("🗑️ Suppression de ligne(s) de commande POS détectée")
+        _logger.debug("🗑️ Suppression de %s ligne(s) de commande POS détectée", len(self))
         
-        # Parcourir toutes les lignes à supprimer
-        for line in self:
-            # Vérifier si le produit nécessite le distributeur
-            if line.product_id and hasattr(line.product_id, 'needs_distributor') and line.product_id.needs_distributor:
-                _logger.info(f"🔍 Ligne #{line.id}: {line.product_id.name} - Vérification crédits...")
-                
-                # Chercher les crédits actifs en utilisant la méthode helper
-                try:
-                    active_credits = line._get_active_credits()
-                except Exception as e:
-                    _logger.warning(f"⚠️ Impossible de récupérer les crédits: {str(e)}")
-                    active_credits = self.env['pos.credit.log']
-                
-                if active_credits:
-                    _logger.info(f"⚠️ {len(active_credits)} crédit(s) actif(s) trouvé(s) - Tentative d'annulation...")
-                    
-                    # Annuler chaque crédit
-                    cancelled_count = 0
-                    for credit_log in active_credits:
-                        if self._cancel_credit_in_flex(credit_log):
-                            cancelled_count += 1
-                    
-                    _logger.info(f"✅ {cancelled_count}/{len(active_credits)} crédit(s) annulé(s) avec succès")
-                else:
-                    _logger.info(f"✅ Aucun crédit actif, suppression simple")
+        # Crédits actifs de toutes les lignes distributeur, annulés en un seul envoi
+        try:
+            credits_by_line = self._distributor_lines()._get_active_credits_by_line()
+        except Exception as e:
+            _logger.warning("⚠️ Impossible de récupérer les crédits: %s", e)
+            credits_by_line = {}
+        active_credits = self.env['pos.credit.log'].concat(*credits_by_line.values())
+        if active_credits:
+            _logger.debug("⚠️ %s crédit(s) actif(s) sur %s ligne(s) - Tentative d'annulation", len(active_credits), len(credits_by_line))
+            self._cancel_credits_bulk(active_credits, 'Annulation automatique suite à suppression de ligne')
         
         # Appeler la méthode parent pour suppression normale
         return super(PosOrderLine, self).unlink()
@@ -158,17 +156,20 @@ class PosOrderLine(models.Model):
         """
         # Vérifier si la quantité change
         if 'qty' in vals:
-            for line in self:
+            qty_to_cancel = {}
+            for line in self._distributor_lines():
                 old_qty = line.qty
                 new_qty = vals['qty']
                 
-                # Si quantité réduite et produit nécessite distributeur
-                if new_qty < old_qty and line.product_id and hasattr(line.product_id, 'needs_distributor') and line.product_id.needs_distributor:
+                # Si quantité réduite
+                if new_qty < old_qty:
                     qty_diff = int(old_qty - new_qty)
-                    _logger.info(f"📉 Réduction quantité détectée: {old_qty} → {new_qty} (diff: {qty_diff})")
-                    
-                    # Annuler les crédits correspondants à la réduction
-                    self._cancel_quantity_credits(line, qty_diff)
+                    _logger.debug("📉 Réduction quantité détectée: %s → %s (diff: %s)", old_qty, new_qty, qty_diff)
+                    qty_to_cancel[line.id] = qty_diff
+            
+            # Annuler les crédits correspondants à la réduction
+            if qty_to_cancel:
+                self._cancel_quantity_credits(qty_to_cancel)
         
         return super(PosOrderLine, self).write(vals)
     
@@ -182,113 +183,50 @@ class PosOrderLine(models.Model):
         Returns:
             bool: True si annulation réussie, False sinon
         """
-        try:
-            _logger.info(f"🔄 Annulation crédit #{credit_log.id}: {credit_log.product_name} (PLU: {credit_log.plu_no})")
-            
-            # Vérifier les droits Barman
-            if not self.env.user.has_group('pos_user_org.group_pos_barman'):
-                _logger.warning("⚠️ Utilisateur non-Barman tente d'annuler un crédit")
-                return False
-            
-            # Préparer la commande d'annulation avec SIGNE MOINS
-            cancel_data = {
-                'server_no': credit_log.server_no,
-                'plu_no': credit_log.plu_no,
-                'sign': '-',  # ❗ SIGNE MOINS = ANNULATION
-                'quantity': credit_log.quantity
-            }
-            
-            _logger.info(f"📤 Envoi annulation au middleware: {cancel_data}")
-            
-            # Envoyer au middleware via MiddlewareClient
-            try:
-                from ..models.middleware_client import MiddlewareClient
-                client = MiddlewareClient(self.env)
-                result = client.send_credit(cancel_data, auto_connect=True)
-            except ImportError:
-                _logger.error("❌ Impossible d'importer MiddlewareClient")
-                return False
-            
-            if result.get('success'):
-                # Mettre à jour le statut du log original
-                credit_log.write({
-                    'status': 'cancelled',
-                    'cancelled_at': fields.Datetime.now(),
-                    'cancelled_by': self.env.user.id,
-                    'cancellation_response': str(result.get('response', ''))
-                })
-                
-                _logger.info(f"✅ Crédit #{credit_log.id} annulé avec succès")
-                
-                # Créer un nouveau log pour l'annulation (traçabilité complète)
-                self.env['pos.credit.log'].sudo().create({
-                    'user_id': self.env.user.id,
-                    'employee_id': self.env.user.employee_id.id if self.env.user.employee_id else False,
-                    'session_id': credit_log.session_id.id if credit_log.session_id else False,
-                    'order_line_id': credit_log.order_line_id.id if credit_log.order_line_id else False,
-                    'product_name': f"🔄 ANNULATION - {credit_log.product_name}",
-                    'plu_no': credit_log.plu_no,
-                    'quantity': credit_log.quantity,
-                    'server_no': credit_log.server_no,
-                    'success': True,
-                    'status': 'cancelled',
-                    'is_cancellation': True,
-                    'message': 'Annulation automatique suite à suppression de ligne',
-                    'response_payload': str(result.get('response', '')),
-                    'credit_id': credit_log.credit_id
-                })
-                
-                return True
-            else:
-                _logger.error(f"❌ Échec annulation crédit #{credit_log.id}: {result.get('message', 'Erreur inconnue')}")
-                
-                # Logger l'échec
-                credit_log.write({
-                    'message': f"Échec annulation: {result.get('message', 'Erreur inconnue')}"
-                })
-                
-                return False
-                
-        except Exception as e:
-            _logger.error(f"❌ Erreur lors de l'annulation du crédit: {str(e)}", exc_info=True)
-            return False
+        return self._cancel_credits_bulk(credit_log, 'Annulation automatique suite à suppression de ligne') > 0
+
+    @api.model
+    def _cancel_credits_bulk(self, credits, reason):
+        """
+        Annule entièrement des crédits dans le Flex/Hart96 en un seul envoi
+        (voir pos.credit.log._cancel_allocations)
+        
+        Returns:
+            int: Nombre d'unités annulées
+        """
+        return self.env['pos.credit.log']._cancel_allocations(
+            [(credit_log, credit_log.remaining_quantity) for credit_log in credits], reason
+        )
     
-    def _cancel_quantity_credits(self, line, qty_to_cancel):
+    def _cancel_quantity_credits(self, qty_to_cancel):
         """
-        Annule les crédits correspondant à une réduction de quantité
+        Annule les crédits correspondant à des réductions de quantité
         
         Args:
-            line: Ligne de commande concernée
-            qty_to_cancel: Nombre d'unités à annuler
+            qty_to_cancel (dict): {order_line_id: nombre d'unités à annuler}
         """
-        if qty_to_cancel <= 0:
+        lines = self.browse([line_id for line_id, qty in qty_to_cancel.items() if qty > 0])
+        if not lines:
             return
         
-        # Récupérer les crédits actifs pour cette ligne (les plus récents en premier)
+        # Unités à annuler réparties sur les crédits de chaque ligne, les plus récents d'abord
         try:
-            all_active_credits = self.env['pos.credit.log'].search([
-                ('order_line_id', '=', line.id),
-                ('status', '=', 'sent'),
-            ], order='create_date desc')
-            
-            # Limiter au nombre à annuler
-            active_credits = all_active_credits[:int(qty_to_cancel)] if all_active_credits else self.env['pos.credit.log']
+            credits_by_line = lines._get_active_credits_by_line()
         except Exception as e:
-            _logger.error(f"❌ Erreur récupération crédits pour annulation quantité: {str(e)}")
+            _logger.error("❌ Erreur récupération crédits pour annulation quantité: %s", e)
             return
+        allocations = [
+            allocation
+            for line_id, credits in credits_by_line.items()
+            for allocation in credits._allocate_quantity(qty_to_cancel[line_id])
+        ]
         
-        if not active_credits:
-            _logger.warning(f"⚠️ Aucun crédit actif trouvé pour annulation de quantité")
+        if not allocations:
+            _logger.warning("⚠️ Aucun crédit actif trouvé pour annulation de quantité")
             return
         
-        _logger.info(f"🔄 Annulation de {len(active_credits)} crédit(s) pour réduction de quantité")
-        
-        cancelled_count = 0
-        for credit_log in active_credits:
-            if self._cancel_credit_in_flex(credit_log):
-                cancelled_count += 1
-        
-        _logger.info(f"✅ {cancelled_count}/{len(active_credits)} crédit(s) annulé(s) avec succès")
+        _logger.debug("🔄 Annulation de %s unité(s) pour réduction de quantité", sum(units for _credit, units in allocations))
+        self.env['pos.credit.log']._cancel_allocations(allocations, 'Annulation suite à réduction de quantité')
     
     def action_cancel_credits(self):
         """
@@ -305,18 +243,16 @@ class PosOrderLine(models.Model):
         if not active_credits:
             raise UserError(_("Aucun crédit actif à annuler pour cette ligne."))
         
-        cancelled_count = 0
-        for credit_log in active_credits:
-            if self._cancel_credit_in_flex(credit_log):
-                cancelled_count += 1
+        active_units = sum(active_credits.mapped('remaining_quantity'))
+        cancelled_count = self._cancel_credits_bulk(active_credits, 'Annulation manuelle des crédits de la ligne')
         
         return {
             'type': 'ir.actions.client',
             'tag': 'display_notification',
             'params': {
                 'title': _('Annulation de crédits'),
-                'message': _('%d crédit(s) annulé(s) sur %d') % (cancelled_count, len(active_credits)),
-                'type': 'success' if cancelled_count == len(active_credits) else 'warning',
+                'message': _('%d crédit(s) annulé(s) sur %d') % (cancelled_count, active_units),
+                'type': 'success' if cancelled_count == active_units else 'warning',
                 'sticky': False,
             }
         } 
\ No newline at end of file
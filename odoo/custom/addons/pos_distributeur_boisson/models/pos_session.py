@@ -4,9 +4,12 @@ from odoo import models, api, fields, _
 from odoo.exceptions import UserError
 import logging
 import requests
-import json
+from contextlib import contextmanager
 from datetime import datetime
 from .middleware_client import MiddlewareClient
+from .dispatch_timing import StageTimer
+from .dispatch_planner import DispatchPlan
+from .credit_log_buffer import CreditLogBuffer
 
 _logger = logging.getLogger(__name__)
 
@@ -27,32 +30,29 @@ class PosSession(models.Model):
         if not self.env.user.has_group('pos_user_org.group_pos_barman'):
             raise UserError(_('Accès refusé: réservé aux Barmans'))
 
-    def _log_credit(self, product_name, plu_no, quantity, success, message, session=None, response=None, order_line_id=None):
+    def _log_credit(self, product_name, plu_no, quantity, success, message, session=None, response=None, order_line_id=None, credit_id=None, timer=None, buffer=None, server_no=None):
+        '''
+        Journalise un crédit envoyé avec succès
+
+        Avec `buffer` (voir _credit_log_buffer), la ligne est créée au flush
+        du tampon avec les autres lignes de l'envoi; sinon immédiatement.
+        '''
         # Ne journaliser que les succès
         if not success:
             return
+        pending = buffer if buffer is not None else CreditLogBuffer(session or self)
+        pending.add(product_name, plu_no, quantity, server_no=server_no, message=message, response=response, order_line_id=order_line_id, credit_id=credit_id, timer=timer)
+        if buffer is None:
+            pending.flush()
+
+    @contextmanager
+    def _credit_log_buffer(self):
+        '''Tampon de journalisation d'un envoi, vidé en un seul create à la sortie du bloc'''
+        buffer = CreditLogBuffer(self)
         try:
-            # Générer un ID unique pour ce crédit
-            import uuid
-            credit_id = f"CRED-{uuid.uuid4().hex[:8].upper()}"
-            
-            self.env['pos.credit.log'].sudo().create({
-                'user_id': self.env.user.id,
-                'employee_id': getattr(self.env.user, 'employee_id', False).id if getattr(self.env.user, 'employee_id', False) else False,
-                'session_id': (session or self).id if isinstance(self, self.__class__) else False,
-                'order_line_id': order_line_id,  # ✨ NOUVEAU
-                'product_name': product_name,
-                'plu_no': str(plu_no) if plu_no is not None else False,
-                'quantity': int(quantity or 1),
-                'server_no': self._get_current_server_no(),
-                'success': True,
-                'status': 'sent',  # ✨ NOUVEAU
-                'credit_id': credit_id,  # ✨ NOUVEAU
-                'message': message,
-                'response_payload': json.dumps(response) if isinstance(response, (dict, list)) else (response or ''),
-            })
-        except Exception as e:
-            _logger.warning(f"Impossible de journaliser le crédit POS: {str(e)}")
+            yield buffer
+        finally:
+            buffer.flush()
 
     def _get_boissons_disponibles(self):
         '''
@@ -72,7 +72,7 @@ class PosSession(models.Model):
                 'needs_distributor': product.needs_distributor,
                 'is_combo_product': product.is_combo_product
             }
-        _logger.info(f"Boissons nécessitant le distributeur trouvées: {len(boissons_dict)} produits")
+        _logger.debug("Boissons nécessitant le distributeur trouvées: %s produits", len(boissons_dict))
         return boissons_dict
 
     def _send_credit_to_middleware(self, credit_data):
@@ -86,109 +86,156 @@ class PosSession(models.Model):
         client = MiddlewareClient(self.env)
         return client.send_credit(credit_data)
 
+    def _send_credits_batch_to_middleware(self, credits_list):
+        '''
+        Envoie plusieurs crédits au middleware Hart96 en une seule requête
+        Retourne un résultat par crédit, dans l'ordre de credits_list
+        '''
+        server_no = None
+        prepared = []
+        for credit_data in credits_list:
+            if not credit_data.get('server_no'):
+                if server_no is None:
+                    server_no = self._get_current_server_no()
+                credit_data = dict(credit_data, server_no=server_no)
+            prepared.append(credit_data)
+        client = MiddlewareClient(self.env)
+        return client.send_credits_batch(prepared)
+
+    def _is_async_dispatch(self):
+        '''Indique si les crédits doivent passer par la file d'attente (pos.credit.outbox)'''
+        return self.env['pos.distributeur.settings']._get_settings()['async_dispatch']
+
+    def _prepare_outbox_vals(self, product_name, plu_no, quantity, server_no, order_ref=None):
+        return {
+            'session_id': self[:1].id,
+            'user_id': self.env.user.id,
+            'order_ref': order_ref,
+            'product_name': product_name,
+            'plu_no': str(plu_no),
+            'server_no': int(server_no),
+            'sign': '+',
+            'quantity': int(quantity or 1),
+        }
+
+    def _prefetch_commande_products(self, items):
+        '''
+        Charge en une fois les produits et recettes de toute la commande
+
+        Returns:
+            dict: {product_id: product.product} des produits existants
+        '''
+        product_ids = list({item['product_id'] for item in items if item.get('product_id')})
+        products = self.env['product.product'].browse(product_ids).exists()
+        products.fetch(['name', 'plu_code', 'is_distributeur_boisson', 'needs_distributor', 'is_combo_product', 'product_tmpl_id'])
+        products.product_tmpl_id.fetch(['cocktail_recipe'])
+        return {product.id: product for product in products}
+
+    def _expand_commande_item(self, item, products=None):
+        '''
+        Développe un item de commande en crédits Hart96, sans rien envoyer
+
+        Returns:
+            dict: product, type ('cocktail' ou 'simple_drink'), ingredients,
+                credits [(nom, PLU, quantité)] et result: résultat immédiat
+                (erreur, boisson directe) quand il n'y a rien à envoyer
+        '''
+        product_id = item.get('product_id')
+        quantity = item.get('quantity', 1)
+        expansion = {'product': None, 'type': None, 'ingredients': [], 'credits': [], 'result': None}
+        if not product_id:
+            expansion['result'] = {'success': False, 'message': 'ID produit manquant'}
+            return expansion
+        if products is not None:
+            product = products.get(product_id) or self.env['product.product']
+        else:
+            product = self.env['product.product'].browse(product_id).exists()
+        if not product:
+            expansion['result'] = {'success': False, 'message': f'Produit {product_id} introuvable'}
+            return expansion
+        expansion['product'] = product
+        # Le frontend signale les cocktails (is_cocktail). Même filtre que le bouton POS:
+        # un produit marqué distributeur (l'un ou l'autre drapeau) avec un PLU reçoit son crédit
+        if not item.get('is_cocktail') and not (product.is_distributeur_boisson or product.needs_distributor):
+            expansion['result'] = {'success': False, 'message': _(f'Le produit "{product.name}" n\'est pas une boisson du distributeur')}
+            return expansion
+        if item.get('is_cocktail') or self._is_cocktail(product):
+            expansion['type'] = 'cocktail'
+            ingredients = self._get_cocktail_ingredients(product)
+            if not ingredients:
+                expansion['result'] = {'success': False, 'message': _(f'Aucun ingrédient trouvé pour le cocktail "{product.name}"')}
+                return expansion
+            expansion['ingredients'] = ingredients
+            expansion['credits'] = [
+                (f"{product.name} - {ingredient_info['name']}", ingredient_info.get('plu_code') or ingredient_info.get('plu_no'), quantity)
+                for ingredient_info in ingredients
+            ]
+        elif not product.plu_code:
+            expansion['result'] = {'success': False, 'message': _(f'Le produit "{product.name}" n\'a pas de code PLU configuré')}
+        else:
+            expansion['type'] = 'simple_drink'
+            expansion['credits'] = [(product.name, product.plu_code, quantity)]
+        return expansion
+
+    def _enqueue_commande(self, commande_data):
+        '''
+        Met en file d'attente tous les crédits d'une commande et rend la main
+        Les crédits sont envoyés par le cron de dispatch après validation de la transaction
+        '''
+        self._ensure_user_is_barman()
+        server_no = self._get_current_server_no()
+        order_ref = commande_data.get('order_id')
+        items = commande_data.get('items', [])
+        results = []
+        vals_list = []
+        direct_count = 0
+        error_count = 0
+        products = self._prefetch_commande_products(items)
+        for item in items:
+            expansion = self._expand_commande_item(item, products)
+            result = expansion['result']
+            if result is not None:
+                results.append(dict(result, item=item))
+                if not result['success']:
+                    error_count += 1
+                elif result.get('direct_drink'):
+                    direct_count += 1
+                continue
+            for product_name, plu_no, quantity in expansion['credits']:
+                vals_list.append(self._prepare_outbox_vals(product_name, plu_no, quantity, server_no, order_ref))
+            product = expansion['product']
+            if expansion['type'] == 'cocktail':
+                message = _(f'Cocktail "{product.name}" mis en file d\'attente ({len(expansion["ingredients"])} ingrédients)')
+            else:
+                message = _(f'Boisson "{product.name}" mise en file d\'attente (Qty: {item.get("quantity", 1)})')
+            results.append({'item': item, 'success': True, 'queued': True, 'message': message})
+        if vals_list:
+            self.env['pos.credit.outbox']._enqueue(vals_list)
+        queued_count = len(items) - direct_count - error_count
+        return {
+            'success': error_count == 0,
+            'queued': True,
+            'message': f"Commande mise en file d'attente: {len(vals_list)} crédit(s) pour {queued_count} boisson(s)" if not error_count else f"Erreurs lors du traitement: {error_count}/{len(items)} items en échec",
+            'items_processed': len(items),
+            'distributor_items': queued_count,
+            'direct_items': direct_count,
+            'error_items': error_count,
+            'queued_credits': len(vals_list),
+            'details': results
+        }
+
     def _is_cocktail(self, product):
         return product.is_combo_product
 
     def _get_cocktail_ingredients(self, product):
         '''
-        Récupère les ingrédients d'un cocktail depuis les combos Odoo
+        Retourne les ingrédients d'un cocktail depuis sa recette compilée
+        (product.template.cocktail_recipe), sans parcourir les combos
         '''
-        _logger.info(f"🍹 Récupération des ingrédients pour le cocktail: {product.name}")
-        
-        try:
-            # Utiliser la méthode get_cocktail_ingredients du modèle product.product
-            if hasattr(product, 'get_cocktail_ingredients'):
-                ingredients = product.get_cocktail_ingredients()
-                _logger.info(f"🍹 Ingrédients récupérés via get_cocktail_ingredients: {len(ingredients) if ingredients else 0}")
-                if ingredients:
-                    return ingredients
-            
-            # Si pas d'ingrédients trouvés, essayer de récupérer depuis les ingrédients sélectionnés
-            if hasattr(product, 'selected_combo_ingredient_ids') and product.selected_combo_ingredient_ids:
-                ingredients = []
-                for ingredient_option in product.selected_combo_ingredient_ids:
-                    if ingredient_option.product_id and ingredient_option.product_id.plu_code:
-                        ingredients.append({
-                            'plu_code': ingredient_option.product_id.plu_code,
-                            'name': ingredient_option.product_id.name,
-                            'price': ingredient_option.product_id.list_price,
-                            'quantity': 1,
-                            'credits': ingredient_option.credits_per_serving or 1,
-                            'product_id': ingredient_option.product_id.id,
-                            'category_name': ingredient_option.combo_category_id.name if ingredient_option.combo_category_id else '',
-                            'price_extra': ingredient_option.price_extra
-                        })
-                _logger.info(f"🍹 Ingrédients récupérés via selected_combo_ingredient_ids: {len(ingredients)}")
-                if ingredients:
-                    return ingredients
-            
-            # Si pas d'ingrédients trouvés, essayer de récupérer depuis les combos
-            if hasattr(product, 'combo_line_ids') and product.combo_line_ids:
-                ingredients = []
-                for combo_line in product.combo_line_ids:
-                    if combo_line.product_id and combo_line.product_id.is_distributeur_boisson:
-                        ingredients.append({
-                            'plu_no': combo_line.product_id.plu_code or f'PLU{combo_line.product_id.id}',
-                            'name': combo_line.product_id.name,
-                            'price': combo_line.product_id.list_price,
-                            'quantity': combo_line.quantity or 1,
-                            'credits': combo_line.product_id.credits_per_serving or 1,
-                            'product_id': combo_line.product_id.id
-                        })
-                _logger.info(f"🍹 Ingrédients récupérés via combo_line_ids: {len(ingredients)}")
-                if ingredients:
-                    return ingredients
-            
-            # Si toujours pas d'ingrédients, essayer de récupérer depuis les produits liés
-            if hasattr(product, 'product_template_id') and product.product_template_id:
-                template = product.product_template_id
-                if hasattr(template, 'combo_line_ids') and template.combo_line_ids:
-                    ingredients = []
-                    for combo_line in template.combo_line_ids:
-                        if combo_line.product_id and combo_line.product_id.is_distributeur_boisson:
-                            ingredients.append({
-                                'plu_no': combo_line.product_id.plu_code or f'PLU{combo_line.product_id.id}',
-                                'name': combo_line.product_id.name,
-                                'price': combo_line.product_id.list_price,
-                                'quantity': combo_line.quantity or 1,
-                                'credits': combo_line.product_id.credits_per_serving or 1,
-                                'product_id': combo_line.product_id.id
-                            })
-                    _logger.info(f"🍹 Ingrédients récupérés via template combo_line_ids: {len(ingredients)}")
-                    if ingredients:
-                        return ingredients
-            
-            # Si toujours pas d'ingrédients, essayer de récupérer depuis les attributs
-            if hasattr(product, 'attribute_line_ids') and product.attribute_line_ids:
-                ingredients = []
-                for attr_line in product.attribute_line_ids:
-                    if attr_line.product_id and attr_line.product_id.is_distributeur_boisson:
-                        ingredients.append({
-                            'plu_no': attr_line.product_id.plu_code or f'PLU{attr_line.product_id.id}',
-                            'name': attr_line.product_id.name,
-                            'price': attr_line.product_id.list_price,
-                            'quantity': 1,
-                            'credits': attr_line.product_id.credits_per_serving or 1,
-                            'product_id': attr_line.product_id.id
-                        })
-                _logger.info(f"🍹 Ingrédients récupérés via attribute_line_ids: {len(ingredients)}")
-                if ingredients:
-                    return ingredients
-            
-            # Si toujours pas d'ingrédients, utiliser des ingrédients par défaut
-            _logger.warning(f"🍹 Aucun ingrédient trouvé pour le cocktail {product.name}, utilisation d'ingrédients par défaut")
-            return [
-                {'plu_no': 'BASE001', 'name': 'Base par défaut', 'price': 0.0, 'quantity': 1, 'credits': 1, 'product_id': 0},
-                {'plu_no': 'MIX001', 'name': 'Mélange par défaut', 'price': 0.0, 'quantity': 1, 'credits': 1, 'product_id': 0}
-            ]
-            
-        except Exception as e:
-            _logger.error(f"🍹 Erreur lors de la récupération des ingrédients: {str(e)}")
-            # Retourner des ingrédients par défaut en cas d'erreur
-            return [
-                {'plu_no': 'BASE001', 'name': 'Base par défaut', 'price': 0.0, 'quantity': 1, 'credits': 1, 'product_id': 0},
-                {'plu_no': 'MIX001', 'name': 'Mélange par défaut', 'price': 0.0, 'quantity': 1, 'credits': 1, 'product_id': 0}
-            ]
+        ingredients = product.product_tmpl_id._get_cocktail_recipe()
+        if not ingredients:
+            _logger.warning("🍹 Recette vide pour le cocktail %s", product.name)
+        return ingredients
     
     @api.model
     def distribuer_boisson(self, product_id, quantity=1, server_name=None):
@@ -196,37 +243,42 @@ class PosSession(models.Model):
         # Sécurité Barman
         self._ensure_user_is_barman()
         try:
-            product = self.env['product.product'].browse(product_id)
-            if not product.exists():
-                return {'success': False, 'message': 'Produit introuvable'}
-            if not product.is_distributeur_boisson:
-                return {'success': False, 'message': _(f'Le produit "{product.name}" n\'est pas une boisson du distributeur')}
-            if not product.needs_distributor:
-                return {'success': True, 'message': _(f'Boisson directe "{product.name}" - aucune action distributeur nécessaire'), 'direct_drink': True}
-            is_cocktail = self._is_cocktail(product) or product.get('is_cocktail', False)
+            timer = StageTimer()
+            with timer.stage('lookup'):
+                product = self.env['product.product'].browse(product_id)
+                if not product.exists():
+                    return {'success': False, 'message': 'Produit introuvable'}
+                if not product.is_distributeur_boisson:
+                    return {'success': False, 'message': _(f'Le produit "{product.name}" n\'est pas une boisson du distributeur')}
+                if not product.needs_distributor:
+                    return {'success': True, 'message': _(f'Boisson directe "{product.name}" - aucune action distributeur nécessaire'), 'direct_drink': True}
+                is_cocktail = self._is_cocktail(product)
             if is_cocktail:
-                return self._distribuer_cocktail(product, quantity, server_name)
+                return self._distribuer_cocktail(product, quantity, server_name, timer=timer)
             else:
-                return self._distribuer_boisson_simple(product, quantity, server_name)
+                return self._distribuer_boisson_simple(product, quantity, server_name, timer=timer)
         except Exception as e:
             _logger.error(f"Erreur lors de la distribution: {str(e)}")
             return {'success': False, 'message': f'Erreur: {str(e)}'}
 
-    def _distribuer_boisson_simple(self, product, quantity, server_name=None):
+    def _distribuer_boisson_simple(self, product, quantity, server_name=None, timer=None):
         '''Distribue une boisson simple'''
         self._ensure_user_is_barman()
+        timer = timer if timer is not None else StageTimer()
         if not product.plu_code:
             return {'success': False, 'message': _(f'Le produit "{product.name}" n\'a pas de code PLU configuré')}
-        server_no = self._get_current_server_no()
+        with timer.stage('server_no'):
+            server_no = self._get_current_server_no()
         credit_data = {
             'server_no': int(server_no),
             'plu_no': product.plu_code,
             'sign': '+',
             'quantity': quantity
         }
-        _logger.info(f"Envoi crédit boisson simple: {product.name} (PLU: {product.plu_code}, Qty: {quantity}, Server: {server_no})")
+        _logger.debug("Envoi crédit boisson simple: %s (PLU: %s, Qty: %s, Server: %s)", product.name, product.plu_code, quantity, server_no)
         result = self._send_credit_to_middleware(credit_data)
-        self._log_credit(product.name, product.plu_code, quantity, result.get('success'), result.get('message'), session=self, response=result)
+        timer.merge(result.get('timings'))
+        self._log_credit(product.name, product.plu_code, quantity, result.get('success'), result.get('message'), session=self, response=result, timer=timer, server_no=server_no)
         if result['success']:
             return {
                 'success': True,
@@ -247,38 +299,46 @@ class PosSession(models.Model):
                 'error_details': result
             }
 
-    def _distribuer_cocktail(self, product, quantity, server_name=None):
+    def _distribuer_cocktail(self, product, quantity, server_name=None, timer=None):
         '''Distribue un cocktail'''
         self._ensure_user_is_barman()
-        _logger.info(f"🍹 Traitement du cocktail: {product.name}")
-        ingredients_list = self._get_cocktail_ingredients(product)
-        _logger.info(f"🍹 Ingrédients trouvés: {len(ingredients_list)}")
+        timer = timer if timer is not None else StageTimer()
+        _logger.debug("🍹 Traitement du cocktail: %s", product.name)
+        with timer.stage('lookup'):
+            ingredients_list = self._get_cocktail_ingredients(product)
+        _logger.debug("🍹 Ingrédients trouvés: %s", len(ingredients_list))
         if not ingredients_list:
             return {'success': False, 'message': _(f'Aucun ingrédient trouvé pour le cocktail "{product.name}"')}
-        success_count = 0
-        results = []
-        server_no = self._get_current_server_no()
-        _logger.info(f"🍹 Envoi des ingrédients (Server: {server_no})...")
-        for i, ingredient_info in enumerate(ingredients_list):
-            ingredient_plu = ingredient_info.get('plu_code') or ingredient_info.get('plu_no')
-            credit_data = {
+        with timer.stage('server_no'):
+            server_no = self._get_current_server_no()
+        _logger.debug("🍹 Envoi groupé des ingrédients (Server: %s)", server_no)
+        credits_list = []
+        for ingredient_info in ingredients_list:
+            credits_list.append({
                 'server_no': int(server_no),
-                'plu_no': ingredient_plu,
+                'plu_no': ingredient_info.get('plu_code') or ingredient_info.get('plu_no'),
                 'sign': '+',
                 'quantity': quantity
-            }
-            result = self._send_credit_to_middleware(credit_data)
-            self._log_credit(f"{product.name} - {ingredient_info['name']}", ingredient_plu, quantity, result.get('success'), result.get('message'), session=self, response=result)
-            results.append({
-                'ingredient_plu': ingredient_plu,
-                'ingredient_name': ingredient_info['name'],
-                'success': result['success'],
-                'message': result['message']
             })
-            if result['success']:
-                success_count += 1
-        total_credits_expected = len(ingredients_list) * quantity
-        _logger.info(f"🍹 Résumé: {success_count}/{total_credits_expected} ingrédients envoyés avec succès")
+        batch_result = self._send_credits_batch_to_middleware(credits_list)
+        timer.merge(batch_result.get('timings'))
+        success_count = 0
+        results = []
+        with self._credit_log_buffer() as log_buffer:
+            for ingredient_info, credit_data, result in zip(ingredients_list, credits_list, batch_result['results']):
+                ingredient_plu = credit_data['plu_no']
+                self._log_credit(f"{product.name} - {ingredient_info['name']}", ingredient_plu, quantity, result.get('success'), result.get('message'), session=self, response=result, timer=timer, buffer=log_buffer, server_no=credit_data['server_no'])
+                results.append({
+                    'ingredient_plu': ingredient_plu,
+                    'ingredient_name': ingredient_info['name'],
+                    'success': result['success'],
+                    'message': result['message']
+                })
+                if result['success']:
+                    success_count += 1
+        # Chaque trame porte déjà la quantité: un succès par ingrédient est attendu
+        total_credits_expected = len(ingredients_list)
+        _logger.debug("🍹 Résumé: %s/%s ingrédients envoyés avec succès", success_count, total_credits_expected)
         cocktail_info = {
             'name': product.name,
             'type': 'cocktail',
@@ -413,55 +473,62 @@ class PosSession(models.Model):
         Vérifie le statut de connexion avec le middleware Hart96
         
         Returns:
-            dict: Statut de la connexion
+            dict: Statut de la connexion, avec l'état du disjoncteur ('breaker')
         '''
-        try:
-            base_url = self.env['ir.config_parameter'].sudo().get_param(
-                'pos_distributeur.middleware_url', 
-                'http://127.0.0.1:5000'  # Port par défaut du middleware Hart96
-            )
-            
-            # Tenter de contacter le middleware Hart96
-            response = requests.get(f"{base_url}/api/status", timeout=5)
-            
-            if response.status_code == 200:
-                try:
-                    response_data = response.json()
-                    if response_data.get('connected'):
-                        return {
-                            'success': True,
-                            'message': 'Middleware Hart96 connecté et disponible',
-                            'url': base_url,
-                            'connected': True,
-                            'port': response_data.get('port'),
-                            'baudrate': response_data.get('baudrate')
-                        }
-                    else:
-                        return {
-                            'success': False,
-                            'message': 'Middleware Hart96 disponible mais non connecté au port série',
-                            'url': base_url,
-                            'connected': False
-                        }
-                except json.JSONDecodeError:
-                    return {
-                        'success': True,
-                        'message': 'Middleware Hart96 disponible',
-                        'url': base_url
-                    }
-            else:
+        client = MiddlewareClient(self.env)
+        status = self._verifier_statut_middleware(client)
+        breaker_status = client._get_breaker().get_status()
+        status['breaker'] = breaker_status
+        if breaker_status['state'] != 'closed':
+            status['message'] = f"{status['message']} (disjoncteur {breaker_status['state']}, {breaker_status['consecutive_failures']} échec(s) consécutif(s))"
+        return status
+
+    @api.model
+    def _verifier_statut_middleware(self, client):
+        # Même URL que le chemin d'envoi (paramètres en cache)
+        base_url = client._get_middleware_url()
+        
+        # Dernier statut connu (sonde d'arrière-plan), sans aller-retour réseau
+        status = client._get_health().get_status()
+        
+        if status['reachable']:
+            if status['connected']:
+                return {
+                    'success': True,
+                    'message': 'Middleware Hart96 connecté et disponible',
+                    'url': base_url,
+                    'connected': True,
+                    'port': status['port'],
+                    'baudrate': status['baudrate'],
+                    'age': status['age']
+                }
+            elif isinstance(status['payload'], dict):
                 return {
                     'success': False,
-                    'message': f'Middleware Hart96 indisponible: {response.status_code}',
-                    'url': base_url
+                    'message': 'Middleware Hart96 disponible mais non connecté au port série',
+                    'url': base_url,
+                    'connected': False,
+                    'age': status['age']
                 }
-                
-        except Exception as e:
+            return {
+                'success': True,
+                'message': 'Middleware Hart96 disponible',
+                'url': base_url,
+                'age': status['age']
+            }
+        elif status['status_code']:
             return {
                 'success': False,
-                'message': f'Impossible de contacter le middleware Hart96: {str(e)}',
-                'url': base_url
+                'message': f"Middleware Hart96 indisponible: {status['status_code']}",
+                'url': base_url,
+                'age': status['age']
             }
+        return {
+            'success': False,
+            'message': f"Impossible de contacter le middleware Hart96: {status['error']}",
+            'url': base_url,
+            'age': status['age']
+        }
 
     # Méthodes de compatibilité pour l'ancien système
     @api.model
@@ -488,14 +555,14 @@ class PosSession(models.Model):
     @api.model
     def envoyer_commande_distributeur(self, commande_data):
         '''
-        Envoie une commande complète au distributeur en utilisant la nouvelle logique
-        # Ajouter dans pos_session.py
+        Envoie une commande complète au distributeur
 
+        Tous les items (boissons et recettes des cocktails) sont développés en
+        un plan de trames regroupées par (server_no, PLU), envoyé en une seule
+        requête middleware sur une seule session série.
         '''
         try:
-            _logger.info(f"=== DÉBUT: Endpoint envoyer_commande_distributeur appelé ===")
-            _logger.info(f"Arguments reçus: {commande_data}")
-            _logger.info(f"Traitement de la commande {commande_data.get('order_id', 'N/A')} pour le distributeur")
+            _logger.debug("Commande %s pour le distributeur: %s", commande_data.get('order_id', 'N/A'), commande_data)
             
             items = commande_data.get('items', [])
             if not items:
@@ -505,42 +572,49 @@ class PosSession(models.Model):
                     'items_processed': 0
                 }
             
+            if self._is_async_dispatch():
+                return self._enqueue_commande(commande_data)
+            
+            self._ensure_user_is_barman()
+            timer = StageTimer()
+            with timer.stage('server_no'):
+                server_no = self._get_current_server_no()
+            
+            # Développer chaque item en crédits et les regrouper par (server_no, PLU)
+            plan = DispatchPlan()
+            expansions = []
+            with timer.stage('lookup'):
+                products = self._prefetch_commande_products(items)
+            for index, item in enumerate(items):
+                with timer.stage('lookup'):
+                    expansion = self._expand_commande_item(item, products)
+                expansions.append(expansion)
+                for product_name, plu_no, quantity in expansion['credits']:
+                    plan.add(server_no, plu_no, quantity, index, product_name)
+            
+            frame_results = {}
+            offline = False
+            if plan:
+                _logger.debug("Plan de la commande %s: %s trame(s) pour %s crédit(s)", commande_data.get('order_id', 'N/A'), len(plan), plan.source_count)
+                batch_result = self._send_credits_batch_to_middleware(plan.credits_list())
+                timer.merge(batch_result.get('timings'))
+                offline = bool(batch_result.get('offline'))
+                with self._credit_log_buffer() as log_buffer:
+                    for frame, result in zip(plan.frames, batch_result['results']):
+                        frame_results[id(frame)] = result
+                        self._log_plan_frame(frame, result, timer, log_buffer)
+            
             results = []
             success_count = 0
             direct_count = 0
             error_count = 0
-            
-            # Traiter chaque item de la commande
-            for item in items:
-                product_id = item.get('product_id')
-                quantity = item.get('quantity', 1)
-                
-                if not product_id:
-                    results.append({
-                        'item': item,
-                        'success': False,
-                        'message': 'ID produit manquant'
-                    })
-                    error_count += 1
-                    continue
-                
-                # Vérifier si c'est un cocktail selon le flag envoyé par le frontend
-                is_cocktail = item.get('is_cocktail', False)
-                
-                if is_cocktail:
-                    _logger.info(f"🍹 Traitement d'un cocktail (ID: {product_id})")
-                    # Pour les cocktails, on appelle directement _distribuer_cocktail
-                    product = self.env['product.product'].browse(product_id)
-                    if product.exists():
-                        result = self._distribuer_cocktail(product, quantity)
-                    else:
-                        result = {
-                            'success': False,
-                            'message': f'Produit {product_id} introuvable'
-                        }
-                else:
-                    # Distribuer la boisson normale
-                    result = self.distribuer_boisson(product_id, quantity)
+            item_frames = plan.item_frames()
+            for index, (item, expansion) in enumerate(zip(items, expansions)):
+                result = expansion['result']
+                if result is None:
+                    result = self._plan_item_result(item, expansion, [frame_results[id(frame)] for frame in item_frames.get(index, [])])
+                    if offline:
+                        result['offline'] = True
                 results.append({
                     'item': item,
                     'success': result['success'],
@@ -575,16 +649,19 @@ class PosSession(models.Model):
                     'items_processed': total_items,
                     'distributor_items': success_count,
                     'direct_items': direct_count,
+                    'frames_sent': len(plan),
                     'details': results
                 }
             else:
                 return {
                     'success': False,
+                    'offline': offline,
                     'message': f"Erreurs lors du traitement: {error_count}/{total_items} items en échec",
                     'items_processed': total_items,
                     'distributor_items': success_count,
                     'direct_items': direct_count,
                     'error_items': error_count,
+                    'frames_sent': len(plan),
                     'details': results
                 }
         except Exception as e:
@@ -594,6 +671,53 @@ class PosSession(models.Model):
                 'message': f'Erreur: {str(e)}'
             }
 
+    def _log_plan_frame(self, frame, result, timer, buffer=None):
+        '''
+        Journalise une trame du plan produit par produit
+
+        Chaque source (boisson ou ingrédient) garde sa ligne et sa quantité dans
+        pos.credit.log; la première reprend le credit_id de la trame, les
+        suivantes un suffixe .2, .3...
+        '''
+        for position, source in enumerate(frame['sources'], start=1):
+            credit_id = result.get('credit_id')
+            if credit_id and position > 1:
+                credit_id = f"{credit_id}.{position}"
+            self._log_credit(source['product_name'], frame['plu_no'], source['quantity'], result.get('success'), result.get('message'), session=self, response=result, credit_id=credit_id, timer=timer, buffer=buffer, server_no=frame['server_no'])
+
+    def _plan_item_result(self, item, expansion, frame_results):
+        '''Résultat d'un item à partir des trames qui le contiennent'''
+        product = expansion['product']
+        quantity = item.get('quantity', 1)
+        success_count = sum(1 for result in frame_results if result.get('success'))
+        if expansion['type'] == 'cocktail':
+            ingredients_list = expansion['ingredients']
+            if frame_results and success_count == len(frame_results):
+                return {
+                    'success': True,
+                    'message': _(f'Cocktail "{product.name}" distribué avec succès (Qty: {quantity}, Ingrédients: {len(ingredients_list)})'),
+                    'product_name': product.name,
+                    'quantity': quantity,
+                    'type': 'cocktail',
+                    'ingredients_list': ingredients_list,
+                }
+            if success_count:
+                message = _(f'Distribution partielle du cocktail "{product.name}": {success_count}/{len(frame_results)} ingrédients envoyés')
+            else:
+                message = _(f'Échec complet de la distribution du cocktail "{product.name}"')
+            return {'success': False, 'message': message, 'ingredients_list': ingredients_list}
+        if frame_results and success_count == len(frame_results):
+            return {
+                'success': True,
+                'message': _(f'Boisson "{product.name}" commandée avec succès (Qty: {quantity})'),
+                'product_name': product.name,
+                'plu_no': product.plu_code,
+                'quantity': quantity,
+                'type': 'simple_drink',
+            }
+        error = frame_results[0].get('message') if frame_results else 'Aucune trame envoyée'
+        return {'success': False, 'message': _(f'Erreur lors de la commande de "{product.name}": {error}'), 'error_details': frame_results}
+
     @api.model
     def test_rpc_access(self):
         '''
@@ -606,75 +730,62 @@ class PosSession(models.Model):
             'timestamp': str(datetime.now())
         }
     
+    @api.model
+    def _allocate_session_credits(self, session_id, quantity_by_plu):
+        '''
+        Répartit les unités à annuler sur les crédits encore annulables de la session
+
+        Une seule requête pour tous les PLU; les crédits les plus récents sont
+        consommés d'abord, quantité restante par quantité restante.
+
+        Args:
+            quantity_by_plu (dict): {plu_no: unités à annuler}
+
+        Returns:
+            list: [(pos.credit.log, unités)]
+        '''
+        credits = self.env['pos.credit.log'].search([
+            ('plu_no', 'in', list(quantity_by_plu)),
+            ('status', '=', 'sent'),
+            ('remaining_quantity', '>', 0),
+            ('session_id', '=', session_id),
+        ], order='create_date desc, id desc')
+        credits_by_plu = {}
+        for credit_log in credits:
+            credits_by_plu.setdefault(credit_log.plu_no, []).append(credit_log.id)
+        return [
+            allocation
+            for plu_no, credit_ids in credits_by_plu.items()
+            for allocation in credits.browse(credit_ids)._allocate_quantity(quantity_by_plu[plu_no])
+        ]
+
     @api.model
     def cancel_simple_drink_credits(self, session_id, plu_no, quantity, product_name):
         """
         Annule les crédits d'une boisson simple
         Appelé depuis le JavaScript lors de la décrémentation
         """
-        _logger.info(f"🔄 Annulation demandée: {product_name} (PLU: {plu_no}, Qty: {quantity})")
+        _logger.debug("🔄 Annulation demandée: %s (PLU: %s, Qty: %s)", product_name, plu_no, quantity)
         
         try:
             # Vérifier droits Barman
             self._ensure_user_is_barman()
+            product_name = product_name or self.env['pos.distributeur.plu.index']._lookup_name(plu_no) or str(plu_no)
             
-            # Chercher les crédits les plus récents pour ce PLU (non annulés)
-            credits_to_cancel = self.env['pos.credit.log'].search([
-                ('plu_no', '=', str(plu_no)),
-                ('status', '=', 'sent'),
-                ('session_id', '=', session_id)
-            ], order='create_date desc', limit=int(quantity))
+            # Répartir les unités sur les crédits les plus récents de ce PLU (quantité restante)
+            allocations = self._allocate_session_credits(session_id, {str(plu_no): quantity})
             
-            if not credits_to_cancel:
+            if not allocations:
                 _logger.warning(f"⚠️ Aucun crédit actif trouvé pour PLU {plu_no}")
                 return {
                     'success': False,
                     'message': f'Aucun crédit actif à annuler pour {product_name}'
                 }
             
-            # Annuler chaque crédit
-            cancelled_count = 0
-            for credit_log in credits_to_cancel:
-                # Préparer les données d'annulation
-                cancel_data = {
-                    'server_no': credit_log.server_no,
-                    'plu_no': credit_log.plu_no,
-                    'sign': '-',
-                    'quantity': 1
-                }
-                
-                # Envoyer au middleware
-                from .middleware_client import MiddlewareClient
-                client = MiddlewareClient(self.env)
-                result = client.send_credit(cancel_data, auto_connect=True)
-                
-                if result.get('success'):
-                    # Mettre à jour le log
-                    credit_log.write({
-                        'status': 'cancelled',
-                        'cancelled_at': fields.Datetime.now(),
-                        'cancelled_by': self.env.user.id,
-                        'cancellation_response': str(result.get('response', ''))
-                    })
-                    
-                    # Créer log d'annulation
-                    self.env['pos.credit.log'].sudo().create({
-                        'user_id': self.env.user.id,
-                        'employee_id': self.env.user.employee_id.id if self.env.user.employee_id else False,
-                        'session_id': session_id,
-                        'product_name': f"🔄 ANNULATION - {product_name}",
-                        'plu_no': credit_log.plu_no,
-                        'quantity': 1,
-                        'server_no': credit_log.server_no,
-                        'success': True,
-                        'status': 'cancelled',
-                        'is_cancellation': True,
-                        'message': 'Annulation suite à décrémentation POS',
-                        'response_payload': str(result.get('response', ''))
-                    })
-                    
-                    cancelled_count += 1
-                    _logger.info(f"✅ Crédit #{credit_log.id} annulé")
+            # Une trame négative par (server_no, PLU), un seul envoi
+            cancelled_count = self.env['pos.credit.log']._cancel_allocations(
+                allocations, 'Annulation suite à décrémentation POS', product_name=product_name
+            )
             
             return {
                 'success': True,
@@ -695,7 +806,7 @@ class PosSession(models.Model):
         Annule les crédits d'un cocktail (tous les ingrédients)
         Appelé depuis le JavaScript lors de la décrémentation
         """
-        _logger.info(f"🍹 Annulation cocktail demandée: Product ID {product_id}, Qty: {quantity}")
+        _logger.debug("🍹 Annulation cocktail demandée: Product ID %s, Qty: %s", product_id, quantity)
         
         try:
             # Vérifier droits Barman
@@ -709,15 +820,8 @@ class PosSession(models.Model):
                     'message': f'Produit {product_id} introuvable'
                 }
             
-            # Récupérer les ingrédients
-            ingredients = []
-            if hasattr(product, 'selected_combo_ingredient_ids') and product.selected_combo_ingredient_ids:
-                for ingredient_option in product.selected_combo_ingredient_ids:
-                    if ingredient_option.product_id and ingredient_option.product_id.plu_code:
-                        ingredients.append({
-                            'plu_code': ingredient_option.product_id.plu_code,
-                            'name': ingredient_option.product_id.name,
-                        })
+            # Mêmes ingrédients que lors de l'envoi (recette compilée)
+            ingredients = self._get_cocktail_ingredients(product)
             
             if not ingredients:
                 _logger.warning(f"⚠️ Aucun ingrédient trouvé pour le cocktail {product.name}")
@@ -726,17 +830,15 @@ class PosSession(models.Model):
                     'message': f'Aucun ingrédient à annuler pour {product.name}'
                 }
             
-            # Annuler les crédits de chaque ingrédient
-            total_cancelled = 0
+            # Annuler les crédits de tous les ingrédients en un seul envoi
+            quantity_by_plu = {}
             for ingredient in ingredients:
-                result = self.cancel_simple_drink_credits(
-                    session_id,
-                    ingredient['plu_code'],
-                    quantity,
-                    f"{product.name} - {ingredient['name']}"
-                )
-                if result.get('success'):
-                    total_cancelled += result.get('cancelled_count', 0)
+                plu_no = str(ingredient['plu_code'])
+                quantity_by_plu[plu_no] = quantity_by_plu.get(plu_no, 0) + int(quantity or 1)
+            allocations = self._allocate_session_credits(session_id, quantity_by_plu)
+            total_cancelled = self.env['pos.credit.log']._cancel_allocations(
+                allocations, 'Annulation suite à décrémentation POS'
+            )
             
             return {
                 'success': True,
@@ -755,18 +857,31 @@ class PosSession(models.Model):
     def send_credit_to_middleware(self, credit_data):
         """Proxy RPC avec contrôle Barmans, server_no employé et journalisation"""
         self._ensure_user_is_barman()
-        _logger.info(f"📤 RPC: Envoi crédit au middleware Hart96")
-        _logger.info(f"📤 Données reçues: {credit_data}")
+        _logger.debug("📤 RPC: Envoi crédit au middleware Hart96: %s", credit_data)
         # Forcer server_no depuis employé
+        timer = StageTimer()
         credit_data = dict(credit_data or {})
-        credit_data['server_no'] = self._get_current_server_no()
+        if not credit_data.get('product_name'):
+            with timer.stage('lookup'):
+                credit_data['product_name'] = self.env['pos.distributeur.plu.index']._lookup_name(credit_data.get('plu_no'))
+        with timer.stage('server_no'):
+            credit_data['server_no'] = self._get_current_server_no()
+        if self._is_async_dispatch():
+            outbox = self.env['pos.credit.outbox']._enqueue([self._prepare_outbox_vals(
+                credit_data.get('product_name') or '',
+                credit_data.get('plu_no'),
+                credit_data.get('quantity', 1),
+                credit_data['server_no'],
+            )])
+            return {'success': True, 'queued': True, 'message': 'Crédit mis en file d\'attente', 'outbox_id': outbox.id}
         client = MiddlewareClient(self.env)
         result = client.send_credit(credit_data)
-        self._log_credit(product_name=credit_data.get('product_name') or '', plu_no=credit_data.get('plu_no'), quantity=credit_data.get('quantity', 1), success=result.get('success'), message=result.get('message'), session=self, response=result)
+        timer.merge(result.get('timings'))
+        self._log_credit(product_name=credit_data.get('product_name') or '', plu_no=credit_data.get('plu_no'), quantity=credit_data.get('quantity', 1), success=result.get('success'), message=result.get('message'), session=self, response=result, timer=timer, server_no=credit_data['server_no'])
         if result['success']:
             return {'success': True, 'message': result['message'], 'middleware_response': result.get('response', {})}
         else:
-            return {'success': False, 'error': result['message'], 'middleware_response': result.get('response', {})}
+            return {'success': False, 'error': result['message'], 'offline': result.get('offline', False), 'middleware_response': result.get('response', {})}
 
     def _loader_params_product_product(self):
         params = super()._loader_params_product_product()
@@ -783,6 +898,16 @@ class PosSession(models.Model):
         ])
         return params
 
+    def _process_pos_ui_product_product(self, products):
+        '''Ajoute les ingrédients des cocktails au chargement POS (une requête pour tous)'''
+        super()._process_pos_ui_product_product(products)
+        cocktail_ids = [product['id'] for product in products if product.get('is_combo_product')]
+        if cocktail_ids:
+            ingredients = self.env['product.product'].browse(cocktail_ids)._get_cocktail_ingredients_bulk()
+            for product in products:
+                if product['id'] in ingredients:
+                    product['cocktail_ingredients'] = ingredients[product['id']]
+
     def _get_combo_data(self):
         '''
         Retourne les données de combo nécessaires pour le POS
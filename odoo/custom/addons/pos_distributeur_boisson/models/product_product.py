@@ -3,6 +3,8 @@
 from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError
 import logging
+from .plu_index import PRODUCT_INDEX_FIELDS
+from .catalog_import import BULK_IMPORT_CONTEXT
 
 _logger = logging.getLogger(__name__)
 
@@ -139,6 +141,9 @@ class ProductProduct(models.Model):
     @api.model_create_multi
     def create(self, vals_list):
         """Synchronise is_combo_product lors de la création et hérite des propriétés distributeur"""
+        if self.env.context.get(BULK_IMPORT_CONTEXT):
+            # Import groupé: template, catégorie POS et index PLU traités par lot
+            return super().create(vals_list)
         # Traiter chaque ensemble de valeurs
         for vals in vals_list:
             if 'is_combo_product' in vals and vals.get('product_tmpl_id'):
@@ -162,10 +167,15 @@ class ProductProduct(models.Model):
                     if template and drinks_category not in template.pos_categ_ids:
                         template.pos_categ_ids = [(4, drinks_category.id)]
         
-        return super().create(vals_list)
+        products = super().create(vals_list)
+        if any(vals.get('plu_code') for vals in vals_list):
+            self.env['pos.distributeur.plu.index']._invalidate_index()
+        return products
 
     def write(self, vals):
         """Synchronise is_combo_product lors de la modification et hérite des propriétés distributeur"""
+        if self.env.context.get(BULK_IMPORT_CONTEXT):
+            return super().write(vals)
         if 'is_combo_product' in vals:
             for record in self:
                 if record.product_tmpl_id:
@@ -187,21 +197,20 @@ class ProductProduct(models.Model):
                     if record.product_tmpl_id and drinks_category not in record.product_tmpl_id.pos_categ_ids:
                         record.product_tmpl_id.pos_categ_ids = [(4, drinks_category.id)]
         
-        return super().write(vals)
+        result = super().write(vals)
+        if set(vals).intersection(PRODUCT_INDEX_FIELDS):
+            self.env['pos.distributeur.plu.index']._invalidate_index()
+        return result
+
+    def unlink(self):
+        result = super().unlink()
+        self.env['pos.distributeur.plu.index']._invalidate_index()
+        return result
 
     @api.constrains('plu_code')
     def _check_plu_code_unique(self):
-        """Vérifie que le code PLU est unique"""
-        for record in self:
-            if record.plu_code:
-                duplicate = self.search([
-                    ('plu_code', '=', record.plu_code),
-                    ('id', '!=', record.id)
-                ])
-                if duplicate:
-                    raise ValidationError(_(
-                        "Le code PLU '%s' est déjà utilisé par le produit '%s'"
-                    ) % (record.plu_code, duplicate[0].name))
+        """Vérifie que le code PLU est unique (une requête pour tout le lot, options comprises)"""
+        self.env['pos.distributeur.plu.index']._check_unique_plu_codes(self.mapped('plu_code'))
 
     @api.constrains('volume_distributeur')
     def _check_volume_distributeur(self):
@@ -241,37 +250,25 @@ class ProductProduct(models.Model):
             list: Liste des dictionnaires contenant les informations des ingrédients
                   [{'plu_code': 'PLU001', 'name': 'Menthe', 'credits': 1, 'product_id': 1}, ...]
         """
-        if not self.is_combo_product:
-            return []
-            
-        ingredients = []
-        
-        # Récupérer toutes les options de combo associées à ce produit
-        for combo_line in self.combo_line_ids:
-            category = combo_line.combo_category_id
-            if category:
-                # Récupérer les options de cette catégorie
-                options = self.env['pos.combo.option'].search([
-                    ('combo_category_id', '=', category.id),
-                    ('active', '=', True)
-                ])
-                
-                for option in options:
-                    ingredient_product = option.product_id
-                    if ingredient_product and ingredient_product.plu_code:
-                        ingredient_info = {
-                            'plu_code': ingredient_product.plu_code,
-                            'name': ingredient_product.name,
-                            'credits': ingredient_product.credits_per_serving or 1,
-                            'product_id': ingredient_product.id,
-                            'category_name': category.name,
-                            'price_extra': option.price_extra
-                        }
-                        ingredients.append(ingredient_info)
-                    else:
-                        _logger.warning(f"Ingrédient {option.name} sans code PLU dans le cocktail {self.name}")
-        
-        return ingredients
+        return self._get_cocktail_ingredients_bulk().get(self.id, [])
+
+    def _get_cocktail_ingredients_bulk(self):
+        """
+        Ingrédients de plusieurs cocktails à la fois (planification d'une commande, chargement POS)
+
+        Lit la recette compilée du template (cocktail_recipe), celle qui est
+        envoyée au distributeur: les ingrédients sélectionnés priment sur les
+        options des lignes de combo. Un seul chargement pour tous les templates.
+
+        Returns:
+            dict: {product_id: [ingrédients]}, même structure que get_cocktail_ingredients
+        """
+        result = {product.id: [] for product in self}
+        cocktails = self.filtered('is_combo_product')
+        cocktails.product_tmpl_id.fetch(['cocktail_recipe'])
+        for product in cocktails:
+            result[product.id] = product.product_tmpl_id._get_cocktail_recipe()
+        return result
 
     def get_combo_data(self):
         """Retourne les données de combo pour ce produit"""
@@ -328,12 +325,7 @@ class ProductProduct(models.Model):
         Recherche les produits qui nécessitent le distributeur
         (boissons simples ET cocktails, mais pas les ingrédients uniquement)
         """
-        return self.search([
-            ('is_distributeur_boisson', '=', True),
-            ('plu_code', '!=', False),
-            ('available_in_pos', '=', True),
-            ('is_ingredient_only', '=', False),  # Exclure les ingrédients uniquement
-        ])
+        return self.browse(self.env['pos.distributeur.plu.index']._distributor_product_ids())
 
     def action_refresh_ingredients(self):
         """
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Vérifie les plans des recherches fréquentes de pos.credit.log à grande volumétrie
+
+Crée une table de mesure UNLOGGED (même structure que pos_credit_log, mêmes
+index que ceux créés par pos.credit.log.init(), unicité des credit_id
+envoyés comprise), la remplit de --rows lignes
+générées côté serveur (10 millions par défaut), la passe en VACUUM ANALYZE
+puis lance EXPLAIN (ANALYZE, BUFFERS) sur les requêtes telles que l'ORM les
+émet:
+
+    session_plu   cancel_simple_drink_credits / cancel_cocktail_credits
+    order_line    PosOrderLine._get_active_credits_by_line
+    credit_id     recherche d'un crédit et de ses annulations
+
+Chaque plan doit être un Index Only Scan sur l'index attendu, sans Seq
+Scan. Le code de sortie vaut 1 sinon; le rapport JSON (--output) donne le
+plan, les durées et les heap fetches de chaque requête.
+
+À lancer sur une base de test, module installé:
+
+    python3 bench_credit_log_plans.py -c /etc/odoo/odoo.conf -d bench --rows 10000000
+
+La table de mesure est supprimée à la fin (sauf --keep; --reuse pour la
+réutiliser sans la regénérer).
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import sys
+import time
+from datetime import datetime
+
+import psycopg2
+
+import odoo
+from odoo.tools import config
+
+BENCH_TABLE = 'bench_pos_credit_log'
+
+# Lignes générées par INSERT (un lot = une requête côté serveur)
+INSERT_BATCH = 1000000
+
+# Proportions du journal simulé
+CREDITS_PER_SESSION = 2000
+CREDITS_PER_ORDER_LINE = 3
+PLU_COUNT = 300
+ACTIVE_RATIO = 0.9        # crédits encore annulables (status 'sent', quantité restante > 0)
+CANCELLATION_RATIO = 0.05  # lignes d'annulation
+
+QUERIES = {
+    'session_plu': {
+        'index': 'session_plu_active',
+        'sql': """
+            SELECT "{table}"."id" FROM "{table}"
+             WHERE ("{table}"."plu_no" IN %(plu_nos)s)
+               AND ("{table}"."status" = 'sent')
+               AND ("{table}"."remaining_quantity" > 0)
+               AND ("{table}"."session_id" = %(session_id)s)
+             ORDER BY "{table}"."create_date" DESC, "{table}"."id" DESC
+        """,
+    },
+    'order_line': {
+        'index': 'order_line_active',
+        'sql': """
+            SELECT "{table}"."id" FROM "{table}"
+             WHERE ("{table}"."order_line_id" IN %(order_line_ids)s)
+               AND ("{table}"."status" = 'sent')
+               AND ("{table}"."remaining_quantity" > 0)
+             ORDER BY "{table}"."create_date" DESC, "{table}"."id" DESC
+        """,
+    },
+    'credit_id': {
+        'index': 'credit_id_cover',
+        'sql': """
+            SELECT "{table}"."id" FROM "{table}"
+             WHERE ("{table}"."credit_id" = %(credit_id)s)
+             ORDER BY "{table}"."create_date" DESC
+        """,
+    },
+}
+
+
+def _connect(database):
+    _db, params = odoo.sql_db.connection_info_for(database)
+    cnx = psycopg2.connect(**params)
+    cnx.autocommit = True
+    return cnx
+
+
+def populate(cr, rows):
+    """(Re)crée la table de mesure et la remplit de `rows` lignes"""
+    from odoo.addons.pos_user_org.models.pos_credit_log import create_credit_id_unique_index, create_credit_log_indexes
+    cr.execute(f'DROP TABLE IF EXISTS {BENCH_TABLE}')
+    # Pas d'INCLUDING DEFAULTS: la séquence des ids de pos_credit_log n'est pas touchée
+    cr.execute(f'CREATE UNLOGGED TABLE {BENCH_TABLE} (LIKE pos_credit_log)')
+    for start in range(1, rows + 1, INSERT_BATCH):
+        stop = min(start + INSERT_BATCH - 1, rows)
+        batch_start = time.perf_counter()
+        cr.execute(f"""
+            INSERT INTO {BENCH_TABLE} (
+                id, user_id, session_id, order_line_id, plu_no, quantity, remaining_quantity,
+                server_no, success, status, is_cancellation, credit_id, create_date
+            )
+            SELECT n,
+                   1 + n % 50,
+                   1 + n / %(per_session)s,
+                   1 + n / %(per_line)s,
+                   'PLU' || (n * 7919 % %(plu_count)s),
+                   1 + n % 3,
+                   CASE WHEN r < %(active)s THEN 1 + n % 3 ELSE 0 END,
+                   1 + n % 8,
+                   TRUE,
+                   CASE WHEN r < %(active)s THEN 'sent' ELSE 'cancelled' END,
+                   r >= 1 - %(cancellation)s,
+                   md5(n::text),
+                   TIMESTAMP '2020-01-01' + n * INTERVAL '10 seconds'
+              FROM (SELECT n, random() AS r FROM generate_series(%(start)s, %(stop)s) AS n) AS s
+        """, {
+            'start': start, 'stop': stop,
+            'per_session': CREDITS_PER_SESSION, 'per_line': CREDITS_PER_ORDER_LINE,
+            'plu_count': PLU_COUNT, 'active': ACTIVE_RATIO, 'cancellation': CANCELLATION_RATIO,
+        })
+        print(f"{stop}/{rows} lignes ({time.perf_counter() - batch_start:.1f} s)", file=sys.stderr)
+    index_start = time.perf_counter()
+    create_credit_id_unique_index(cr, BENCH_TABLE)
+    create_credit_log_indexes(cr, BENCH_TABLE)
+    print(f"Index créés ({time.perf_counter() - index_start:.1f} s)", file=sys.stderr)
+    # Carte de visibilité à jour: indispensable aux Index Only Scan
+    cr.execute(f'VACUUM (ANALYZE) {BENCH_TABLE}')
+
+
+def _plan_nodes(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from _plan_nodes(child)
+
+
+def explain(cr, query, params):
+    cr.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + query['sql'].format(table=BENCH_TABLE), params)
+    plan = cr.fetchone()[0][0]
+    nodes = list(_plan_nodes(plan['Plan']))
+    expected_index = f"{BENCH_TABLE}_{query['index']}_idx"
+    scans = [node for node in nodes if 'Scan' in node['Node Type']]
+    problems = []
+    if any(node['Node Type'] == 'Seq Scan' for node in scans):
+        problems.append('Seq Scan')
+    if not any(node['Node Type'] == 'Index Only Scan' and node.get('Index Name') == expected_index for node in scans):
+        problems.append(f"pas d'Index Only Scan sur {expected_index}")
+    return {
+        'ok': not problems,
+        'problems': problems,
+        'scans': [
+            {'type': node['Node Type'], 'index': node.get('Index Name'), 'heap_fetches': node.get('Heap Fetches')}
+            for node in scans
+        ],
+        'planning_ms': round(plan['Planning Time'], 3),
+        'execution_ms': round(plan['Execution Time'], 3),
+        'shared_buffers_hit': plan['Plan'].get('Shared Hit Blocks'),
+        'shared_buffers_read': plan['Plan'].get('Shared Read Blocks'),
+    }
+
+
+def sample_params(rows, rnd):
+    n = rnd.randint(1, rows)
+    return {
+        'plu_nos': tuple(f'PLU{(m * 7919) % PLU_COUNT}' for m in (n, n + 1, n + 2)),
+        'session_id': 1 + n // CREDITS_PER_SESSION,
+        'order_line_ids': tuple(1 + m // CREDITS_PER_ORDER_LINE for m in range(n, n + 30 * CREDITS_PER_ORDER_LINE, CREDITS_PER_ORDER_LINE)),
+        'credit_id': hashlib.md5(str(n).encode()).hexdigest(),  # md5(n::text) de populate()
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plans des recherches pos.credit.log à grande volumétrie")
+    parser.add_argument('-c', '--config', help="Fichier de configuration Odoo")
+    parser.add_argument('-d', '--database', required=True, help="Base de test (module installé)")
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--samples', type=int, default=5, help="Exécutions par requête (paramètres tirés au hasard)")
+    parser.add_argument('--reuse', action='store_true', help="Réutiliser la table de mesure existante")
+    parser.add_argument('--keep', action='store_true', help="Ne pas supprimer la table de mesure")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="Fichier JSON de résultats")
+    args = parser.parse_args(argv)
+
+    odoo_args = ['-d', args.database, '--log-level=warn']
+    if args.config:
+        odoo_args = ['-c', args.config] + odoo_args
+    config.parse_config(odoo_args)
+    # Les addons_path de la configuration ne sont connus qu'ici
+    odoo.modules.module.initialize_sys_path()
+    from odoo.addons.pos_user_org.models.pos_credit_log import CREDIT_LOG_INDEXES
+
+    rnd = random.Random(args.seed)
+    cnx = _connect(args.database)
+    try:
+        with cnx.cursor() as cr:
+            if not args.reuse:
+                populate(cr, args.rows)
+            results = {name: [] for name in QUERIES}
+            for _i in range(args.samples):
+                params = sample_params(args.rows, rnd)
+                for name, query in QUERIES.items():
+                    results[name].append(explain(cr, query, params))
+            if not args.keep:
+                cr.execute(f'DROP TABLE IF EXISTS {BENCH_TABLE}')
+    finally:
+        cnx.close()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'database': args.database,
+            'rows': args.rows,
+            'indexes': CREDIT_LOG_INDEXES,
+        },
+        'queries': {
+            name: {
+                'ok': all(run['ok'] for run in runs),
+                'execution_ms_max': max(run['execution_ms'] for run in runs),
+                'heap_fetches_max': max((scan['heap_fetches'] or 0) for run in runs for scan in run['scans']) if runs else None,
+                'runs': runs,
+            }
+            for name, runs in results.items()
+        },
+    }
+    report['ok'] = all(query['ok'] for query in report['queries'].values())
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
+    return 0 if report['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
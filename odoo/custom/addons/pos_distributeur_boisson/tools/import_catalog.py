@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Import groupé du catalogue distributeur depuis des fichiers CSV/JSON
+
+Charge le registre Odoo de la base puis importe, dans cet ordre, les
+produits (boissons et ingrédients), les options de combo et les recettes
+des cocktails via pos.distributeur.catalog.import. Les fichiers sont lus
+ligne à ligne et traités par lots (--chunk-size); les lignes sont
+rapprochées par PLU, donc relancer l'import sur le même catalogue ne
+modifie rien.
+
+Colonnes (CSV) ou clés (JSON/JSONL):
+
+    produits:  plu_code, name, list_price, volume_distributeur,
+               credits_per_serving, is_combo_product, is_ingredient_only,
+               needs_distributor, available_in_pos, default_code, barcode
+    options:   product_plu, category, plu_code, name, price_extra, sequence,
+               volume_distributeur, credits_per_serving, active
+    recettes:  cocktail_plu, ingredients (PLU séparés par '|' en CSV,
+               liste en JSON)
+
+Exemple:
+
+    python3 import_catalog.py -c /etc/odoo/odoo.conf -d prod \\
+        --products boissons.csv --options ingredients.csv --recipes recettes.jsonl
+
+Sans --commit, l'import est annulé à la fin (essai à blanc).
+"""
+
+import argparse
+import json
+import sys
+
+import odoo
+from odoo import api, SUPERUSER_ID
+from odoo.tools import config
+
+# Fichiers acceptés, dans l'ordre d'import (CATALOG_KINDS de models/catalog_import.py)
+CATALOG_FILES = ('products', 'options', 'recipes')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import groupé du catalogue distributeur")
+    parser.add_argument('-c', '--config', help="Fichier de configuration Odoo")
+    parser.add_argument('-d', '--database', required=True, help="Base cible (module installé)")
+    parser.add_argument('--products', help="Fichier des produits (boissons, ingrédients, cocktails)")
+    parser.add_argument('--options', help="Fichier des options de combo (ingrédients)")
+    parser.add_argument('--recipes', help="Fichier des recettes des cocktails")
+    parser.add_argument('--format', choices=('csv', 'jsonl', 'json'), help="Format (sinon d'après l'extension)")
+    parser.add_argument('--chunk-size', type=int, help="Lignes par lot (défaut: DEFAULT_CHUNK_SIZE du module)")
+    parser.add_argument('--commit', action='store_true', help="Valider l'import (sinon essai à blanc)")
+    args = parser.parse_args(argv)
+
+    files = {kind: getattr(args, kind) for kind in CATALOG_FILES if getattr(args, kind)}
+    if not files:
+        parser.error("Au moins un fichier parmi --products, --options, --recipes")
+
+    odoo_args = ['-d', args.database, '--log-level=warn']
+    if args.config:
+        odoo_args = ['-c', args.config] + odoo_args
+    config.parse_config(odoo_args)
+    odoo.netsvc.init_logger()
+    # Les addons_path de la configuration ne sont connus qu'ici
+    odoo.modules.module.initialize_sys_path()
+    from odoo.addons.pos_distributeur_boisson.models.catalog_import import DEFAULT_CHUNK_SIZE, iter_catalog_rows
+    chunk_size = args.chunk_size or DEFAULT_CHUNK_SIZE
+    registry = odoo.modules.registry.Registry(args.database)
+
+    report = {}
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        Import = env['pos.distributeur.catalog.import']
+        for kind, path in files.items():
+            with open(path, encoding='utf-8-sig', newline='') as stream:
+                report[kind] = Import.import_catalog(kind, iter_catalog_rows(stream, args.format), chunk_size=chunk_size)
+            print(report[kind]['message'], file=sys.stderr)
+        if args.commit:
+            cr.commit()
+        else:
+            cr.rollback()
+    report['committed'] = args.commit
+    print(json.dumps(report, indent=2, default=str))
+    return 0 if all(result['success'] for kind, result in report.items() if kind in files) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
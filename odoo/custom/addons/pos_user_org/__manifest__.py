@@ -8,7 +8,9 @@
     'data': [
         'security/security.xml',
         'security/ir.model.access.csv',
+        'data/pos_credit_log_cron.xml',
         'views/pos_credit_log_views.xml',
+        'views/pos_credit_log_daily_views.xml',
         'views/hr_employee_views.xml',
         'views/menu.xml',
     ],
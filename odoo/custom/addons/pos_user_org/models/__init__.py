@@ -4,3 +4,4 @@ from . import hr_employee
 from . import presence
 from . import presence_log
 from . import credit_log_migration
+from . import pos_credit_log_daily
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+
+
+class PosCreditLogDaily(models.Model):
+    _name = 'pos.credit.log.daily'
+    _description = 'Synthèse journalière des crédits POS'
+    _order = 'date desc, id desc'
+
+    # Alimenté par pos.credit.log._cron_rollup_closed_sessions (sessions fermées)
+    date = fields.Date(string='Jour', required=True, index=True)
+    config_id = fields.Many2one('pos.config', string='Terminal', index=True, ondelete='set null')
+    plu_no = fields.Char(string='PLU', index=True)
+    server_no = fields.Integer(string='Server No')
+    product_name = fields.Char(string='Produit')
+
+    credit_count = fields.Integer(string='Crédits envoyés')
+    quantity_sent = fields.Integer(string='Quantité envoyée')
+    cancellation_count = fields.Integer(string='Annulations')
+    quantity_cancelled = fields.Integer(string='Quantité annulée')
+    failure_count = fields.Integer(string='Échecs')
+    net_quantity = fields.Integer(string='Quantité nette', compute='_compute_net_quantity', store=True)
+
+    duration_total_sum_ms = fields.Float(string='Durée cumulée (ms)', digits=(16, 2))
+    duration_avg_ms = fields.Float(
+        string='Durée moyenne (ms)',
+        digits=(16, 2),
+        compute='_compute_duration_avg',
+        store=True,
+        group_operator='avg'
+    )
+
+    @api.depends('quantity_sent', 'quantity_cancelled')
+    def _compute_net_quantity(self):
+        for rec in self:
+            rec.net_quantity = rec.quantity_sent - rec.quantity_cancelled
+
+    @api.depends('duration_total_sum_ms', 'credit_count')
+    def _compute_duration_avg(self):
+        for rec in self:
+            rec.duration_avg_ms = rec.duration_total_sum_ms / rec.credit_count if rec.credit_count else 0.0
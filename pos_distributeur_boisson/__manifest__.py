@@ -19,10 +19,13 @@
         'views/product_combo_views.xml',
         'views/product_views_simple.xml',
         'views/ingredient_selection_wizard_views.xml',
+        'views/pos_credit_outbox_views.xml',
+        'views/res_config_settings_views.xml',
         
         'data/demo_products.xml',
         'data/combo_test_data.xml',
         'data/pos_actions.xml',
+        'data/pos_credit_outbox_cron.xml',
     ],
     'assets': {
         'point_of_sale.assets_prod': [
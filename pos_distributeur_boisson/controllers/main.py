@@ -5,8 +5,10 @@ from odoo.http import request
 import requests
 import json
 import logging
-from datetime import datetime
+import hmac
+from datetime import datetime, timedelta
 from ..models.middleware_client import MiddlewareClient
+from ..models.dispatch_metrics import DispatchMetrics, collect, render_prometheus
 
 _logger = logging.getLogger(__name__)
 
@@ -30,14 +32,29 @@ class PosDistributeurController(http.Controller):
         is_barman = request.env.user.has_group('pos_user_org.group_pos_barman')
         return {'success': True, 'is_barman': bool(is_barman)}
     
+    @http.route('/pos_distributeur_boisson/dispatch_order', type='json', auth='user')
+    def dispatch_order(self, items=None, order_id=None, **kwargs):
+        """
+        Envoie toute une commande en un seul appel (bouton Distributeur du POS)
+
+        Droits Barman vérifiés une fois, cocktails développés et crédits
+        regroupés côté serveur (pos.session.envoyer_commande_distributeur);
+        la réponse contient un résultat par ligne dans details.
+        """
+        if not request.env.user.has_group('pos_user_org.group_pos_barman'):
+            return {'success': False, 'error': "Accès refusé: réservé aux Barmans", 'details': []}
+        return request.env['pos.session'].envoyer_commande_distributeur({
+            'order_id': order_id,
+            'items': items or [],
+        })
+    
     @http.route('/pos_distributeur_boisson/send_credit_to_middleware', type='json', auth='user')
     def send_credit_to_middleware(self, **kwargs):
         """
         Proxy pour envoyer des crédits au middleware Hart96
         Utilise la classe MiddlewareClient centralisée
         """
-        _logger.info(f"📤 Direct: Envoi crédit au middleware Hart96")
-        _logger.info(f"📤 Données reçues: {kwargs}")
+        _logger.debug("📤 Direct: Envoi crédit au middleware Hart96: %s", kwargs)
         
         # Vérifier droits Barman
         if not request.env.user.has_group('pos_user_org.group_pos_barman'):
@@ -74,8 +91,7 @@ class PosDistributeurController(http.Controller):
             server_name (str): Nom du serveur (optionnel)
         """
         try:
-            _logger.info(f"🍹 Envoi des ingrédients du cocktail au middleware Hart96")
-            _logger.info(f"🍹 Données reçues: {kwargs}")
+            _logger.debug("🍹 Envoi des ingrédients du cocktail au middleware Hart96: %s", kwargs)
             
             if not request.env.user.has_group('pos_user_org.group_pos_barman'):
                 return {'success': False, 'error': "Accès refusé: réservé aux Barmans"}
@@ -105,25 +121,8 @@ class PosDistributeurController(http.Controller):
                     'error': f'Le produit "{product.name}" n\'est pas un cocktail'
                 }
             
-            # Récupérer les ingrédients du cocktail
-            ingredients_list = []
-            
-            # Utiliser les ingrédients sélectionnés si disponibles
-            if hasattr(product, 'selected_combo_ingredient_ids') and product.selected_combo_ingredient_ids:
-                for ingredient_option in product.selected_combo_ingredient_ids:
-                    if ingredient_option.product_id and ingredient_option.product_id.plu_code:
-                        ingredients_list.append({
-                            'plu_code': ingredient_option.product_id.plu_code,
-                            'name': ingredient_option.product_id.name,
-                            'credits': ingredient_option.credits_per_serving or 1,
-                            'product_id': ingredient_option.product_id.id,
-                            'category_name': ingredient_option.combo_category_id.name if ingredient_option.combo_category_id else '',
-                            'price_extra': ingredient_option.price_extra
-                        })
-            
-            # Si pas d'ingrédients sélectionnés, utiliser la méthode get_cocktail_ingredients
-            if not ingredients_list and hasattr(product, 'get_cocktail_ingredients'):
-                ingredients_list = product.get_cocktail_ingredients()
+            # Ingrédients de la recette compilée (mêmes que l'envoi et l'annulation)
+            ingredients_list = request.env['pos.session']._get_cocktail_ingredients(product)
             
             if not ingredients_list:
                 return {
@@ -131,7 +130,7 @@ class PosDistributeurController(http.Controller):
                     'error': f'Aucun ingrédient trouvé pour le cocktail "{product.name}"'
                 }
             
-            _logger.info(f"🍹 Ingrédients trouvés: {len(ingredients_list)}")
+            _logger.debug("🍹 Ingrédients trouvés: %s", len(ingredients_list))
             
             # Préparer la liste des crédits à envoyer pour chaque ingrédient
             credits_list = []
@@ -144,9 +143,9 @@ class PosDistributeurController(http.Controller):
                 }
                 credits_list.append(credit_data)
             
-            # Utiliser MiddlewareClient pour envoyer tous les crédits
+            # Un seul aller-retour HTTP pour tous les ingrédients
             client = MiddlewareClient(request.env)
-            middleware_result = client.send_multiple_credits(credits_list)
+            middleware_result = client.send_credits_batch(credits_list)
             
             # Préparer les détails pour chaque ingrédient
             results = []
@@ -175,6 +174,7 @@ class PosDistributeurController(http.Controller):
             # Retourner le résultat basé sur le succès global
             return {
                 'success': middleware_result['success'],
+                'offline': middleware_result.get('offline', False),
                 'message': f'Cocktail "{product.name}": {middleware_result["message"]} (Qty: {quantity})',
                 'product_name': product.name,
                 'quantity': quantity,
@@ -193,15 +193,17 @@ class PosDistributeurController(http.Controller):
             }
     
    
-    def test_middleware_connection(self, **kwargs):
+    @http.route('/pos_distributeur_boisson/test_middleware_connection', type='json', auth='user')
+    def test_middleware_connection(self, force=False, **kwargs):
         """
         Test de connexion au middleware pour vérifier la configuration
-        Utilise MiddlewareClient centralisé
+        Utilise MiddlewareClient centralisé: renvoie le dernier statut connu
+        (sonde d'arrière-plan) sauf si force=True
         """
-        _logger.info("🔍 Test de connexion au middleware")
+        _logger.debug("🔍 Test de connexion au middleware")
         
         client = MiddlewareClient(request.env)
-        return client.test_connection()
+        return client.test_connection(force=bool(force))
     
     @http.route('/pos_distributeur_boisson/test_connection_logs', type='json', auth='user')
     def test_connection_logs(self, **kwargs):
@@ -232,5 +234,58 @@ class PosDistributeurController(http.Controller):
                 'disconnection': disconnect_status
             }
         }
-    
-    
\ No newline at end of file
+
+    @http.route('/pos_distributeur_boisson/metrics', type='http', auth='public', methods=['GET'], csrf=False)
+    def metrics(self, token=None, **kwargs):
+        """
+        Export Prometheus des mesures du distributeur (format texte)
+
+        Les compteurs viennent des instantanés publiés par les workers: aucun
+        parcours de pos.credit.log. Accès par jeton (paramètre
+        pos_distributeur.metrics_token, en-tête Authorization: Bearer ou
+        ?token=), sinon réservé aux administrateurs connectés.
+        """
+        settings = request.env['pos.distributeur.settings'].sudo()._get_settings()
+        if not self._metrics_authorized(settings, token):
+            return request.make_response('Accès refusé\n', status=403, headers=[('Content-Type', 'text/plain; charset=utf-8')])
+
+        # Publier d'abord les mesures de ce worker pour qu'elles soient à jour
+        metrics = DispatchMetrics.get()
+        metrics.configure(directory=settings['metrics_dir'])
+        try:
+            metrics.flush()
+        except OSError as e:
+            _logger.warning(f"Impossible de publier les mesures du worker: {e}")
+        body = render_prometheus(collect(settings['metrics_dir']), self._metrics_gauges())
+        return request.make_response(body, headers=[('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')])
+
+    def _metrics_authorized(self, settings, token):
+        expected = settings['metrics_token']
+        if not expected:
+            return request.env.user.has_group('base.group_system')
+        auth_header = request.httprequest.headers.get('Authorization', '')
+        if auth_header.startswith('Bearer '):
+            token = auth_header[len('Bearer '):]
+        return bool(token) and hmac.compare_digest(str(token), expected)
+
+    def _metrics_gauges(self):
+        """Jauges lues en base au moment de l'export (tables de petite taille, indexées)"""
+        cr = request.env.cr
+        gauges = []
+        cr.execute("""
+            SELECT state, count(*)
+              FROM pos_credit_outbox
+             WHERE state IN ('pending', 'failed')
+          GROUP BY state
+        """)
+        depth = dict(cr.fetchall())
+        for state in ('pending', 'failed'):
+            gauges.append(('pos_distributeur_outbox_credits', {'state': state}, depth.get(state, 0)))
+
+        Presence = request.env['user.presence'].sudo()
+        online_since = datetime.utcnow() - timedelta(minutes=2)
+        online = Presence.search_count([('last_seen', '>=', online_since)])
+        total = Presence.search_count([])
+        gauges.append(('pos_distributeur_presence_users', {'state': 'online'}, online))
+        gauges.append(('pos_distributeur_presence_users', {'state': 'offline'}, total - online))
+        return gauges
@@ -2,7 +2,10 @@
 
 from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError
+import hashlib
+import json
 import logging
+from .plu_index import OPTION_INDEX_FIELDS
 
 _logger = logging.getLogger(__name__)
 
@@ -76,19 +79,42 @@ class PosComboOption(models.Model):
          'Ce code PLU est déjà utilisé par une autre option.')
     ]
 
-    @api.constrains('plu_code')
+    @api.constrains('plu_code', 'product_id')
     def _check_plu_code_unique(self):
-        """Vérifie que le code PLU est unique"""
-        for record in self:
-            if record.plu_code:
-                existing = self.search([
-                    ('plu_code', '=', record.plu_code),
-                    ('id', '!=', record.id)
-                ])
-                if existing:
-                    raise ValidationError(_(
-                        "Le code PLU '%s' est déjà utilisé par l'option '%s'"
-                    ) % (record.plu_code, existing[0].name))
+        """Vérifie que le code PLU est unique (une requête pour tout le lot, produits compris)"""
+        self.env['pos.distributeur.plu.index']._check_unique_plu_codes(self.mapped('plu_code'))
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        options = super().create(vals_list)
+        self.env['pos.distributeur.plu.index']._invalidate_index()
+        return options
+
+    def write(self, vals):
+        result = super().write(vals)
+        if set(vals).intersection(OPTION_INDEX_FIELDS):
+            self.env['pos.distributeur.plu.index']._invalidate_index()
+        return result
+
+    def unlink(self):
+        result = super().unlink()
+        self.env['pos.distributeur.plu.index']._invalidate_index()
+        return result
+
+    @api.model
+    def _get_active_options_by_category(self, categories):
+        """
+        Options actives de plusieurs catégories en une seule requête, produits préchargés
+
+        Returns:
+            dict: {category_id: pos.combo.option} dans l'ordre de séquence
+        """
+        options = self.search([('combo_category_id', 'in', categories.ids), ('active', '=', True)])
+        options.product_id.fetch(['name', 'plu_code', 'credits_per_serving', 'list_price'])
+        option_ids = {category_id: [] for category_id in categories.ids}
+        for option in options:
+            option_ids[option.combo_category_id.id].append(option.id)
+        return {category_id: self.browse(ids) for category_id, ids in option_ids.items()}
 
     def action_select_ingredient(self):
         """
@@ -182,6 +208,22 @@ class ProductTemplate(models.Model):
         help="Volume total calculé à partir des ingrédients sélectionnés"
     )
 
+    # Recette compilée: ingrédients dans l'ordre d'envoi, recalculée quand la composition change
+    cocktail_recipe = fields.Json(
+        string='Recette compilée',
+        compute='_compute_cocktail_recipe',
+        store=True,
+        readonly=True
+    )
+
+    cocktail_recipe_version = fields.Char(
+        string='Version de la recette',
+        compute='_compute_cocktail_recipe',
+        store=True,
+        readonly=True,
+        help="Empreinte de la recette compilée; change dès qu'un ingrédient, un PLU ou un nombre de crédits change"
+    )
+
     @api.onchange('is_combo_product')
     def _onchange_is_combo_product(self):
         if not self.is_combo_product:
@@ -224,6 +266,84 @@ class ProductTemplate(models.Model):
             else:
                 product.combo_volume_total = 0.0
 
+    @api.depends(
+        'is_combo_product',
+        'selected_combo_ingredient_ids',
+        'selected_combo_ingredient_ids.sequence',
+        'selected_combo_ingredient_ids.credits_per_serving',
+        'selected_combo_ingredient_ids.volume_distributeur',
+        'selected_combo_ingredient_ids.price_extra',
+        'selected_combo_ingredient_ids.combo_category_id.name',
+        'selected_combo_ingredient_ids.product_id.plu_code',
+        'selected_combo_ingredient_ids.product_id.name',
+        'selected_combo_ingredient_ids.product_id.list_price',
+        'selected_combo_ingredient_ids.product_id.credits_per_serving',
+        'combo_line_ids.sequence',
+        'combo_line_ids.combo_category_id.name',
+        'combo_line_ids.combo_category_id.option_ids',
+        'combo_line_ids.combo_category_id.option_ids.active',
+        'combo_line_ids.combo_category_id.option_ids.sequence',
+        'combo_line_ids.combo_category_id.option_ids.credits_per_serving',
+        'combo_line_ids.combo_category_id.option_ids.volume_distributeur',
+        'combo_line_ids.combo_category_id.option_ids.price_extra',
+        'combo_line_ids.combo_category_id.option_ids.product_id.plu_code',
+        'combo_line_ids.combo_category_id.option_ids.product_id.name',
+        'combo_line_ids.combo_category_id.option_ids.product_id.list_price',
+        'combo_line_ids.combo_category_id.option_ids.product_id.credits_per_serving',
+    )
+    def _compute_cocktail_recipe(self):
+        """
+        Compile la recette d'un cocktail: liste ordonnée des ingrédients (PLU,
+        crédits, volume) lue telle quelle à chaque envoi et à chaque annulation
+
+        Les ingrédients sélectionnés pour ce cocktail priment; à défaut, toutes
+        les options actives des catégories des lignes de combo.
+        """
+        cocktails = self.filtered('is_combo_product')
+        options_by_category = self.env['pos.combo.option']._get_active_options_by_category(
+            cocktails.filtered(lambda t: not t.selected_combo_ingredient_ids).combo_line_ids.combo_category_id
+        )
+        for template in self:
+            recipe = template._build_cocktail_recipe(options_by_category) if template.is_combo_product else []
+            template.cocktail_recipe = recipe
+            template.cocktail_recipe_version = hashlib.sha1(
+                json.dumps(recipe, sort_keys=True).encode('utf-8')
+            ).hexdigest()[:12] if recipe else False
+
+    def _build_cocktail_recipe(self, options_by_category):
+        self.ensure_one()
+        recipe = []
+        options = self.selected_combo_ingredient_ids
+        if not options:
+            for combo_line in self.combo_line_ids.sorted('sequence'):
+                options |= options_by_category.get(combo_line.combo_category_id.id, self.env['pos.combo.option'])
+        for option in options:
+            ingredient_product = option.product_id
+            if not ingredient_product.plu_code:
+                _logger.warning(f"Ingrédient {option.name} sans code PLU dans le cocktail {self.name}")
+                continue
+            recipe.append({
+                'plu_code': ingredient_product.plu_code,
+                'name': ingredient_product.name,
+                'credits': option.credits_per_serving or ingredient_product.credits_per_serving or 1,
+                'volume': option.volume_distributeur or 0.0,
+                'quantity': 1,
+                'price': ingredient_product.list_price,
+                'price_extra': option.price_extra,
+                'product_id': ingredient_product.id,
+                'option_id': option.id,
+                'category_name': option.combo_category_id.name or '',
+            })
+        return recipe
+
+    def _get_cocktail_recipe(self):
+        """
+        Returns:
+            list: Ingrédients de la recette compilée (copie modifiable)
+        """
+        self.ensure_one()
+        return [dict(ingredient) for ingredient in self.cocktail_recipe or []]
+
     def action_refresh_ingredients(self):
         """
         Force le recalcul des ingrédients disponibles
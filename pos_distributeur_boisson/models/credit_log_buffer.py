@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import time
+
+from .middleware_client import new_credit_id
+
+_logger = logging.getLogger(__name__)
+
+
+class CreditLogBuffer:
+    """
+    Journal des crédits en écriture différée, le temps d'un envoi
+
+    Les lignes d'un envoi (une par boisson ou ingrédient) sont collectées
+    puis créées par flush() en un seul create multi-lignes. Utilisateur,
+    employé, session et réglages de durée sont résolus une fois par flush,
+    et les durées par étape partent dans le même INSERT. Chaque ligne garde
+    le server_no de la trame envoyée.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self._entries = []
+        # Seuil 'crédit lent' lu au dernier flush, repris par _record_log_stage
+        self._slow_threshold_ms = 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, product_name, plu_no, quantity, server_no=None, message=None, response=None, order_line_id=None, credit_id=None, timer=None):
+        # Reprendre l'ID envoyé au middleware (clé d'idempotence), sinon en générer un
+        if not credit_id and isinstance(response, dict):
+            credit_id = response.get('credit_id')
+        self._entries.append({
+            'product_name': product_name,
+            'plu_no': str(plu_no) if plu_no is not None else False,
+            'quantity': int(quantity or 1),
+            'server_no': int(server_no) if server_no else False,
+            'message': message,
+            'response': response,
+            'order_line_id': order_line_id,
+            'credit_id': credit_id or new_credit_id(),
+            # Copie: les lignes d'un même lot partagent les durées mesurées jusqu'ici
+            'timer': timer.copy() if timer is not None else None,
+        })
+
+    def flush(self):
+        """
+        Crée les lignes collectées et vide le tampon
+
+        Les credit_id déjà journalisés (rejeu d'une commande) sont écartés en
+        une recherche. Si le create groupé échoue malgré tout, les lignes sont
+        reprises une à une sous savepoint: une ligne en erreur n'invalide ni
+        les autres ni la transaction de la commande. Ces crédits sont déjà
+        partis au distributeur: une ligne impossible à créer est signalée en
+        erreur avec son credit_id.
+
+        Returns:
+            recordset: pos.credit.log créés
+        """
+        entries, self._entries = self._entries, []
+        env = self.session.env
+        Log = env['pos.credit.log'].sudo()
+        if not entries:
+            return Log
+        flush_start = time.perf_counter()
+        vals_list = self._prepare_vals_list(entries, Log)
+        if not vals_list:
+            return Log
+        try:
+            with env.cr.savepoint():
+                logs = Log.create(vals_list)
+        except Exception as e:
+            _logger.warning("Journalisation groupée impossible (%s), reprise ligne par ligne", e)
+            logs = Log
+            for vals in vals_list:
+                try:
+                    with env.cr.savepoint():
+                        logs |= Log.create(vals)
+                except Exception as e:
+                    _logger.error(
+                        "❌ Crédit envoyé non journalisé: %s (PLU %s, server_no %s, qté %s): %s",
+                        vals['credit_id'], vals['plu_no'], vals['server_no'], vals['quantity'], e,
+                    )
+        self._record_log_stage(logs.filtered('duration_total_ms'), time.perf_counter() - flush_start)
+        _logger.debug("📝 %s crédit(s) journalisé(s) en un create", len(logs))
+        return logs
+
+    def _prepare_vals_list(self, entries, Log):
+        """Valeurs des lignes à créer; ne lève pas (les crédits sont déjà envoyés)"""
+        env = self.session.env
+        employee = getattr(env.user, 'employee_id', False)
+        # server_no de secours (lignes ajoutées sans celui de leur trame), sans contrôle Barman
+        try:
+            default_server_no = int(employee.server_no) if employee and employee.server_no else False
+        except (TypeError, ValueError):
+            default_server_no = False
+        session_id = self.session[:1].id or False
+        try:
+            settings = env['pos.distributeur.settings']._get_settings()
+        except Exception as e:
+            _logger.warning("Réglages indisponibles, crédits journalisés sans durées: %s", e)
+            settings = None
+        self._slow_threshold_ms = settings['slow_credit_threshold_ms'] if settings is not None else 0.0
+
+        credit_ids = [entry['credit_id'] for entry in entries]
+        try:
+            with env.cr.savepoint():
+                seen = set(Log.search([('credit_id', 'in', credit_ids), ('is_cancellation', '=', False)]).mapped('credit_id'))
+        except Exception as e:
+            # Doublons éventuels rattrapés par la reprise ligne par ligne
+            _logger.warning("Recherche des credit_id déjà journalisés impossible: %s", e)
+            seen = set()
+        vals_list = []
+        for entry in entries:
+            if entry['credit_id'] in seen:
+                _logger.warning("Crédit %s déjà journalisé, ignoré", entry['credit_id'])
+                continue
+            seen.add(entry['credit_id'])
+            response = entry['response']
+            vals = {
+                'user_id': env.user.id,
+                'employee_id': employee.id if employee else False,
+                'session_id': session_id,
+                'order_line_id': entry['order_line_id'],
+                'product_name': entry['product_name'],
+                'plu_no': entry['plu_no'],
+                'quantity': entry['quantity'],
+                'server_no': entry['server_no'] or default_server_no,
+                'success': True,
+                'status': 'sent',
+                'credit_id': entry['credit_id'],
+                'message': entry['message'],
+                'response_payload': json.dumps(response) if isinstance(response, (dict, list)) else (response or ''),
+            }
+            timer = entry['timer']
+            if timer is not None and settings is not None:
+                threshold = self._slow_threshold_ms
+                vals.update(timer.log_vals(threshold), middleware_url=settings['middleware_url'])
+                if vals['is_slow']:
+                    _logger.warning(
+                        "🐢 Crédit lent (%.0f ms > %.0f ms): PLU %s, server_no %s - %s",
+                        vals['duration_total_ms'], threshold, vals['plu_no'], vals['server_no'],
+                        ", ".join("%s=%.0f" % (name, duration) for name, duration in timer.stages.items()),
+                    )
+            vals_list.append(vals)
+        return vals_list
+
+    def _record_log_stage(self, logs, duration_s):
+        """
+        Répartit la durée du flush sur l'étape 'log' des lignes chronométrées (une requête)
+
+        is_slow est recalculé dans la même requête sur le total incluant cette étape.
+        """
+        if not logs:
+            return
+        share_ms = round(duration_s * 1000.0 / len(logs), 2)
+        logs.flush_recordset()
+        logs.env.cr.execute("""
+            UPDATE pos_credit_log
+               SET duration_log_ms = duration_log_ms + %(share)s,
+                   duration_total_ms = duration_total_ms + %(share)s,
+                   is_slow = %(threshold)s > 0 AND duration_total_ms + %(share)s >= %(threshold)s
+             WHERE id = ANY(%(ids)s)
+        """, {'share': share_ms, 'threshold': self._slow_threshold_ms, 'ids': logs.ids})
+        logs.invalidate_recordset(['duration_log_ms', 'duration_total_ms', 'is_slow'])
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import logging
+import threading
+
+# Un enregistrement compact par crédit (logger dédié, échantillonnable)
+CREDIT_LOGGER_NAME = 'odoo.addons.pos_distributeur_boisson.credit'
+
+
+class kv:
+    """
+    Champs structurés formatés en key=value au moment de l'écriture seulement
+
+    _logger.info("credit %s", kv(credit_id=..., plu=...)) ne coûte rien si
+    le niveau INFO est désactivé ou si l'enregistrement est écarté par
+    l'échantillonnage.
+    """
+
+    __slots__ = ('fields',)
+
+    def __init__(self, **fields):
+        self.fields = fields
+
+    def __str__(self):
+        parts = []
+        for key, value in self.fields.items():
+            if value is None:
+                continue
+            value = str(value)
+            if not value or any(c in value for c in ' ="'):
+                value = '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+            parts.append(f'{key}={value}')
+        return ' '.join(parts)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Ne garde qu'un enregistrement sur `rate` par modèle de message
+
+    Les avertissements et erreurs passent toujours.
+    """
+
+    def __init__(self, rate=1):
+        super().__init__()
+        self.rate = max(int(rate or 1), 1)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.rate <= 1 or record.levelno >= logging.WARNING:
+            return True
+        counter = self._counters.get(record.msg)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(record.msg, itertools.count())
+        return next(counter) % self.rate == 0
+
+
+def set_sample_rate(logger, rate):
+    """Échantillonne les messages INFO/DEBUG de ce logger (1 = tout garder)"""
+    sampling = next((f for f in logger.filters if isinstance(f, SamplingFilter)), None)
+    if sampling is None:
+        sampling = SamplingFilter(rate)
+        logger.addFilter(sampling)
+    else:
+        sampling.rate = max(int(rate or 1), 1)
+    return logger
+
+
+def get_credit_logger(sample_rate=None):
+    logger = logging.getLogger(CREDIT_LOGGER_NAME)
+    if sample_rate is not None:
+        set_sample_rate(logger, sample_rate)
+    return logger
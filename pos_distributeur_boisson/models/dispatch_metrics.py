@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from .middleware_breaker import CircuitBreaker, STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN
+
+_logger = logging.getLogger(__name__)
+
+# Bornes (secondes) de l'histogramme de latence des requêtes middleware
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Délai maximum (secondes) avant qu'une mesure soit visible des autres workers
+FLUSH_INTERVAL = 5.0
+
+# Instantanés de workers arrêtés supprimés au-delà de cet âge (secondes)
+STALE_SNAPSHOT_AGE = 7 * 24 * 3600
+
+BREAKER_STATE_VALUES = {STATE_CLOSED: 0, STATE_HALF_OPEN: 1, STATE_OPEN: 2}
+
+METRIC_HELP = {
+    'pos_distributeur_credits_total': ('counter', "Crédits traités par le middleware, par issue (sent, cancelled, failed, offline), PLU et server_no"),
+    'pos_distributeur_middleware_requests_total': ('counter', "Requêtes HTTP envoyées au middleware Hart96, par route et statut"),
+    'pos_distributeur_middleware_request_duration_seconds': ('histogram', "Latence des requêtes HTTP au middleware Hart96"),
+    'pos_distributeur_breaker_state': ('gauge', "État du disjoncteur le plus dégradé parmi les workers (0 fermé, 1 semi-ouvert, 2 ouvert)"),
+    'pos_distributeur_breaker_open_workers': ('gauge', "Nombre de workers dont le disjoncteur est ouvert"),
+    'pos_distributeur_outbox_credits': ('gauge', "Crédits dans la file d'attente, par état"),
+    'pos_distributeur_presence_users': ('gauge', "Utilisateurs suivis par user.presence, en ligne ou non"),
+    'pos_distributeur_metrics_workers': ('gauge', "Workers vivants ayant publié des mesures"),
+}
+
+
+def _labels_key(labels):
+    return tuple(sorted((str(k), str(v)) for k, v in (labels or {}).items()))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class DispatchMetrics:
+    """
+    Compteurs du distributeur tenus en mémoire par le worker
+
+    Chaque worker publie périodiquement un instantané JSON dans un
+    répertoire partagé (un fichier par processus); l'export Prometheus
+    additionne les instantanés. Enregistrer une mesure ne touche ni la base
+    ni le disque: l'écriture est regroupée au plus toutes les FLUSH_INTERVAL
+    secondes par un timer.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self.directory = None
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._started_at = time.time()
+        self._last_flush = 0.0
+        self._flush_timer = None
+
+    @classmethod
+    def get(cls):
+        """Retourne les compteurs du processus courant"""
+        instance = cls._instance
+        if instance is None:
+            with cls._instance_lock:
+                instance = cls._instance
+                if instance is None:
+                    instance = cls._instance = cls()
+        return instance
+
+    def configure(self, directory=None):
+        if directory and directory != self.directory:
+            with self._lock:
+                self.directory = directory
+
+    @property
+    def snapshot_path(self):
+        return os.path.join(self.directory, f'worker-{os.getpid()}-{int(self._started_at * 1000)}.json')
+
+    # ------------------------------------------------------------------
+    # Enregistrement
+    # ------------------------------------------------------------------
+
+    def inc(self, name, labels=None, value=1):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._schedule_flush()
+
+    def observe(self, name, value, labels=None):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * (len(LATENCY_BUCKETS) + 1), 'sum': 0.0, 'count': 0}
+            index = next((i for i, bound in enumerate(LATENCY_BUCKETS) if value <= bound), len(LATENCY_BUCKETS))
+            histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+        self._schedule_flush()
+
+    def record_credit(self, outcome, plu_no, server_no, quantity=1):
+        self.inc('pos_distributeur_credits_total', {'outcome': outcome, 'plu': plu_no, 'server_no': server_no}, quantity or 1)
+
+    def record_request(self, endpoint, status, duration):
+        self.inc('pos_distributeur_middleware_requests_total', {'endpoint': endpoint, 'status': status})
+        self.observe('pos_distributeur_middleware_request_duration_seconds', duration, {'endpoint': endpoint})
+
+    # ------------------------------------------------------------------
+    # Publication
+    # ------------------------------------------------------------------
+
+    def _schedule_flush(self):
+        if not self.directory:
+            return
+        with self._lock:
+            if self._flush_timer is not None:
+                return
+            delay = max(FLUSH_INTERVAL - (time.monotonic() - self._last_flush), 0.0)
+            self._flush_timer = threading.Timer(delay, self._flush_from_timer)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _flush_from_timer(self):
+        with self._lock:
+            self._flush_timer = None
+        try:
+            self.flush()
+        except Exception as e:
+            _logger.warning(f"Impossible de publier les mesures du distributeur: {e}")
+
+    def snapshot(self):
+        with self._lock:
+            counters = [[name, dict(labels), value] for (name, labels), value in self._counters.items()]
+            histograms = [
+                [name, dict(labels), list(h['buckets']), h['sum'], h['count']]
+                for (name, labels), h in self._histograms.items()
+            ]
+        return {
+            'pid': os.getpid(),
+            'started_at': self._started_at,
+            'updated_at': time.time(),
+            'counters': counters,
+            'histograms': histograms,
+            'breakers': {breaker.middleware_url: breaker.state for breaker in CircuitBreaker.all_breakers()},
+        }
+
+    def flush(self):
+        """Écrit l'instantané du worker (remplacement atomique du fichier)"""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        snapshot = self.snapshot()
+        fd, tmp_path = tempfile.mkstemp(prefix='.worker-', suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        with self._lock:
+            self._last_flush = time.monotonic()
+
+
+def collect(directory):
+    """
+    Additionne les instantanés de tous les workers
+
+    Les compteurs des workers arrêtés restent comptés (ils sont
+    cumulatifs); l'état des disjoncteurs ne vient que des workers vivants.
+
+    Returns:
+        dict: counters et histograms agrégés par (nom, labels), breakers
+            {url: [états]} et workers (nombre de workers vivants)
+    """
+    counters = {}
+    histograms = {}
+    breakers = {}
+    workers = 0
+    now = time.time()
+    for path in glob.glob(os.path.join(directory, 'worker-*.json')):
+        try:
+            with open(path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        alive = _pid_alive(snapshot.get('pid', 0))
+        if not alive and now - snapshot.get('updated_at', 0) > STALE_SNAPSHOT_AGE:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            continue
+        for name, labels, value in snapshot.get('counters', []):
+            key = (name, _labels_key(labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, buckets, total, count in snapshot.get('histograms', []):
+            key = (name, _labels_key(labels))
+            histogram = histograms.setdefault(key, {'buckets': [0] * (len(LATENCY_BUCKETS) + 1), 'sum': 0.0, 'count': 0})
+            for i, bucket_count in enumerate(buckets[:len(histogram['buckets'])]):
+                histogram['buckets'][i] += bucket_count
+            histogram['sum'] += total
+            histogram['count'] += count
+        if alive:
+            workers += 1
+            for middleware_url, state in snapshot.get('breakers', {}).items():
+                breakers.setdefault(middleware_url, []).append(state)
+    return {'counters': counters, 'histograms': histograms, 'breakers': breakers, 'workers': workers}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(collected, gauges=None):
+    """
+    Format texte Prometheus (version 0.0.4)
+
+    Args:
+        collected (dict): Résultat de collect()
+        gauges (list): Jauges calculées au moment de l'export, [(nom, labels, valeur)]
+    """
+    samples = {}
+
+    def add(name, labels, value, suffix=''):
+        samples.setdefault(name, []).append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+
+    for (name, labels), value in sorted(collected['counters'].items()):
+        add(name, labels, value)
+    for (name, labels), histogram in sorted(collected['histograms'].items()):
+        cumulative = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS + ('+Inf',), histogram['buckets']):
+            cumulative += bucket_count
+            add(name, labels + (('le', str(bound)),), cumulative, '_bucket')
+        add(name, labels, round(histogram['sum'], 6), '_sum')
+        add(name, labels, histogram['count'], '_count')
+    for middleware_url, states in sorted(collected['breakers'].items()):
+        labels = (('middleware', middleware_url),)
+        add('pos_distributeur_breaker_state', labels, max(BREAKER_STATE_VALUES.get(state, 0) for state in states))
+        add('pos_distributeur_breaker_open_workers', labels, sum(1 for state in states if state == STATE_OPEN))
+    add('pos_distributeur_metrics_workers', (), collected['workers'])
+    for name, labels, value in gauges or []:
+        add(name, _labels_key(labels), value)
+
+    lines = []
+    for name, name_samples in samples.items():
+        metric_type, help_text = METRIC_HELP.get(name, ('untyped', ''))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(name_samples)
+    return '\n'.join(lines) + '\n'
+
+
+def _after_fork_in_child():
+    # Nouveau processus: nouveaux compteurs et nouvel instantané
+    DispatchMetrics._instance = None
+    DispatchMetrics._instance_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
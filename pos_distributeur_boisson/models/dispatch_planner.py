@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+
+class DispatchPlan:
+    """
+    Plan d'envoi d'une commande: trames Hart96 regroupées par (server_no, PLU, signe)
+
+    Chaque crédit ajouté garde sa source (item de la commande, nom du produit
+    ou de l'ingrédient, quantité) pour répartir ensuite le résultat de la
+    trame et journaliser produit par produit. Huit mojitos et quatre vodkas
+    donnent une trame par PLU distinct, quelle que soit la taille de la
+    tournée.
+    """
+
+    def __init__(self):
+        self._frames = {}
+
+    def __bool__(self):
+        return bool(self._frames)
+
+    def __len__(self):
+        return len(self._frames)
+
+    def add(self, server_no, plu_no, quantity, item_index, product_name, sign='+'):
+        key = (int(server_no), str(plu_no), sign)
+        frame = self._frames.get(key)
+        if frame is None:
+            frame = self._frames[key] = {
+                'server_no': key[0],
+                'plu_no': key[1],
+                'sign': sign,
+                'quantity': 0,
+                'sources': [],
+            }
+        quantity = int(quantity or 1)
+        frame['quantity'] += quantity
+        frame['sources'].append({'item_index': item_index, 'product_name': product_name, 'quantity': quantity})
+
+    @property
+    def frames(self):
+        """Trames dans l'ordre de première apparition"""
+        return list(self._frames.values())
+
+    @property
+    def source_count(self):
+        return sum(len(frame['sources']) for frame in self._frames.values())
+
+    def credits_list(self):
+        """Données de crédit à passer à MiddlewareClient.send_credits_batch"""
+        return [{
+            'server_no': frame['server_no'],
+            'plu_no': frame['plu_no'],
+            'sign': frame['sign'],
+            'quantity': frame['quantity'],
+        } for frame in self._frames.values()]
+
+    def item_frames(self):
+        """{item_index: [trames contenant cet item]}"""
+        by_item = {}
+        for frame in self._frames.values():
+            for index in {source['item_index'] for source in frame['sources']}:
+                by_item.setdefault(index, []).append(frame)
+        return by_item
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import threading
+import time
+
+from .middleware_transport import get_transport
+
+_logger = logging.getLogger(__name__)
+
+# Valeurs par défaut si aucun paramètre système n'est défini
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_RESET_TIMEOUT = 30.0
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class MiddlewareUnavailable(Exception):
+    """Levée quand le disjoncteur est ouvert: le middleware est considéré hors ligne"""
+
+
+class CircuitBreaker:
+    """
+    Disjoncteur partagé devant le middleware Hart96 (un par URL et par worker)
+
+    - fermé: les appels passent, les échecs consécutifs sont comptés;
+    - ouvert: après failure_threshold échecs consécutifs, tout appel échoue
+      immédiatement pendant reset_timeout secondes;
+    - semi-ouvert: une fois ce délai écoulé, une seule sonde GET /api/status
+      décide de refermer le circuit ou de le rouvrir.
+    """
+
+    _breakers = {}
+    _breakers_lock = threading.Lock()
+
+    def __init__(self, middleware_url, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.middleware_url = middleware_url
+        self.failure_threshold = max(int(failure_threshold), 1)
+        self.reset_timeout = float(reset_timeout)
+        self._lock = threading.Lock()
+        # Élection de l'unique sonde semi-ouverte, tenu hors de _lock pendant le GET
+        self._probe_lock = threading.Lock()
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._last_error = None
+
+    @classmethod
+    def for_url(cls, middleware_url):
+        """Retourne le disjoncteur partagé pour cette URL de middleware"""
+        breaker = cls._breakers.get(middleware_url)
+        if breaker is None:
+            with cls._breakers_lock:
+                breaker = cls._breakers.get(middleware_url)
+                if breaker is None:
+                    breaker = cls._breakers[middleware_url] = cls(middleware_url)
+        return breaker
+
+    @classmethod
+    def all_breakers(cls):
+        return list(cls._breakers.values())
+
+    def configure(self, failure_threshold=None, reset_timeout=None):
+        with self._lock:
+            if failure_threshold is not None:
+                self.failure_threshold = max(int(failure_threshold), 1)
+            if reset_timeout is not None:
+                self.reset_timeout = float(reset_timeout)
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return STATE_HALF_OPEN
+            return self._state
+
+    def get_status(self):
+        """Retourne l'état du disjoncteur pour affichage (verifier_statut_middleware)"""
+        state = self.state
+        with self._lock:
+            retry_in = 0.0
+            if state == STATE_OPEN:
+                retry_in = max(self.reset_timeout - (time.monotonic() - self._opened_at), 0.0)
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'failure_threshold': self.failure_threshold,
+                'retry_in': round(retry_in, 1),
+                'last_error': self._last_error,
+            }
+
+    def before_call(self):
+        """
+        À appeler avant chaque requête au middleware
+
+        Raises:
+            MiddlewareUnavailable: si le circuit est ouvert (ou si la sonde semi-ouverte échoue)
+        """
+        state = self.state
+        if state == STATE_CLOSED:
+            return
+        if state == STATE_OPEN:
+            raise MiddlewareUnavailable(self._last_error)
+        # Semi-ouvert: un seul appelant sonde /api/status, les autres échouent vite.
+        # La sonde (jusqu'à 2 s) tourne hors de _lock: state, record_success/failure
+        # et get_status ne l'attendent pas.
+        if not self._probe_lock.acquire(blocking=False):
+            raise MiddlewareUnavailable(self._last_error)
+        try:
+            # Une sonde précédente a pu refermer ou rouvrir le circuit entre-temps
+            state = self.state
+            if state == STATE_CLOSED:
+                return
+            if state == STATE_OPEN:
+                raise MiddlewareUnavailable(self._last_error)
+            error = self._probe()
+            with self._lock:
+                if error is None:
+                    _logger.info("🟢 Middleware Hart96 de nouveau joignable, disjoncteur refermé")
+                    self._state = STATE_CLOSED
+                    self._failures = 0
+                    return
+                self._last_error = error
+                self._opened_at = time.monotonic()
+            raise MiddlewareUnavailable(error)
+        finally:
+            self._probe_lock.release()
+
+    def _probe(self):
+        """GET /api/status; retourne None si le middleware répond, sinon l'erreur"""
+        try:
+            response = get_transport().get(f"{self.middleware_url}/api/status", timeout=2)
+            if response.status_code == 200:
+                return None
+            return f'HTTP {response.status_code}'
+        except Exception as e:
+            return str(e)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._state = STATE_CLOSED
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self._failures += 1
+            self._last_error = str(error) if error else self._last_error
+            if self._state != STATE_OPEN and self._failures >= self.failure_threshold:
+                _logger.error(f"🔴 Middleware Hart96 hors ligne après {self._failures} échecs, disjoncteur ouvert")
+                self._state = STATE_OPEN
+                self._opened_at = time.monotonic()
+
+
+def _after_fork_in_child():
+    CircuitBreaker._breakers = {}
+    CircuitBreaker._breakers_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
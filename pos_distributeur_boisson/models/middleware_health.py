@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import threading
+import time
+
+from .middleware_transport import get_transport
+
+_logger = logging.getLogger(__name__)
+
+# Valeurs par défaut si aucun paramètre système n'est défini
+DEFAULT_PROBE_INTERVAL = 10.0
+
+# Le prober s'arrête si personne n'a lu le statut depuis ce nombre d'intervalles
+IDLE_PROBES_BEFORE_STOP = 30
+
+
+class MiddlewareHealth:
+    """
+    Cache du statut du middleware Hart96 (un par URL et par worker)
+
+    Un thread d'arrière-plan interroge GET /api/status toutes les
+    probe_interval secondes; les appelants lisent le dernier statut connu
+    (joignable, port série connecté, port, baudrate) et son âge sans aller
+    -retour réseau. Le thread s'arrête de lui-même quand plus personne ne
+    lit le statut et redémarre à la lecture suivante.
+    """
+
+    _healths = {}
+    _healths_lock = threading.Lock()
+
+    def __init__(self, middleware_url, probe_interval=DEFAULT_PROBE_INTERVAL):
+        self.middleware_url = middleware_url
+        self.probe_interval = float(probe_interval)
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+        self._status = None
+        self._checked_at = 0.0
+        self._last_read = 0.0
+        self._prober = None
+
+    @classmethod
+    def for_url(cls, middleware_url):
+        """Retourne le cache de statut partagé pour cette URL de middleware"""
+        health = cls._healths.get(middleware_url)
+        if health is None:
+            with cls._healths_lock:
+                health = cls._healths.get(middleware_url)
+                if health is None:
+                    health = cls._healths[middleware_url] = cls(middleware_url)
+        return health
+
+    def configure(self, probe_interval=None):
+        with self._lock:
+            if probe_interval is not None:
+                self.probe_interval = max(float(probe_interval), 1.0)
+
+    def get_status(self, max_age=None):
+        """
+        Retourne le dernier statut connu du middleware
+
+        Le réseau n'est sollicité que si aucun statut n'a encore été relevé
+        ou si le statut est plus vieux que max_age secondes.
+
+        Args:
+            max_age (float): Âge maximum accepté (secondes); None = intervalle du prober x 3
+
+        Returns:
+            dict: reachable, connected, port, baudrate, status_code, error,
+                payload et age (secondes depuis la dernière vérification)
+        """
+        with self._lock:
+            self._last_read = time.monotonic()
+            status, checked_at = self._status, self._checked_at
+        if max_age is None:
+            max_age = self.probe_interval * 3
+        if status is None or time.monotonic() - checked_at > max_age:
+            status, checked_at = self.refresh()
+        self._ensure_prober()
+        return dict(status, age=round(time.monotonic() - checked_at, 1))
+
+    def refresh(self):
+        """Interroge /api/status maintenant et met le cache à jour"""
+        with self._probe_lock:
+            status = self._probe()
+            with self._lock:
+                self._status = status
+                self._checked_at = time.monotonic()
+                return self._status, self._checked_at
+
+    def _probe(self):
+        status = {
+            'reachable': False,
+            'connected': False,
+            'port': None,
+            'baudrate': None,
+            'status_code': None,
+            'error': None,
+            'payload': None,
+        }
+        try:
+            response = get_transport().get(f"{self.middleware_url}/api/status", timeout=5)
+            status['status_code'] = response.status_code
+            if response.status_code != 200:
+                status['error'] = f'HTTP {response.status_code}'
+                return status
+            status['reachable'] = True
+            try:
+                payload = response.json()
+            except ValueError:
+                payload = None
+            if not isinstance(payload, dict):
+                # Réponse non-JSON: middleware joignable, état du port inconnu
+                status['connected'] = None
+                status['payload'] = response.text
+                return status
+            status.update({
+                'connected': bool(payload['connected']) if 'connected' in payload else None,
+                'port': payload.get('port'),
+                'baudrate': payload.get('baudrate'),
+                'payload': payload,
+            })
+        except Exception as e:
+            status['error'] = str(e)
+        return status
+
+    def _ensure_prober(self):
+        with self._lock:
+            if self._prober is not None and self._prober.is_alive():
+                return
+            self._prober = threading.Thread(
+                target=self._probe_loop,
+                name=f'hart96-health-{self.middleware_url}',
+                daemon=True,
+            )
+            self._prober.start()
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.probe_interval)
+            with self._lock:
+                if time.monotonic() - self._last_read > self.probe_interval * IDLE_PROBES_BEFORE_STOP:
+                    self._prober = None
+                    return
+            previous = self._status
+            status, _checked_at = self.refresh()
+            if previous and previous['reachable'] != status['reachable']:
+                if status['reachable']:
+                    _logger.info(f"🟢 Middleware Hart96 joignable ({self.middleware_url})")
+                else:
+                    _logger.warning(f"🔴 Middleware Hart96 injoignable ({self.middleware_url}): {status['error']}")
+
+
+def _after_fork_in_child():
+    # Les threads de sonde ne survivent pas au fork: repartir de zéro
+    MiddlewareHealth._healths = {}
+    MiddlewareHealth._healths_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
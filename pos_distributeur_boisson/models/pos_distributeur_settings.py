@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+from odoo import models, api, tools
+from odoo.tools import frozendict
+from .middleware_transport import DEFAULT_POOL_SIZE, DEFAULT_IDLE_TIMEOUT
+from .middleware_session import DEFAULT_IDLE_TIMEOUT as DEFAULT_SERIAL_IDLE_TIMEOUT, DEFAULT_HEALTH_INTERVAL
+from .middleware_breaker import DEFAULT_FAILURE_THRESHOLD, DEFAULT_RESET_TIMEOUT
+from .middleware_health import DEFAULT_PROBE_INTERVAL
+from .middleware_client import DEFAULT_RETRY_MAX_ATTEMPTS, DEFAULT_RETRY_BASE_DELAY, DEFAULT_CREDIT_DEADLINE
+from .pos_credit_outbox import DEFAULT_BATCH_SIZE, DEFAULT_MAX_ATTEMPTS, DEFAULT_RETRY_DELAY
+from .dispatch_timing import DEFAULT_SLOW_THRESHOLD_MS
+
+_logger = logging.getLogger(__name__)
+
+# URL utilisée si pos_distributeur.middleware_url n'est pas défini
+DEFAULT_MIDDLEWARE_URL = 'http://192.168.1.59:5000'
+DEFAULT_SERVER_NO = 1
+
+
+def default_metrics_dir():
+    """Répertoire partagé des instantanés de mesures des workers"""
+    return os.path.join(tools.config['data_dir'], 'pos_distributeur_metrics')
+
+
+def _to_int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _to_float(value, default):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _to_bool(value):
+    return str(value or '').strip().lower() not in ('', '0', 'false', 'no', 'none')
+
+
+def normalize_middleware_url(url):
+    """Normalise l'URL du middleware (schéma, port par défaut, sans / final)"""
+    url = (url or DEFAULT_MIDDLEWARE_URL).strip().rstrip('/')
+    if not url.startswith(('http://', 'https://')):
+        url = f"http://{url}"
+    # S'assurer que l'URL a un port
+    if not url.endswith(':5000') and not url.endswith(':80'):
+        if 'http://192.168.1.59' in url:
+            url = 'http://192.168.1.59:5000'
+    return url
+
+
+class PosDistributeurSettings(models.AbstractModel):
+    """
+    Paramètres du distributeur lus une fois par worker
+
+    Tous les paramètres pos_distributeur.* sont lus et typés en une fois puis
+    gardés dans le cache du registre: le chemin d'envoi d'un crédit ne
+    touche plus la base pour savoir où et comment envoyer. Le cache est vidé
+    par toute écriture dans ir.config_parameter et par
+    res.config.settings.set_values, sur tous les workers.
+    """
+    _name = 'pos.distributeur.settings'
+    _description = 'Paramètres du distributeur de boissons'
+
+    @api.model
+    @tools.ormcache()
+    def _get_settings(self):
+        """
+        Returns:
+            frozendict: Paramètres typés (ne pas modifier, partagé par le worker)
+        """
+        params = self.env['ir.config_parameter'].sudo()
+
+        def get(key):
+            return params.get_param(f'pos_distributeur.{key}')
+
+        settings = frozendict({
+            'middleware_url': normalize_middleware_url(get('middleware_url')),
+            'middleware_token': get('middleware_token') or '',
+            'server_no': _to_int(get('server_no'), DEFAULT_SERVER_NO),
+            'http_pool_size': _to_int(get('http_pool_size'), DEFAULT_POOL_SIZE),
+            'http_idle_timeout': _to_float(get('http_idle_timeout'), DEFAULT_IDLE_TIMEOUT),
+            'serial_idle_timeout': _to_float(get('serial_idle_timeout'), DEFAULT_SERIAL_IDLE_TIMEOUT),
+            'serial_health_interval': _to_float(get('serial_health_interval'), DEFAULT_HEALTH_INTERVAL),
+            'health_probe_interval': _to_float(get('health_probe_interval'), DEFAULT_PROBE_INTERVAL),
+            'breaker_failure_threshold': _to_int(get('breaker_failure_threshold'), DEFAULT_FAILURE_THRESHOLD),
+            'breaker_reset_timeout': _to_float(get('breaker_reset_timeout'), DEFAULT_RESET_TIMEOUT),
+            'retry_max_attempts': max(_to_int(get('retry_max_attempts'), DEFAULT_RETRY_MAX_ATTEMPTS), 1),
+            'retry_base_delay': _to_float(get('retry_base_delay'), DEFAULT_RETRY_BASE_DELAY),
+            'credit_deadline': _to_float(get('credit_deadline'), DEFAULT_CREDIT_DEADLINE),
+            'async_dispatch': _to_bool(get('async_dispatch')),
+            'outbox_batch_size': max(_to_int(get('outbox_batch_size'), DEFAULT_BATCH_SIZE), 1),
+            'outbox_max_attempts': max(_to_int(get('outbox_max_attempts'), DEFAULT_MAX_ATTEMPTS), 1),
+            'outbox_retry_delay': max(_to_float(get('outbox_retry_delay'), DEFAULT_RETRY_DELAY), 0.0),
+            'metrics_dir': get('metrics_dir') or default_metrics_dir(),
+            'metrics_token': get('metrics_token') or '',
+            'credit_log_sample_rate': max(_to_int(get('credit_log_sample_rate'), 1), 1),
+            'slow_credit_threshold_ms': _to_float(get('slow_credit_threshold_ms'), DEFAULT_SLOW_THRESHOLD_MS),
+        })
+        _logger.debug(f"Paramètres distributeur chargés: {settings['middleware_url']} (server_no={settings['server_no']})")
+        return settings
+
+    @api.model
+    def _invalidate_settings(self):
+        """Vide le cache des paramètres sur ce worker et, en fin de requête, sur les autres"""
+        self.env.registry.clear_cache()
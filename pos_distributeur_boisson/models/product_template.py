@@ -3,6 +3,7 @@
 from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError
 import logging
+from .plu_index import TEMPLATE_INDEX_FIELDS
 
 _logger = logging.getLogger(__name__)
 
@@ -106,3 +107,9 @@ class ProductTemplate(models.Model):
                     record.name
                 )
 
+    def write(self, vals):
+        # Nom, archivage et disponibilité POS des variantes sont repris dans l'index PLU
+        result = super().write(vals)
+        if set(vals).intersection(TEMPLATE_INDEX_FIELDS):
+            self.env['pos.distributeur.plu.index']._invalidate_index()
+        return result
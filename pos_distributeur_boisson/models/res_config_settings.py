@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from odoo import fields, models
+from .pos_distributeur_settings import DEFAULT_MIDDLEWARE_URL
 
 
 class ResConfigSettings(models.TransientModel):
@@ -15,7 +16,7 @@ class ResConfigSettings(models.TransientModel):
     pos_distributeur_middleware_url = fields.Char(
         string="URL du Middleware",
         config_parameter='pos_distributeur.middleware_url',
-        default='http://192.168.1.58:5000',
+        default=DEFAULT_MIDDLEWARE_URL,
         help="URL du middleware pour la communication avec l'appareil distributeur (ex: http://192.168.1.58:5000)"
     )
     
@@ -33,12 +34,48 @@ class ResConfigSettings(models.TransientModel):
         help="Numéro d'identification du serveur/distributeur de boissons (ex: 1, 2, 3...)"
     )
 
+    pos_distributeur_http_pool_size = fields.Integer(
+        string="Taille du pool HTTP",
+        config_parameter='pos_distributeur.http_pool_size',
+        default=10,
+        help="Nombre maximum de connexions keep-alive gardées ouvertes vers le middleware par worker Odoo"
+    )
+
+    pos_distributeur_http_idle_timeout = fields.Integer(
+        string="Inactivité max du pool HTTP (s)",
+        config_parameter='pos_distributeur.http_idle_timeout',
+        default=60,
+        help="Au-delà de ce délai sans requête, les connexions au middleware sont fermées puis rouvertes à la demande (0 = jamais)"
+    )
+
+    pos_distributeur_serial_idle_timeout = fields.Integer(
+        string="Inactivité max de la session série (s)",
+        config_parameter='pos_distributeur.serial_idle_timeout',
+        default=30,
+        help="La session série du middleware reste ouverte tant que des crédits arrivent et se ferme après ce délai sans activité (0 = fermeture après chaque envoi)"
+    )
+
+    pos_distributeur_serial_health_interval = fields.Integer(
+        string="Intervalle de vérification de la session série (s)",
+        config_parameter='pos_distributeur.serial_health_interval',
+        default=15,
+        help="Une session série gardée ouverte est revérifiée via /api/status après ce délai avant d'être réutilisée"
+    )
+
+    pos_distributeur_async_dispatch = fields.Boolean(
+        string="Envoi asynchrone des crédits",
+        config_parameter='pos_distributeur.async_dispatch',
+        help="Les crédits sont mis en file d'attente dans la transaction de la commande et envoyés au middleware par le cron de dispatch: le POS n'attend plus la réponse du distributeur"
+    )
+
     def set_values(self):
         """Sauvegarde les valeurs de configuration"""
-        super().set_values()
-        # Ici vous pouvez ajouter une logique de validation si nécessaire
+        # Normaliser avant l'écriture dans ir.config_parameter
         if self.pos_distributeur_middleware_url and not self.pos_distributeur_middleware_url.startswith(('http://', 'https://')):
             self.pos_distributeur_middleware_url = f"http://{self.pos_distributeur_middleware_url}"
+        super().set_values()
+        # Recharger les paramètres en cache sur tous les workers
+        self.env['pos.distributeur.settings']._invalidate_settings()
 
     def get_values(self):
         """Récupère les valeurs de configuration"""
@@ -46,7 +83,7 @@ class ResConfigSettings(models.TransientModel):
         # Récupérer les valeurs depuis les paramètres système
         config_param = self.env['ir.config_parameter'].sudo()
         res.update({
-            'pos_distributeur_middleware_url': config_param.get_param('pos_distributeur.middleware_url', 'http://192.168.1.58:5000'),
+            'pos_distributeur_middleware_url': config_param.get_param('pos_distributeur.middleware_url', DEFAULT_MIDDLEWARE_URL),
             'pos_distributeur_middleware_token': config_param.get_param('pos_distributeur.middleware_token', ''),
             'pos_distributeur_server_no': int(config_param.get_param('pos_distributeur.server_no', '1')),
         })
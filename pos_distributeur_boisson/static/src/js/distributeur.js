@@ -4,6 +4,9 @@ import { useService } from "@web/core/utils/hooks";
 import { ProductScreen } from "@point_of_sale/app/screens/product_screen/product_screen";
 import { _t } from "@web/core/l10n/translation";
 
+// Abonnement unique aux résultats du dispatch asynchrone (pos.credit.outbox)
+let creditStatusSubscribed = false;
+
 export class DistributeurButton extends Component {
     static template = "pos_distributeur_boisson.DistributeurButton";
     
@@ -12,17 +15,28 @@ export class DistributeurButton extends Component {
         this.popup = useService("popup");
         this.rpc = useService("rpc");
         this.notification = useService("notification");
+        this.subscribeCreditStatus();
+    }
+    
+    subscribeCreditStatus() {
+        const bus = this.env.services.bus_service;
+        if (!bus || creditStatusSubscribed) return;
+        creditStatusSubscribed = true;
+        const notification = this.notification;
+        bus.subscribe("pos_distributeur_boisson/credit_status", (payload) => {
+            const credits = payload?.credits || [];
+            const sent = credits.filter((c) => c.state === 'done').length;
+            const failed = credits.filter((c) => c.state === 'failed');
+            if (failed.length) {
+                notification.add(`❌ ${_t("Crédits non envoyés")}: ${failed.map((c) => c.product_name).join(', ')}`, { type: "danger" });
+            } else if (sent) {
+                notification.add(`✅ ${_t("Crédits envoyés au distributeur")} (${sent})`, { type: "success" });
+            }
+        });
     }
     
     async onClick() {
         try {
-            // Vérifier droit Barman
-            const grp = await this.rpc('/pos_distributeur_boisson/is_barman', {});
-            if (!grp?.is_barman) {
-                this.notification.add(_t("Accès refusé: réservé aux Barmans"), { type: "danger" });
-                return;
-            }
-            
             const pos = this.env.services.pos;
             if (!pos) {
                 this.notification.add(_t("Erreur: Service POS non disponible"), { type: "danger" });
@@ -45,15 +59,10 @@ export class DistributeurButton extends Component {
                 let product = line.get_product ? line.get_product() : line.product;
                 if (product) {
                     const isDistributeur = product.is_distributeur_boisson || product.needs_distributor || product.distributeur_boisson;
-                    const isCocktail = product.is_combo_product;
                     if (isDistributeur) {
                         let quantity = line.get_quantity ? line.get_quantity() : (line.quantity ?? line.qty ?? 1);
-                        if (isCocktail) {
-                            items.push({ type: 'cocktail', product_id: product.id, product_name: product.name, quantity, server_name: 'Serveur' });
-                        } else {
-                            // Laisser le backend injecter server_no (employé)
-                            items.push({ plu_no: product.plu_code?.replace('PLU','PLU') || product.plu_code || 'PLU1', sign: '+', quantity, product_name: product.name });
-                        }
+                        // Le serveur développe les recettes et injecte server_no (employé)
+                        items.push({ product_id: product.id, product_name: product.name, quantity, is_cocktail: !!product.is_combo_product });
                     }
                 }
             }
@@ -62,30 +71,31 @@ export class DistributeurButton extends Component {
                 return;
             }
             this.notification.add(_t("⏳ Envoi de la commande au distributeur..."), { type: "info" });
-            try {
-                const connectionTest = await this.rpc('/pos_distributeur_boisson/test_middleware_connection', {});
-                if (connectionTest?.success) this.notification.add(_t("✅ Connexion au middleware établie"), { type: "success" });
-                else this.notification.add(_t("❌ Impossible de se connecter au middleware"), { type: "warning" });
-            } catch (_) {}
-            const results = [];
-            let successCount = 0;
-            for (let i = 0; i < items.length; i++) {
-                const item = items[i];
-                try {
-                    let result;
-                    if (item.type === 'cocktail') {
-                        result = await this.rpc('/pos_distributeur_boisson/send_cocktail_ingredients', { product_id: item.product_id, quantity: item.quantity, server_name: item.server_name });
-                    } else {
-                        // Passer par le modèle qui injecte server_no et journalise
-                        result = await this.rpc('/web/dataset/call_kw', { model: 'pos.session', method: 'send_credit_to_middleware', args: [item], kwargs: {} });
-                    }
-                    if (result?.success) { successCount++; results.push({ item, success: true, message: result.message || 'OK', details: result.details || null, ingredients_list: result.ingredients_list || null }); }
-                    else { results.push({ item, success: false, message: result?.error || result?.message || 'Erreur inconnue', details: result?.details || null }); }
-                } catch (error) {
-                    results.push({ item, success: false, message: `Erreur réseau: ${error.message}` });
-                }
+            // Un seul appel: droits Barman, développement des cocktails et envoi groupé côté serveur
+            const result = await this.rpc('/pos_distributeur_boisson/dispatch_order', {
+                order_id: currentOrder.name || currentOrder.uid,
+                items,
+            });
+            if (result?.error) {
+                this.notification.add(`❌ ${result.error}`, { type: "danger" });
+                return;
+            }
+            if (result?.offline) {
+                // Disjoncteur ouvert: rien n'a été envoyé
+                const offlineMessage = (result.details || []).find((d) => d.details?.offline)?.message || result.message;
+                this.notification.add(`⛔ ${offlineMessage}`, { type: "danger", sticky: true });
+                return;
+            }
+            const details = result?.details || [];
+            const successCount = details.filter((d) => d.success).length;
+            if (result?.queued) {
+                this.notification.add(`${result.success ? '⏳' : '❌'} ${result.message}`, { type: result.success ? "info" : "danger" });
+                return;
+            }
+            for (const detail of details.filter((d) => !d.success)) {
+                this.notification.add(`❌ ${detail.item?.product_name || ''}: ${detail.message}`, { type: "warning" });
             }
-            const summary = successCount === items.length;
+            const summary = result?.success && successCount === items.length;
             this.notification.add(`${summary ? '✅' : '❌'} ${summary ? _t('Commande envoyée avec succès') : _t("Erreurs lors de l'envoi") } (${successCount}/${items.length})`, { type: summary ? "success" : "danger" });
         } catch (error) {
             this.notification.add(`❌ ${error.message}`, { type: "danger" });
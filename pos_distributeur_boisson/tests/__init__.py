@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+from . import test_catalog_import
+from . import test_dispatch_planner
+from . import test_credit_allocation
+from . import test_credit_outbox
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+from odoo.tests import TransactionCase, tagged
+from odoo.tools import mute_logger
+
+from odoo.addons.pos_distributeur_boisson.models.catalog_import import PosDistributeurCatalogImport
+
+
+@tagged('post_install', '-at_install')
+class TestCatalogImport(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env = cls.env(user=cls.env.ref('base.user_admin'))
+        cls.Import = cls.env['pos.distributeur.catalog.import']
+
+    def _products(self, *plu_codes):
+        return self.env['product.product'].with_context(active_test=False).search([('plu_code', 'in', list(plu_codes))])
+
+    def test_duplicate_barcode_rejects_only_its_chunk(self):
+        """Un code-barres déjà utilisé annule son lot, pas l'import"""
+        rows = [
+            {'plu_code': 'TSTIMP1', 'name': 'Import test 1', 'barcode': '9990000000011'},
+            {'plu_code': 'TSTIMP2', 'name': 'Import test 2', 'barcode': '9990000000011'},
+            {'plu_code': 'TSTIMP3', 'name': 'Import test 3', 'barcode': '9990000000028'},
+        ]
+        result = self.Import.import_catalog('products', rows, chunk_size=1)
+
+        self.assertFalse(result['success'])
+        self.assertEqual(result['created'], 2)
+        self.assertEqual(result['rejected'], 1)
+        self.assertEqual([error['line'] for error in result['errors']], [2])
+        self.assertEqual(sorted(self._products('TSTIMP1', 'TSTIMP2', 'TSTIMP3').mapped('plu_code')), ['TSTIMP1', 'TSTIMP3'])
+
+    def test_database_error_rejects_chunk(self):
+        """Une erreur de la base (psycopg2) est rapportée comme un lot rejeté"""
+        original = PosDistributeurCatalogImport._import_products_chunk
+
+        def _import_products_chunk(self, chunk, errors):
+            if any(row['plu_code'] == 'TSTIMP5' for _line, row in chunk):
+                self.env.cr.execute("SELECT 1/0")
+            return original(self, chunk, errors)
+
+        rows = [
+            {'plu_code': 'TSTIMP4', 'name': 'Import test 4'},
+            {'plu_code': 'TSTIMP5', 'name': 'Import test 5'},
+            {'plu_code': 'TSTIMP6', 'name': 'Import test 6'},
+        ]
+        with patch.object(PosDistributeurCatalogImport, '_import_products_chunk', _import_products_chunk), \
+                mute_logger('odoo.sql_db'):
+            result = self.Import.import_catalog('products', rows, chunk_size=2)
+
+        # Le premier lot (lignes 1-2) est annulé en entier
+        self.assertEqual(result['created'], 1)
+        self.assertEqual(result['rejected'], 2)
+        self.assertEqual(sorted(self._products('TSTIMP4', 'TSTIMP5', 'TSTIMP6').mapped('plu_code')), ['TSTIMP6'])
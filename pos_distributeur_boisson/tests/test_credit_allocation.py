@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+from odoo.tests import TransactionCase, tagged
+
+from odoo.addons.pos_distributeur_boisson.models.middleware_client import MiddlewareClient
+
+
+@tagged('post_install', '-at_install')
+class TestCreditAllocation(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        admin = cls.env.ref('base.user_admin')
+        admin.groups_id |= cls.env.ref('pos_user_org.group_pos_barman')
+        cls.env = cls.env(user=admin)
+        cls.Log = cls.env['pos.credit.log']
+
+    def _credit(self, quantity, **vals):
+        return self.Log.create(dict({
+            'product_name': 'Vodka test',
+            'plu_no': 'TSTALC1',
+            'server_no': 3,
+            'quantity': quantity,
+        }, **vals))
+
+    def test_allocate_quantity_skips_inactive_credits(self):
+        """Les unités vont aux crédits du recordset dans l'ordre, sans dépasser leur quantité restante"""
+        first = self._credit(3)
+        cancelled = self._credit(2, status='cancelled', remaining_quantity=0)
+        last = self._credit(2)
+        credits = first | cancelled | last
+
+        self.assertEqual(credits._allocate_quantity(4), [(first, 3), (last, 1)])
+        self.assertEqual(credits._allocate_quantity(10), [(first, 3), (last, 2)])
+        self.assertEqual(credits._allocate_quantity(0), [])
+        # Rien n'est écrit
+        self.assertEqual(first.remaining_quantity, 3)
+
+    def test_partial_cancellation_keeps_credit_sent(self):
+        """Une annulation partielle décrémente la quantité restante, un crédit épuisé passe en cancelled"""
+        partial = self._credit(3)
+        exhausted = self._credit(1)
+        calls = []
+
+        def send_credits_batch(client, credits_list, auto_connect=True):
+            calls.append(credits_list)
+            results = [{'success': True, 'message': 'OK', 'response': 'OK'} for _credit in credits_list]
+            return {'success': True, 'message': 'OK', 'total_credits': len(credits_list), 'results': results, 'timings': {}}
+
+        allocations = (partial | exhausted)._allocate_quantity(2)
+        self.assertEqual(allocations, [(partial, 2)])
+        allocations.append((exhausted, 1))
+        with patch.object(MiddlewareClient, 'send_credits_batch', send_credits_batch):
+            cancelled = self.Log._cancel_allocations(allocations, 'Annulation test')
+
+        # Une seule trame négative pour les deux crédits du même (server_no, PLU)
+        self.assertEqual(calls, [[{'server_no': 3, 'plu_no': 'TSTALC1', 'sign': '-', 'quantity': 3}]])
+        self.assertEqual(cancelled, 3)
+        self.assertEqual((partial.status, partial.remaining_quantity), ('sent', 1))
+        self.assertEqual((exhausted.status, exhausted.remaining_quantity), ('cancelled', 0))
+        cancellations = self.Log.search([('plu_no', '=', 'TSTALC1'), ('is_cancellation', '=', True)])
+        self.assertEqual(sorted(cancellations.mapped('quantity')), [1, 2])
+
+    def test_failed_cancellation_leaves_quantities(self):
+        """Une trame refusée ne consomme aucune unité"""
+        credit = self._credit(2)
+
+        def send_credits_batch(client, credits_list, auto_connect=True):
+            results = [{'success': False, 'message': 'Refusé'} for _credit in credits_list]
+            return {'success': False, 'message': 'Refusé', 'total_credits': len(credits_list), 'results': results, 'timings': {}}
+
+        with patch.object(MiddlewareClient, 'send_credits_batch', send_credits_batch):
+            cancelled = self.Log._cancel_allocations(credit._allocate_quantity(1), 'Annulation test')
+
+        self.assertEqual(cancelled, 0)
+        self.assertEqual((credit.status, credit.remaining_quantity), ('sent', 2))
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests import TransactionCase, tagged
+
+from odoo.addons.pos_distributeur_boisson.models.middleware_client import MiddlewareClient
+from odoo.addons.pos_distributeur_boisson.models.pos_credit_outbox import DEFAULT_RETRY_DELAY
+
+
+@tagged('post_install', '-at_install')
+class TestCreditOutbox(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Outbox = cls.env['pos.credit.outbox'].sudo()
+        cls.env['ir.config_parameter'].sudo().set_param('pos_distributeur.outbox_retry_delay', DEFAULT_RETRY_DELAY)
+
+    def _enqueue(self, *plu_nos):
+        return self.Outbox.create([
+            {'product_name': f'Produit {plu_no}', 'plu_no': plu_no, 'server_no': 3, 'quantity': 1}
+            for plu_no in plu_nos
+        ])
+
+    def _dispatch(self, send_credits_batch):
+        """Passage du cron avec le middleware simulé; les commit du cron restent dans la transaction de test"""
+        with patch.object(MiddlewareClient, 'send_credits_batch', send_credits_batch), \
+                patch.object(self.env.cr, 'commit', lambda: None):
+            return self.Outbox._cron_dispatch()
+
+    def test_failed_credit_waits_for_next_attempt(self):
+        """Un crédit refusé attend next_attempt_at et n'est pas renvoyé dans le même passage"""
+        accepted, refused = self._enqueue('TSTOBX1', 'TSTOBX2')
+        calls = []
+
+        def send_credits_batch(client, credits_list, auto_connect=True):
+            calls.append([credit['credit_id'] for credit in credits_list])
+            results = [
+                {'success': credit['plu_no'] == 'TSTOBX1', 'message': 'OK' if credit['plu_no'] == 'TSTOBX1' else 'PLU inconnu', 'credit_id': credit['credit_id']}
+                for credit in credits_list
+            ]
+            return {'success': False, 'message': '1/2 crédits envoyés avec succès', 'total_credits': len(credits_list), 'results': results, 'timings': {}}
+
+        before = fields.Datetime.now()
+        self._dispatch(send_credits_batch)
+
+        self.assertEqual(calls, [[accepted.credit_id, refused.credit_id]])
+        self.assertEqual(accepted.state, 'done')
+        self.assertTrue(accepted.credit_log_id)
+        self.assertEqual((refused.state, refused.attempts, refused.last_error), ('pending', 1, 'PLU inconnu'))
+        self.assertGreaterEqual(refused.next_attempt_at, before + timedelta(seconds=DEFAULT_RETRY_DELAY))
+
+        # Passage suivant avant l'échéance: rien n'est renvoyé
+        self._dispatch(send_credits_batch)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(refused.attempts, 1)
+
+    def test_missing_results_count_as_failed_attempts(self):
+        """Une réponse sans résultat par crédit consomme une tentative avec le message du lot"""
+        outbox = self._enqueue('TSTOBX3', 'TSTOBX4')
+
+        def send_credits_batch(client, credits_list, auto_connect=True):
+            return {'success': False, 'message': 'Réponse incomplète'}
+
+        self._dispatch(send_credits_batch)
+
+        self.assertEqual(outbox.mapped('state'), ['pending', 'pending'])
+        self.assertEqual(outbox.mapped('attempts'), [1, 1])
+        self.assertEqual(outbox.mapped('last_error'), ['Réponse incomplète', 'Réponse incomplète'])
+        self.assertTrue(all(outbox.mapped('next_attempt_at')))
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+from odoo.tests import TransactionCase, new_test_user, tagged
+
+from odoo.addons.pos_distributeur_boisson.models.dispatch_planner import DispatchPlan
+from odoo.addons.pos_distributeur_boisson.models.middleware_client import MiddlewareClient
+
+
+@tagged('post_install', '-at_install')
+class TestDispatchPlanner(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.barman = new_test_user(
+            cls.env, login='barman_dispatch_test',
+            groups='base.group_user,point_of_sale.group_pos_user,pos_user_org.group_pos_barman',
+        )
+        cls.env['hr.employee'].create({'name': 'Barman test', 'user_id': cls.barman.id, 'server_no': 3})
+        Product = cls.env['product.product']
+        cls.vodka = Product.create({'name': 'Vodka test', 'plu_code': 'TSTDSP1', 'is_distributeur_boisson': True, 'needs_distributor': True})
+        cls.rhum = Product.create({'name': 'Rhum test', 'plu_code': 'TSTDSP2', 'is_distributeur_boisson': True, 'needs_distributor': True})
+
+    def test_plan_coalesces_by_server_and_plu(self):
+        """Une trame par (server_no, PLU, signe), quantités additionnées"""
+        plan = DispatchPlan()
+        plan.add(3, 'PLU1', 4, 0, 'Vodka')
+        plan.add(3, 'PLU2', 1, 1, 'Mojito - Rhum')
+        plan.add(3, 'PLU1', 2, 1, 'Mojito - Vodka')
+        plan.add(5, 'PLU1', 1, 2, 'Vodka')
+        plan.add(3, 'PLU1', 1, 3, 'Vodka', sign='-')
+
+        self.assertEqual(len(plan), 4)
+        self.assertEqual(plan.source_count, 5)
+        self.assertEqual(plan.credits_list(), [
+            {'server_no': 3, 'plu_no': 'PLU1', 'sign': '+', 'quantity': 6},
+            {'server_no': 3, 'plu_no': 'PLU2', 'sign': '+', 'quantity': 1},
+            {'server_no': 5, 'plu_no': 'PLU1', 'sign': '+', 'quantity': 1},
+            {'server_no': 3, 'plu_no': 'PLU1', 'sign': '-', 'quantity': 1},
+        ])
+        item_frames = plan.item_frames()
+        self.assertEqual([frame['plu_no'] for frame in item_frames[1]], ['PLU1', 'PLU2'])
+        self.assertEqual(len(item_frames[0]), 1)
+
+    def test_order_results_per_item(self):
+        """Une requête pour la commande, un résultat par item et une ligne de journal par source"""
+        calls = []
+
+        def send_credits_batch(client, credits_list, auto_connect=True):
+            calls.append(credits_list)
+            results = [
+                {'success': credit['plu_no'] != 'TSTDSP2', 'message': 'OK' if credit['plu_no'] != 'TSTDSP2' else 'PLU inconnu', 'credit_id': f'TSTDSP-{index}'}
+                for index, credit in enumerate(credits_list)
+            ]
+            return {'success': False, 'message': 'lot', 'total_credits': len(credits_list), 'results': results, 'timings': {}}
+
+        items = [
+            {'product_id': self.vodka.id, 'quantity': 4},
+            {'product_id': self.vodka.id, 'quantity': 2},
+            {'product_id': self.rhum.id, 'quantity': 1},
+        ]
+        Session = self.env['pos.session'].with_user(self.barman)
+        with patch.object(MiddlewareClient, 'send_credits_batch', send_credits_batch):
+            result = Session.envoyer_commande_distributeur({'order_id': 'TSTDSP', 'items': items})
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([(credit['plu_no'], credit['quantity'], credit['server_no']) for credit in calls[0]], [('TSTDSP1', 6, 3), ('TSTDSP2', 1, 3)])
+        self.assertEqual(result['frames_sent'], 2)
+        self.assertEqual([detail['success'] for detail in result['details']], [True, True, False])
+        self.assertIn('PLU inconnu', result['details'][2]['message'])
+
+        logs = self.env['pos.credit.log'].search([('plu_no', 'in', ['TSTDSP1', 'TSTDSP2'])], order='id')
+        self.assertEqual(logs.mapped('credit_id'), ['TSTDSP-0', 'TSTDSP-0.2'])
+        self.assertEqual(logs.mapped('quantity'), [4, 2])
+        self.assertEqual(set(logs.mapped('server_no')), {3})
@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+"""
+Banc de mesure de bout en bout du dispatch des crédits distributeur
+
+Charge le registre Odoo d'une base de test, crée (une fois) un jeu de
+données BENCH (N boissons, M cocktails avec selected_combo_ingredient_ids,
+des barmans avec leur server_no) puis lance des barmans simulés en
+parallèle, un thread et un curseur par barman. Chaque barman enchaîne des
+appels à:
+
+    pos.session.envoyer_commande_distributeur
+    pos.session.send_credit_to_middleware
+    pos.session.cancel_simple_drink_credits
+    pos.session.cancel_cocktail_credits
+
+contre le simulateur Hart96 (tools/hart96_simulator.py, démarré dans le
+processus) ou un middleware donné par --middleware-url.
+
+Mesures: latence p50/p95/p99 par opération, crédits/s, requêtes SQL par
+appel (cr.sql_log_count) et allers-retours middleware par boisson. Les
+résultats sont écrits en JSON (--output) pour comparer les versions.
+
+À lancer sur une base dédiée, module installé:
+
+    python3 bench_dispatch.py -c /etc/odoo/odoo.conf -d bench \\
+        --drinks 20 --cocktails 10 --barmen 4 --orders 50 --output bench.json
+
+Le paramètre pos_distributeur.middleware_url est pointé sur le simulateur
+pendant la mesure puis restauré.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import odoo
+from odoo import api, SUPERUSER_ID
+from odoo.tools import config
+
+try:
+    from odoo.addons.pos_distributeur_boisson.tools.hart96_simulator import start_in_thread
+except ImportError:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from hart96_simulator import start_in_thread
+
+# Plages de PLU réservées au jeu de données BENCH
+DRINK_PLU_BASE = 9000
+INGREDIENT_PLU_BASE = 9500
+BENCH_PREFIX = 'BENCH'
+
+OPERATIONS = ('order', 'credit', 'cancel_drink', 'cancel_cocktail')
+
+
+def percentile(values, pct):
+    """Percentile par rang le plus proche (valeurs déjà triées)"""
+    if not values:
+        return None
+    rank = max(math.ceil(pct / 100.0 * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+# ----------------------------------------------------------------------
+# Jeu de données
+# ----------------------------------------------------------------------
+
+def seed(env, n_drinks, n_cocktails, n_barmen, ingredients_per_cocktail):
+    """Crée ou réutilise le jeu de données BENCH; retourne les ids utiles"""
+    Product = env['product.product']
+    Option = env['pos.combo.option']
+
+    drinks = Product.browse()
+    for i in range(n_drinks):
+        code = f'{BENCH_PREFIX}-DRINK-{i:03d}'
+        drink = Product.search([('default_code', '=', code)], limit=1)
+        if not drink:
+            drink = Product.create({
+                'name': f'Bench boisson {i:03d}',
+                'default_code': code,
+                'type': 'consu',
+                'available_in_pos': True,
+                'list_price': 3.0,
+                'plu_code': str(DRINK_PLU_BASE + i),
+                'is_distributeur_boisson': True,
+                'needs_distributor': True,
+            })
+        drinks |= drink
+
+    category = env['pos.combo.category'].search([('name', '=', f'{BENCH_PREFIX} Ingrédients')], limit=1)
+    if not category:
+        category = env['pos.combo.category'].create({'name': f'{BENCH_PREFIX} Ingrédients'})
+
+    options = Option.browse()
+    for i in range(ingredients_per_cocktail * 2):
+        code = f'{BENCH_PREFIX}-ING-{i:03d}'
+        ingredient = Product.search([('default_code', '=', code)], limit=1)
+        if not ingredient:
+            ingredient = Product.create({
+                'name': f'Bench ingrédient {i:03d}',
+                'default_code': code,
+                'type': 'consu',
+                'plu_code': str(INGREDIENT_PLU_BASE + i),
+                'is_distributeur_boisson': True,
+                'is_ingredient_only': True,
+            })
+        option = Option.search([('product_id', '=', ingredient.id), ('combo_category_id', '=', category.id)], limit=1)
+        if not option:
+            option = Option.create({
+                'name': ingredient.name,
+                'combo_category_id': category.id,
+                'product_id': ingredient.id,
+            })
+        options |= option
+
+    cocktails = Product.browse()
+    rnd = random.Random(42)
+    for i in range(n_cocktails):
+        code = f'{BENCH_PREFIX}-COCKTAIL-{i:03d}'
+        cocktail = Product.search([('default_code', '=', code)], limit=1)
+        if not cocktail:
+            selected = rnd.sample(options.ids, min(ingredients_per_cocktail, len(options)))
+            cocktail = Product.create({
+                'name': f'Bench cocktail {i:03d}',
+                'default_code': code,
+                'type': 'consu',
+                'available_in_pos': True,
+                'list_price': 8.0,
+                'is_distributeur_boisson': True,
+                'needs_distributor': True,
+                'is_combo_product': True,
+                'selected_combo_ingredient_ids': [(6, 0, selected)],
+            })
+        cocktails |= cocktail
+
+    barman_group = env.ref('pos_user_org.group_pos_barman')
+    users = env['res.users'].browse()
+    for i in range(n_barmen):
+        login = f'bench_barman_{i:02d}'
+        user = env['res.users'].with_context(active_test=False).search([('login', '=', login)], limit=1)
+        if not user:
+            user = env['res.users'].with_context(no_reset_password=True).create({
+                'name': f'Bench barman {i:02d}',
+                'login': login,
+                'groups_id': [(4, env.ref('base.group_user').id), (4, barman_group.id)],
+            })
+        if not user.employee_id:
+            env['hr.employee'].create({'name': user.name, 'user_id': user.id, 'server_no': i + 1})
+        users |= user
+
+    return {
+        'drinks': [{'id': p.id, 'name': p.name, 'plu_code': p.plu_code} for p in drinks],
+        'cocktails': [{'id': p.id, 'name': p.name} for p in cocktails],
+        'user_ids': users.ids,
+    }
+
+
+# ----------------------------------------------------------------------
+# Barmans simulés
+# ----------------------------------------------------------------------
+
+class Barman(threading.Thread):
+    """Un barman: un curseur, une suite d'opérations, une transaction par appel (comme une requête RPC)"""
+
+    def __init__(self, registry, uid, dataset, n_orders, mix, items_per_order, seed_value):
+        super().__init__(name=f'bench-barman-{uid}', daemon=True)
+        self.registry = registry
+        self.uid = uid
+        self.dataset = dataset
+        self.n_orders = n_orders
+        self.mix = mix
+        self.items_per_order = items_per_order
+        self.random = random.Random(seed_value)
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.exceptions = []
+
+    def _call(self, cr, name, func):
+        queries_before = cr.sql_log_count
+        start = time.perf_counter()
+        try:
+            result = func()
+            cr.commit()
+            ok = bool(result.get('success')) if isinstance(result, dict) else bool(result)
+        except Exception as e:
+            cr.rollback()
+            ok = False
+            self.exceptions.append(f'{name}: {e}')
+        elapsed = time.perf_counter() - start
+        self.samples[name].append((elapsed, cr.sql_log_count - queries_before))
+        if not ok:
+            self.errors[name] += 1
+
+    def run(self):
+        drinks = self.dataset['drinks']
+        cocktails = self.dataset['cocktails']
+        operations, weights = zip(*self.mix.items())
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, self.uid, {})
+            PosSession = env['pos.session']
+            for n in range(self.n_orders):
+                operation = self.random.choices(operations, weights)[0]
+                if operation == 'order':
+                    items = []
+                    for _i in range(self.items_per_order):
+                        if cocktails and self.random.random() < 0.4:
+                            product = self.random.choice(cocktails)
+                            items.append({'product_id': product['id'], 'quantity': 1, 'is_cocktail': True})
+                        elif drinks:
+                            product = self.random.choice(drinks)
+                            items.append({'product_id': product['id'], 'quantity': 1, 'is_cocktail': False})
+                    commande = {'order_id': f'BENCH-{self.uid}-{n}', 'items': items}
+                    self._call(cr, operation, lambda: PosSession.envoyer_commande_distributeur(commande))
+                elif operation == 'credit' and drinks:
+                    drink = self.random.choice(drinks)
+                    credit = {'plu_no': drink['plu_code'], 'quantity': 1, 'product_name': drink['name']}
+                    self._call(cr, operation, lambda: PosSession.send_credit_to_middleware(credit))
+                elif operation == 'cancel_drink' and drinks:
+                    drink = self.random.choice(drinks)
+                    self._call(cr, operation, lambda: PosSession.cancel_simple_drink_credits(False, drink['plu_code'], 1, drink['name']))
+                elif operation == 'cancel_cocktail' and cocktails:
+                    cocktail = self.random.choice(cocktails)
+                    self._call(cr, operation, lambda: PosSession.cancel_cocktail_credits(False, cocktail['id'], 1))
+
+
+# ----------------------------------------------------------------------
+# Mesure
+# ----------------------------------------------------------------------
+
+def _count_credit_logs(registry, user_ids):
+    with registry.cursor() as cr:
+        cr.execute("""
+            SELECT COUNT(*) FILTER (WHERE is_cancellation IS NOT TRUE),
+                   COUNT(*) FILTER (WHERE is_cancellation IS TRUE)
+              FROM pos_credit_log
+             WHERE user_id IN %s
+        """, [tuple(user_ids) or (0,)])
+        return cr.fetchone()
+
+
+def _set_params(registry, values):
+    """Écrit des paramètres système; retourne les anciennes valeurs"""
+    previous = {}
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        params = env['ir.config_parameter']
+        for key, value in values.items():
+            previous[key] = params.get_param(key)
+            params.set_param(key, value)
+    return previous
+
+
+def summarize(barmen, wall_time, credits_before, credits_after, simulator_before, simulator_after):
+    per_operation = {}
+    all_latencies = []
+    for name in OPERATIONS:
+        samples = [s for barman in barmen for s in barman.samples.get(name, [])]
+        if not samples:
+            continue
+        latencies = sorted(s[0] * 1000.0 for s in samples)
+        queries = [s[1] for s in samples]
+        all_latencies.extend(latencies)
+        per_operation[name] = {
+            'calls': len(samples),
+            'errors': sum(barman.errors.get(name, 0) for barman in barmen),
+            'latency_ms': {
+                'p50': round(percentile(latencies, 50), 2),
+                'p95': round(percentile(latencies, 95), 2),
+                'p99': round(percentile(latencies, 99), 2),
+                'mean': round(sum(latencies) / len(latencies), 2),
+                'max': round(latencies[-1], 2),
+            },
+            'sql_queries_per_call': {
+                'mean': round(sum(queries) / len(queries), 1),
+                'max': max(queries),
+            },
+        }
+
+    credits_sent = credits_after[0] - credits_before[0]
+    cancellations = credits_after[1] - credits_before[1]
+    totals = {
+        'wall_time_s': round(wall_time, 3),
+        'calls': sum(op['calls'] for op in per_operation.values()),
+        'credits_logged': credits_sent,
+        'cancellations_logged': cancellations,
+        'credits_per_second': round((credits_sent + cancellations) / wall_time, 2) if wall_time else None,
+        'calls_per_second': round(len(all_latencies) / wall_time, 2) if wall_time else None,
+    }
+    if simulator_before is not None:
+        requests = simulator_after['requests'] - simulator_before['requests']
+        frames = simulator_after['frames'] - simulator_before['frames']
+        totals.update({
+            'middleware_requests': requests,
+            'middleware_frames': frames,
+            'middleware_round_trips_per_drink': round(requests / frames, 3) if frames else None,
+            'frames_per_second': round(frames / wall_time, 2) if wall_time else None,
+        })
+    return per_operation, totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc de mesure du dispatch distributeur")
+    parser.add_argument('-c', '--config', help="Fichier de configuration Odoo")
+    parser.add_argument('-d', '--database', required=True, help="Base de test (module installé)")
+    parser.add_argument('--drinks', type=int, default=20)
+    parser.add_argument('--cocktails', type=int, default=10)
+    parser.add_argument('--ingredients-per-cocktail', type=int, default=3)
+    parser.add_argument('--barmen', type=int, default=4)
+    parser.add_argument('--orders', type=int, default=50, help="Opérations par barman")
+    parser.add_argument('--items-per-order', type=int, default=3)
+    parser.add_argument('--mix', default='order=6,credit=2,cancel_drink=1,cancel_cocktail=1',
+                        help="Pondération des opérations")
+    parser.add_argument('--middleware-url', help="Middleware existant (sinon simulateur dans le processus)")
+    parser.add_argument('--latency', type=float, default=5.0, help="Latence du simulateur (ms)")
+    parser.add_argument('--baudrate', type=int, default=9600, help="Débit série du simulateur (0 = illimité)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Taux d'erreur du simulateur")
+    parser.add_argument('--async-dispatch', action='store_true', help="Mesurer avec la file d'attente activée")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="Fichier JSON de résultats")
+    args = parser.parse_args(argv)
+
+    mix = {}
+    for part in args.mix.split(','):
+        name, _sep, weight = part.partition('=')
+        if name.strip() not in OPERATIONS:
+            parser.error(f"Opération inconnue dans --mix: {name}")
+        mix[name.strip()] = float(weight or 1)
+
+    odoo_args = ['-d', args.database, '--log-level=warn']
+    if args.config:
+        odoo_args = ['-c', args.config] + odoo_args
+    config.parse_config(odoo_args)
+    odoo.netsvc.init_logger()
+    registry = odoo.modules.registry.Registry(args.database)
+
+    server = None
+    middleware_url = args.middleware_url
+    if not middleware_url:
+        server, middleware_url = start_in_thread(latency_ms=args.latency, baudrate=args.baudrate, error_rate=args.error_rate)
+
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        dataset = seed(env, args.drinks, args.cocktails, args.barmen, args.ingredients_per_cocktail)
+
+    previous_params = _set_params(registry, {
+        'pos_distributeur.middleware_url': middleware_url,
+        'pos_distributeur.async_dispatch': 'True' if args.async_dispatch else False,
+    })
+    try:
+        barmen = [
+            Barman(registry, uid, dataset, args.orders, mix, args.items_per_order, args.seed + i)
+            for i, uid in enumerate(dataset['user_ids'])
+        ]
+        credits_before = _count_credit_logs(registry, dataset['user_ids'])
+        simulator_before = dict(server.simulator.stats) if server else None
+        start = time.perf_counter()
+        for barman in barmen:
+            barman.start()
+        for barman in barmen:
+            barman.join()
+        wall_time = time.perf_counter() - start
+        simulator_after = dict(server.simulator.stats) if server else None
+        credits_after = _count_credit_logs(registry, dataset['user_ids'])
+    finally:
+        _set_params(registry, {key: value or False for key, value in previous_params.items()})
+        if server:
+            server.shutdown()
+
+    per_operation, totals = summarize(barmen, wall_time, credits_before, credits_after, simulator_before, simulator_after)
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': _git_revision(),
+            'database': args.database,
+            'middleware': 'simulator' if server else middleware_url,
+            'args': vars(args),
+        },
+        'operations': per_operation,
+        'totals': totals,
+        'exceptions': [e for barman in barmen for e in barman.exceptions][:20],
+    }
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
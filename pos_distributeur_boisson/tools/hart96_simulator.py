@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+Simulateur du middleware Hart96 pour les tests de charge en local
+
+Implémente les routes utilisées par MiddlewareClient:
+
+    POST /api/connect        ouvre la "session série"
+    POST /api/disconnect     ferme la session série
+    POST /api/send-credit    une trame {server_no, plu_no, sign, quantity[, credit_id]}
+    POST /api/send-credits   un lot {"credits": [trame, ...]}
+    GET  /api/status         {"connected", "port", "baudrate"}
+
+et deux routes propres au simulateur:
+
+    GET  /api/counters       compteurs par server_no / PLU et statistiques
+    POST /api/reset          remise à zéro des compteurs
+
+La liaison série est modélisée par un verrou unique: chaque trame l'occupe
+le temps de transmettre frame_bytes octets à baudrate bauds (10 bits par
+octet, 8N1), ce qui plafonne le débit comme le vrai boîtier. Les crédits
+portant un credit_id déjà servi sont acquittés sans être recomptés.
+
+Aucune dépendance hors bibliothèque standard:
+
+    python3 hart96_simulator.py --port 5000 --latency 20 --error-rate 0.02
+
+Ctrl+C arrête le serveur et affiche les compteurs (ou les écrit dans
+--dump-file).
+"""
+
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_logger = logging.getLogger('hart96_simulator')
+
+DEFAULT_PORT = 5000
+DEFAULT_BAUDRATE = 9600
+# Taille approximative d'une trame Hart96 (en-tête, server_no, PLU, signe, quantité, CRC)
+DEFAULT_FRAME_BYTES = 16
+# Nombre de credit_id mémorisés pour l'idempotence
+MAX_SEEN_CREDIT_IDS = 100000
+
+
+class Hart96Simulator:
+    """État du boîtier simulé: session série, compteurs par PLU, idempotence"""
+
+    def __init__(self, latency_ms=0.0, latency_jitter_ms=0.0, baudrate=DEFAULT_BAUDRATE,
+                 frame_bytes=DEFAULT_FRAME_BYTES, error_rate=0.0, require_connect=False,
+                 serial_port='COM1', seed=None):
+        self.latency = latency_ms / 1000.0
+        self.latency_jitter = latency_jitter_ms / 1000.0
+        self.baudrate = baudrate
+        self.frame_bytes = frame_bytes
+        self.error_rate = error_rate
+        self.require_connect = require_connect
+        self.serial_port = serial_port
+        self._random = random.Random(seed)
+        self._serial_line = threading.Lock()
+        self._lock = threading.Lock()
+        self.reset()
+
+    @property
+    def frame_time(self):
+        """Durée (s) d'occupation de la liaison série par une trame"""
+        if not self.baudrate:
+            return 0.0
+        return self.frame_bytes * 10.0 / self.baudrate
+
+    def reset(self):
+        with self._lock:
+            self.connected = False
+            self.counters = defaultdict(lambda: {'credits': 0, 'debits': 0, 'net_quantity': 0})
+            self.seen_credit_ids = {}
+            self.stats = {
+                'requests': 0,
+                'frames': 0,
+                'duplicates': 0,
+                'injected_errors': 0,
+                'connects': 0,
+                'disconnects': 0,
+                'started_at': time.time(),
+            }
+
+    # ------------------------------------------------------------------
+    # Comportement du boîtier
+    # ------------------------------------------------------------------
+
+    def request_delay(self):
+        """Latence réseau/traitement simulée d'une requête"""
+        delay = self.latency
+        if self.latency_jitter:
+            delay += self._random.uniform(0, self.latency_jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def should_fail(self):
+        if self.error_rate and self._random.random() < self.error_rate:
+            with self._lock:
+                self.stats['injected_errors'] += 1
+            return True
+        return False
+
+    def connect(self, port=None, baudrate=None):
+        with self._lock:
+            self.connected = True
+            self.stats['connects'] += 1
+        return {'success': True, 'message': f'Connecté à {port or self.serial_port}'}
+
+    def disconnect(self):
+        with self._lock:
+            self.connected = False
+            self.stats['disconnects'] += 1
+        return {'success': True, 'message': 'Déconnecté'}
+
+    def status(self):
+        return {
+            'connected': self.connected,
+            'port': self.serial_port,
+            'baudrate': self.baudrate,
+            'simulator': True,
+        }
+
+    def send_frame(self, frame, idempotency_key=None):
+        """Transmet une trame sur la liaison série simulée et met à jour les compteurs"""
+        try:
+            server_no = int(frame['server_no'])
+            plu_no = int(frame['plu_no'])
+            quantity = int(frame.get('quantity', 1))
+            sign = frame.get('sign', '+')
+        except (KeyError, TypeError, ValueError) as e:
+            return {'success': False, 'error': f'Trame invalide: {e}'}
+        if sign not in ('+', '-'):
+            return {'success': False, 'error': f'Signe invalide: {sign}'}
+        if self.require_connect and not self.connected:
+            return {'success': False, 'error': 'Port série non connecté'}
+
+        credit_id = frame.get('credit_id') or idempotency_key
+        if credit_id:
+            with self._lock:
+                if credit_id in self.seen_credit_ids:
+                    self.stats['duplicates'] += 1
+                    return {'success': True, 'message': 'OK', 'duplicate': True, 'credit_id': credit_id}
+
+        if self.should_fail():
+            return {'success': False, 'error': 'Erreur série simulée'}
+
+        # Une seule trame à la fois sur la liaison série
+        with self._serial_line:
+            if self.frame_time:
+                time.sleep(self.frame_time)
+
+        with self._lock:
+            if credit_id:
+                if len(self.seen_credit_ids) >= MAX_SEEN_CREDIT_IDS:
+                    self.seen_credit_ids.pop(next(iter(self.seen_credit_ids)))
+                self.seen_credit_ids[credit_id] = True
+            counter = self.counters[(server_no, plu_no)]
+            if sign == '+':
+                counter['credits'] += quantity
+                counter['net_quantity'] += quantity
+            else:
+                counter['debits'] += quantity
+                counter['net_quantity'] -= quantity
+            self.stats['frames'] += 1
+        result = {'success': True, 'message': 'OK'}
+        if credit_id:
+            result['credit_id'] = credit_id
+        return result
+
+    def dump(self):
+        """Compteurs par server_no / PLU et statistiques globales"""
+        with self._lock:
+            elapsed = max(time.time() - self.stats['started_at'], 1e-9)
+            return {
+                'stats': dict(self.stats, frames_per_second=round(self.stats['frames'] / elapsed, 2)),
+                'counters': [
+                    dict(counter, server_no=server_no, plu_no=plu_no)
+                    for (server_no, plu_no), counter in sorted(self.counters.items())
+                ],
+            }
+
+
+class Hart96RequestHandler(BaseHTTPRequestHandler):
+    server_version = 'Hart96Simulator/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def simulator(self):
+        return self.server.simulator
+
+    def log_message(self, format, *args):
+        _logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError:
+            return None
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        with self.simulator._lock:
+            self.simulator.stats['requests'] += 1
+        if self.path == '/api/status':
+            self.simulator.request_delay()
+            self._send_json(200, self.simulator.status())
+        elif self.path == '/api/counters':
+            self._send_json(200, self.simulator.dump())
+        else:
+            self._send_json(404, {'success': False, 'error': 'Route inconnue'})
+
+    def do_POST(self):
+        with self.simulator._lock:
+            self.simulator.stats['requests'] += 1
+        payload = self._read_json()
+        if payload is None:
+            self._send_json(400, {'success': False, 'error': 'JSON invalide'})
+            return
+
+        if self.path == '/api/reset':
+            self.simulator.reset()
+            self._send_json(200, {'success': True})
+            return
+
+        self.simulator.request_delay()
+        if self.path == '/api/connect':
+            self._send_json(200, self.simulator.connect(payload.get('port'), payload.get('baudrate')))
+        elif self.path == '/api/disconnect':
+            self._send_json(200, self.simulator.disconnect())
+        elif self.path == '/api/send-credit':
+            if self.simulator.should_fail():
+                self._send_json(500, {'success': False, 'error': 'Erreur middleware simulée'})
+                return
+            self._send_json(200, self.simulator.send_frame(payload, self.headers.get('Idempotency-Key')))
+        elif self.path == '/api/send-credits':
+            frames = payload.get('credits')
+            if not isinstance(frames, list):
+                self._send_json(400, {'success': False, 'error': 'Champ "credits" manquant'})
+                return
+            if self.simulator.should_fail():
+                self._send_json(500, {'success': False, 'error': 'Erreur middleware simulée'})
+                return
+            results = [self.simulator.send_frame(frame) for frame in frames]
+            self._send_json(200, {'success': all(r['success'] for r in results), 'results': results})
+        else:
+            self._send_json(404, {'success': False, 'error': 'Route inconnue'})
+
+
+def make_server(host='127.0.0.1', port=DEFAULT_PORT, **simulator_options):
+    """Crée le serveur HTTP du simulateur (à lancer avec serve_forever())"""
+    server = ThreadingHTTPServer((host, port), Hart96RequestHandler)
+    server.daemon_threads = True
+    server.simulator = Hart96Simulator(**simulator_options)
+    return server
+
+
+def start_in_thread(host='127.0.0.1', port=0, **simulator_options):
+    """
+    Démarre le simulateur dans un thread (port 0 = port libre)
+
+    Returns:
+        tuple: (server, url) — appeler server.shutdown() pour l'arrêter
+    """
+    server = make_server(host, port, **simulator_options)
+    thread = threading.Thread(target=server.serve_forever, name='hart96-simulator', daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulateur du middleware Hart96")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--latency', type=float, default=0.0, help="Latence fixe par requête (ms)")
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help="Latence aléatoire ajoutée (ms, uniforme)")
+    parser.add_argument('--baudrate', type=int, default=DEFAULT_BAUDRATE, help="Débit série simulé (0 = illimité)")
+    parser.add_argument('--frame-bytes', type=int, default=DEFAULT_FRAME_BYTES, help="Taille d'une trame Hart96 (octets)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Proportion de requêtes/trames en erreur (0-1)")
+    parser.add_argument('--require-connect', action='store_true', help="Refuser les trames sans /api/connect préalable")
+    parser.add_argument('--seed', type=int, default=None, help="Graine pour l'injection d'erreurs")
+    parser.add_argument('--dump-file', default=None, help="Écrire les compteurs JSON dans ce fichier à l'arrêt")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    server = make_server(
+        args.host, args.port,
+        latency_ms=args.latency,
+        latency_jitter_ms=args.latency_jitter,
+        baudrate=args.baudrate,
+        frame_bytes=args.frame_bytes,
+        error_rate=args.error_rate,
+        require_connect=args.require_connect,
+        seed=args.seed,
+    )
+    simulator = server.simulator
+    _logger.info(
+        f"Simulateur Hart96 sur http://{args.host}:{server.server_address[1]} "
+        f"({args.baudrate or 'illimité'} bauds, {simulator.frame_time * 1000:.1f} ms/trame, "
+        f"latence {args.latency} ms, erreurs {args.error_rate:.0%})"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        dump = json.dumps(simulator.dump(), indent=2)
+        if args.dump_file:
+            with open(args.dump_file, 'w', encoding='utf-8') as f:
+                f.write(dump)
+            _logger.info(f"Compteurs écrits dans {args.dump_file}")
+        else:
+            print(dump)
+
+
+if __name__ == '__main__':
+    main()
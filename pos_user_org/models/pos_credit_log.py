@@ -1,10 +1,88 @@
 # -*- coding: utf-8 -*-
+import logging
+from datetime import date, timedelta
+
+from dateutil.relativedelta import relativedelta
+
 from odoo import models, fields, api
 
+_logger = logging.getLogger(__name__)
+
+# Index des recherches fréquentes (annulations, idempotence), créés par init().
+# Partiels sur les crédits encore annulables et couvrants (id compris): les
+# recherches de l'ORM, qui ne lisent que l'id, restent en Index Only Scan
+# quelle que soit la taille du journal. {table} permet de les reproduire sur
+# une table de mesure (tools/bench_credit_log_plans.py).
+CREDIT_LOG_INDEXES = {
+    # cancel_simple_drink_credits / cancel_cocktail_credits
+    'session_plu_active': "(session_id, plu_no, create_date DESC, id DESC) WHERE status = 'sent' AND remaining_quantity > 0",
+    # PosOrderLine._get_active_credits_by_line (suppression, réduction de quantité)
+    'order_line_active': "(order_line_id, create_date DESC, id DESC) WHERE status = 'sent' AND remaining_quantity > 0",
+    # Recherche par credit_id (crédit d'origine et ses annulations)
+    'credit_id_cover': "(credit_id) INCLUDE (create_date, id, is_cancellation, status) WHERE credit_id IS NOT NULL",
+    # Filtres par date de la vue liste, sélection des lignes à archiver
+    'create_date': "(create_date)",
+    # Sessions fermées restant à consolider (_cron_rollup_closed_sessions)
+    'rollup_pending': "(session_id) WHERE rolled_up IS NOT TRUE",
+}
+
+# Rétention (ir.config_parameter pos_user_org.<clé>, en jours / mois, 0 = jamais)
+DEFAULT_PAYLOAD_RETENTION_DAYS = 90
+DEFAULT_ARCHIVE_AFTER_DAYS = 365
+DEFAULT_ARCHIVE_RETENTION_MONTHS = 0
+
+ROLLUP_SESSION_BATCH = 50
+MAINTENANCE_BATCH_SIZE = 10000
+
+# Archive froide: table partitionnée par mois hors ORM. Les réponses brutes
+# du middleware n'y sont pas reprises (purgées avant l'archivage).
+ARCHIVE_TABLE = 'pos_credit_log_archive'
+ARCHIVE_COLUMNS = (
+    ('id', 'integer NOT NULL'),
+    ('create_date', 'timestamp NOT NULL'),
+    ('user_id', 'integer'),
+    ('employee_id', 'integer'),
+    ('session_id', 'integer'),
+    ('config_id', 'integer'),
+    ('order_ref', 'varchar'),
+    ('product_name', 'varchar'),
+    ('plu_no', 'varchar'),
+    ('quantity', 'integer'),
+    ('server_no', 'integer'),
+    ('success', 'boolean'),
+    ('status', 'varchar'),
+    ('is_cancellation', 'boolean'),
+    ('credit_id', 'varchar'),
+    ('message', 'varchar'),
+    ('cancelled_at', 'timestamp'),
+    ('cancelled_by', 'integer'),
+    ('duration_total_ms', 'numeric'),
+)
+
+
+def create_credit_log_indexes(cr, table='pos_credit_log'):
+    """Crée les index de CREDIT_LOG_INDEXES s'ils n'existent pas (idempotent)"""
+    for name, definition in CREDIT_LOG_INDEXES.items():
+        cr.execute(f"CREATE INDEX IF NOT EXISTS {table}_{name}_idx ON {table} {definition}")
+
+
+def create_credit_id_unique_index(cr, table='pos_credit_log'):
+    """
+    Un credit_id ne peut être journalisé qu'une fois comme envoi
+    (les lignes d'annulation reprennent l'ID du crédit d'origine)
+    """
+    cr.execute(f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS {table}_credit_id_sent_uniq
+            ON {table} (credit_id)
+         WHERE credit_id IS NOT NULL AND is_cancellation IS NOT TRUE
+    """)
+
+
 class PosCreditLog(models.Model):
     _name = 'pos.credit.log'
     _description = 'Journal des crédits POS envoyés au middleware'
-    _order = 'create_date desc'
+    # Même ordre que create_date desc, mais servi par la clé primaire
+    _order = 'id desc'
 
     user_id = fields.Many2one('res.users', string='Utilisateur', required=True, index=True, default=lambda self: self.env.user)
     employee_id = fields.Many2one('hr.employee', string='Employé', index=True, compute='_compute_employee', store=True)
@@ -13,6 +91,12 @@ class PosCreditLog(models.Model):
     product_name = fields.Char(string='Produit')
     plu_no = fields.Char(string='PLU')
     quantity = fields.Integer(string='Quantité', default=1)
+    remaining_quantity = fields.Integer(
+        string='Quantité restante',
+        help='Unités de ce crédit encore annulables. Une annulation partielle la décrémente; '
+             'la ligne passe en Annulé quand elle tombe à 0.',
+        default=0
+    )
     server_no = fields.Integer(string='Server No')
     success = fields.Boolean(string='Succès', default=False)
     message = fields.Char(string='Message')
@@ -52,8 +136,9 @@ class PosCreditLog(models.Model):
     
     credit_id = fields.Char(
         string='ID Crédit',
-        help='Identifiant unique du crédit pour traçabilité',
-        index=True
+        help='Identifiant unique du crédit, envoyé au middleware comme clé d\'idempotence. '
+             'Les lignes d\'annulation reprennent l\'ID du crédit annulé.',
+        index=False  # pos_credit_log_credit_id_cover_idx (init)
     )
     
     is_cancellation = fields.Boolean(
@@ -62,6 +147,39 @@ class PosCreditLog(models.Model):
         default=False
     )
     
+    # Temps de traitement par étape (ms), moyennés dans les vues graphe/pivot
+    duration_lookup_ms = fields.Float(string='Recherche produit (ms)', digits=(16, 2), group_operator='avg')
+    duration_server_no_ms = fields.Float(string='Server No (ms)', digits=(16, 2), group_operator='avg')
+    duration_connect_ms = fields.Float(string='Connexion (ms)', digits=(16, 2), group_operator='avg')
+    duration_send_ms = fields.Float(string='Envoi (ms)', digits=(16, 2), group_operator='avg')
+    duration_disconnect_ms = fields.Float(string='Déconnexion (ms)', digits=(16, 2), group_operator='avg')
+    duration_log_ms = fields.Float(string='Journalisation (ms)', digits=(16, 2), group_operator='avg')
+    duration_total_ms = fields.Float(string='Durée totale (ms)', digits=(16, 2), group_operator='avg')
+
+    is_slow = fields.Boolean(
+        string='Lent',
+        help='Durée totale au-delà du seuil pos_distributeur.slow_credit_threshold_ms',
+        default=False,
+        index=True
+    )
+
+    middleware_url = fields.Char(string='Middleware')
+
+    config_id = fields.Many2one(
+        'pos.config',
+        string='Terminal',
+        related='session_id.config_id',
+        store=True,
+        index=True
+    )
+
+    rolled_up = fields.Boolean(
+        string='Consolidé',
+        help='Ligne reprise dans la synthèse journalière (pos.credit.log.daily)',
+        default=False,
+        readonly=True
+    )
+
     # Champ calculé pour affichage coloré dans les vues
     status_display = fields.Char(
         string='Statut Visuel',
@@ -69,6 +187,306 @@ class PosCreditLog(models.Model):
         store=False
     )
 
+    def init(self):
+        # Doublons d'avant l'index unique (IDs courts 'CRED-' + 8 hex): le plus
+        # ancien garde son ID, les suivants prennent le suffixe -<id>
+        self.env.cr.execute("""
+            UPDATE pos_credit_log l
+               SET credit_id = l.credit_id || '-' || l.id
+              FROM (
+                    SELECT id, row_number() OVER (PARTITION BY credit_id ORDER BY id) AS rn
+                      FROM pos_credit_log
+                     WHERE credit_id IS NOT NULL AND is_cancellation IS NOT TRUE
+                   ) d
+             WHERE d.id = l.id AND d.rn > 1
+        """)
+        if self.env.cr.rowcount:
+            _logger.warning("%s credit_id en double renommé(s) avant l'index unique", self.env.cr.rowcount)
+        create_credit_id_unique_index(self.env.cr)
+        # Crédits journalisés avant la quantité restante: tout reste annulable
+        self.env.cr.execute("""
+            UPDATE pos_credit_log
+               SET remaining_quantity = quantity
+             WHERE status = 'sent' AND is_cancellation IS NOT TRUE
+               AND (remaining_quantity IS NULL OR remaining_quantity = 0)
+               AND cancelled_at IS NULL
+        """)
+        create_credit_log_indexes(self.env.cr)
+        # Remplacé par pos_credit_log_credit_id_cover_idx
+        self.env.cr.execute("DROP INDEX IF EXISTS pos_credit_log__credit_id_index")
+        columns = ",\n                ".join(f"{name} {definition}" for name, definition in ARCHIVE_COLUMNS)
+        self.env.cr.execute(f"""
+            CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE} (
+                {columns},
+                PRIMARY KEY (create_date, id)
+            ) PARTITION BY RANGE (create_date)
+        """)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        for vals in vals_list:
+            if 'remaining_quantity' not in vals and vals.get('status', 'sent') == 'sent' and not vals.get('is_cancellation'):
+                vals['remaining_quantity'] = vals.get('quantity', 1)
+        return super().create(vals_list)
+
+    def _allocate_quantity(self, quantity):
+        """
+        Répartit `quantity` unités à annuler sur ces crédits, dans l'ordre du recordset
+
+        Returns:
+            list: [(pos.credit.log, unités)], sans rien écrire
+        """
+        allocations = []
+        left = int(quantity or 0)
+        for credit in self:
+            if left <= 0:
+                break
+            units = min(credit.remaining_quantity, left)
+            if units > 0 and credit.status == 'sent':
+                allocations.append((credit, units))
+                left -= units
+        return allocations
+
+    @api.model
+    def _consume_allocations(self, allocations, cancel_vals):
+        """
+        Décrémente la quantité restante des crédits annulés
+
+        Les crédits épuisés passent en 'cancelled' (avec cancel_vals) en une
+        écriture; les autres gardent leur statut, une écriture par quantité
+        restante.
+        """
+        exhausted = []
+        partial = {}
+        for credit, units in allocations:
+            remaining = credit.remaining_quantity - units
+            if remaining <= 0:
+                exhausted.append(credit.id)
+            else:
+                partial.setdefault(remaining, []).append(credit.id)
+        if exhausted:
+            self.browse(exhausted).write(dict(cancel_vals, status='cancelled', remaining_quantity=0))
+        for remaining, ids in partial.items():
+            self.browse(ids).write({'remaining_quantity': remaining})
+
+    # ------------------------------------------------------------------
+    # Consolidation, purge et archivage (cron quotidien)
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _get_retention_params(self):
+        params = self.env['ir.config_parameter'].sudo()
+
+        def _int(key, default):
+            try:
+                return max(int(params.get_param(f'pos_user_org.{key}', default)), 0)
+            except (TypeError, ValueError):
+                return default
+
+        return {
+            'payload_retention_days': _int('credit_log_payload_retention_days', DEFAULT_PAYLOAD_RETENTION_DAYS),
+            'archive_after_days': _int('credit_log_archive_after_days', DEFAULT_ARCHIVE_AFTER_DAYS),
+            'archive_retention_months': _int('credit_log_archive_retention_months', DEFAULT_ARCHIVE_RETENTION_MONTHS),
+        }
+
+    @api.model
+    def _cron_rollup_and_archive(self, limit_batches=None):
+        """
+        Maintenance quotidienne du journal des crédits
+
+        1. Consolide les sessions fermées dans pos.credit.log.daily
+        2. Efface les réponses brutes du middleware au-delà de la rétention
+        3. Déplace les lignes consolidées anciennes vers l'archive mensuelle
+        4. Supprime les partitions d'archive au-delà de leur rétention
+
+        Chaque lot est validé séparément: un passage interrompu reprend là
+        où il s'est arrêté.
+        """
+        params = self._get_retention_params()
+        self.flush_model()
+        sessions = self._cron_rollup_closed_sessions(limit_batches)
+        purged = self._purge_payloads(params['payload_retention_days'], limit_batches)
+        archived = self._archive_rolled_up(params['archive_after_days'], limit_batches)
+        dropped = self._drop_archive_partitions(params['archive_retention_months'])
+        _logger.info(
+            "🗄️ Journal des crédits: %s session(s) consolidée(s), %s réponse(s) purgée(s), "
+            "%s ligne(s) archivée(s), %s partition(s) supprimée(s)",
+            sessions, purged, archived, dropped
+        )
+        return {'sessions': sessions, 'purged': purged, 'archived': archived, 'dropped_partitions': dropped}
+
+    @api.model
+    def _cron_rollup_closed_sessions(self, limit_batches=None):
+        """Consolide, par lots de sessions, les crédits des sessions fermées"""
+        batches = 0
+        sessions = 0
+        while limit_batches is None or batches < limit_batches:
+            self.env.cr.execute("""
+                SELECT DISTINCT log.session_id
+                  FROM pos_credit_log log
+                  JOIN pos_session session ON session.id = log.session_id
+                 WHERE log.rolled_up IS NOT TRUE AND session.state = 'closed'
+                 LIMIT %s
+            """, [ROLLUP_SESSION_BATCH])
+            session_ids = [row[0] for row in self.env.cr.fetchall()]
+            if not session_ids:
+                break
+            self._rollup_sessions(session_ids)
+            self.env.cr.commit()
+            sessions += len(session_ids)
+            batches += 1
+        return sessions
+
+    @api.model
+    def _rollup_sessions(self, session_ids):
+        """
+        Ajoute les crédits non consolidés de ces sessions à la synthèse journalière
+
+        Un seul _read_group par lot, regroupé par jour, terminal, PLU et
+        server_no; les lignes de synthèse existantes sont incrémentées.
+        """
+        domain = [('session_id', 'in', session_ids), ('rolled_up', '=', False)]
+        groups = self._read_group(
+            domain,
+            ['create_date:day', 'config_id', 'plu_no', 'server_no', 'is_cancellation', 'success'],
+            ['__count', 'quantity:sum', 'duration_total_ms:sum', 'product_name:max'],
+        )
+        totals = {}
+        for day, config, plu_no, server_no, is_cancellation, success, count, quantity, duration, product_name in groups:
+            key = (fields.Date.to_date(day), config.id or False, plu_no or False, server_no or 0)
+            total = totals.setdefault(key, {
+                'product_name': False, 'credit_count': 0, 'quantity_sent': 0, 'cancellation_count': 0,
+                'quantity_cancelled': 0, 'failure_count': 0, 'duration_total_sum_ms': 0.0,
+            })
+            if not success:
+                total['failure_count'] += count
+            elif is_cancellation:
+                total['cancellation_count'] += count
+                total['quantity_cancelled'] += quantity or 0
+            else:
+                total['credit_count'] += count
+                total['quantity_sent'] += quantity or 0
+                total['duration_total_sum_ms'] += duration or 0.0
+                total['product_name'] = product_name or total['product_name']
+
+        Daily = self.env['pos.credit.log.daily'].sudo()
+        existing = {
+            (rec.date, rec.config_id.id or False, rec.plu_no or False, rec.server_no or 0): rec
+            for rec in Daily.search([('date', 'in', list({key[0] for key in totals}))])
+        }
+        create_vals = []
+        for key, total in totals.items():
+            rec = existing.get(key)
+            if rec:
+                rec.write({
+                    name: (rec[name] + value) if name != 'product_name' else (value or rec.product_name)
+                    for name, value in total.items()
+                })
+            else:
+                day, config_id, plu_no, server_no = key
+                create_vals.append(dict(total, date=day, config_id=config_id, plu_no=plu_no, server_no=server_no))
+        if create_vals:
+            Daily.create(create_vals)
+        self.sudo().search(domain).write({'rolled_up': True})
+        _logger.debug("📊 %s session(s) consolidée(s) en %s ligne(s) de synthèse", len(session_ids), len(totals))
+
+    @api.model
+    def _purge_payloads(self, retention_days, limit_batches=None):
+        """Efface les réponses brutes du middleware des lignes consolidées plus anciennes que retention_days"""
+        if not retention_days:
+            return 0
+        cutoff = fields.Datetime.now() - timedelta(days=retention_days)
+        batches = 0
+        purged = 0
+        while limit_batches is None or batches < limit_batches:
+            self.env.cr.execute("""
+                UPDATE pos_credit_log
+                   SET response_payload = NULL, cancellation_response = NULL
+                 WHERE id IN (
+                    SELECT id FROM pos_credit_log
+                     WHERE rolled_up AND create_date < %s
+                       AND (response_payload IS NOT NULL OR cancellation_response IS NOT NULL)
+                     LIMIT %s
+                 )
+            """, [cutoff, MAINTENANCE_BATCH_SIZE])
+            if not self.env.cr.rowcount:
+                break
+            purged += self.env.cr.rowcount
+            self.env.cr.commit()
+            batches += 1
+        self.invalidate_model(['response_payload', 'cancellation_response'])
+        return purged
+
+    @api.model
+    def _archive_rolled_up(self, archive_after_days, limit_batches=None):
+        """Déplace les lignes consolidées plus anciennes que archive_after_days vers l'archive mensuelle"""
+        if not archive_after_days:
+            return 0
+        cutoff = fields.Datetime.now() - timedelta(days=archive_after_days)
+        columns = ", ".join(name for name, _definition in ARCHIVE_COLUMNS)
+        batches = 0
+        archived = 0
+        while limit_batches is None or batches < limit_batches:
+            self.env.cr.execute("""
+                SELECT id, date_trunc('month', create_date)::date
+                  FROM pos_credit_log
+                 WHERE rolled_up AND create_date < %s
+                 ORDER BY create_date
+                 LIMIT %s
+            """, [cutoff, MAINTENANCE_BATCH_SIZE])
+            rows = self.env.cr.fetchall()
+            if not rows:
+                break
+            for month in sorted({month for _id, month in rows}):
+                self._ensure_archive_partition(month)
+            self.env.cr.execute(f"""
+                WITH moved AS (
+                    DELETE FROM pos_credit_log WHERE id = ANY(%s)
+                    RETURNING {columns}
+                )
+                INSERT INTO {ARCHIVE_TABLE} ({columns}) SELECT {columns} FROM moved
+            """, [[row[0] for row in rows]])
+            archived += self.env.cr.rowcount
+            self.env.cr.commit()
+            batches += 1
+        self.invalidate_model()
+        return archived
+
+    @api.model
+    def _ensure_archive_partition(self, month):
+        """Crée la partition mensuelle de l'archive (pos_credit_log_archive_AAAA_MM) si besoin"""
+        month = date(month.year, month.month, 1)
+        self.env.cr.execute(f"""
+            CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE}_{month:%Y_%m}
+                PARTITION OF {ARCHIVE_TABLE}
+                FOR VALUES FROM (%s) TO (%s)
+        """, [month, month + relativedelta(months=1)])
+
+    @api.model
+    def _drop_archive_partitions(self, retention_months):
+        """Supprime les partitions d'archive entièrement antérieures à retention_months"""
+        if not retention_months:
+            return 0
+        cutoff = fields.Date.today().replace(day=1) - relativedelta(months=retention_months)
+        self.env.cr.execute("""
+            SELECT child.relname
+              FROM pg_inherits
+              JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+              JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+             WHERE parent.relname = %s
+        """, [ARCHIVE_TABLE])
+        dropped = 0
+        for (partition,) in self.env.cr.fetchall():
+            try:
+                year, month = map(int, partition[len(ARCHIVE_TABLE) + 1:].split('_'))
+            except ValueError:
+                continue
+            if date(year, month, 1) + relativedelta(months=1) <= cutoff:
+                self.env.cr.execute(f'DROP TABLE "{partition}"')
+                _logger.info("🗑️ Partition d'archive %s supprimée", partition)
+                dropped += 1
+        return dropped
+
     @api.depends('status', 'is_cancellation')
     def _compute_status_display(self):
         """Calcule l'affichage visuel du statut"""